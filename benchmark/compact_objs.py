@@ -0,0 +1,52 @@
+#!usr/bin/env python3
+# -*- coding:utf-8 -*-
+__author__ = 'mayanqiong'
+
+"""
+Quote 与 CompactQuote (TqApi(_compact_objs=True) 时使用) 的内存占用及访问耗时
+
+每个合约合并一次行情 diff 之后，用 tracemalloc 统计平均每个合约占用的内存，并统计遍历全部字段及按 key 取单个字段的耗时。
+
+用法: python benchmark/compact_objs.py [合约数量]
+"""
+
+import sys
+import time
+import tracemalloc
+
+from tqsdk.diff import _merge_diff, _get_obj
+from tqsdk.entity import Entity
+from tqsdk.objs import Quote, CompactQuote
+
+
+def run(quote_cls, n_quotes):
+    prototype = {"quotes": {"#": quote_cls(None)}}
+    data = Entity()
+    data._instance_entity([])
+    tracemalloc.start()
+    quotes = [_get_obj(data, ["quotes", f"SHFE.cu{i}"], prototype["quotes"]["#"]) for i in range(n_quotes)]
+    _merge_diff(data, {"quotes": {f"SHFE.cu{i}": {"last_price": 1.0 * i, "volume": i, "datetime": "2021-01-04 09:00:00.000000"}
+                                  for i in range(n_quotes)}}, prototype, persist=False)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    start = time.perf_counter()
+    for q in quotes:
+        for _ in q.items():
+            pass
+    items_cost = time.perf_counter() - start
+    start = time.perf_counter()
+    for q in quotes:
+        q["last_price"]
+    getitem_cost = time.perf_counter() - start
+    print(f"{quote_cls.__name__:12s}: 每个合约 {memory / n_quotes:6.0f} bytes, "
+          f"遍历字段 {1e6 * items_cost / n_quotes:6.2f}us/合约, 取单个字段 {1e9 * getitem_cost / n_quotes:6.0f}ns")
+
+
+def main():
+    n_quotes = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    for quote_cls in (Quote, CompactQuote):
+        run(quote_cls, n_quotes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+#!usr/bin/env python3
+# -*- coding:utf-8 -*-
+__author__ = 'mayanqiong'
+
+"""
+is_changing 的耗时
+
+_merge_diff 在合并 diff 时收集有变更的节点路径 (diff_paths)，is_changing 查表判断，
+与之前遍历每个 diff 调用 _is_key_exist 的方式对比，并检查两种方式的结果一致。
+
+用法: python benchmark/is_changing.py [合约数量] [每次 wait_update 收到的 diff 个数]
+"""
+
+import random
+import sys
+import time
+
+from tqsdk.diff import _merge_diff, _is_key_exist, _is_path_changing
+from tqsdk.entity import Entity
+from tqsdk.objs import Quote
+
+
+def main():
+    n_quotes = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    n_diffs = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    rnd = random.Random(0)
+    prototype = {"quotes": {"#": Quote(None)}}
+    symbols = [f"SHFE.cu{i}" for i in range(n_quotes)]
+    data = Entity()
+    data._instance_entity([])
+    _merge_diff(data, {"quotes": {s: {"last_price": 0.0} for s in symbols}}, prototype, persist=False)
+
+    diffs, diff_paths = [], {}
+    for i in range(n_diffs):
+        diff = {"quotes": {s: {"last_price": float(i), "volume": i} for s in rnd.sample(symbols, n_quotes // 10)}}
+        _merge_diff(data, diff, prototype, persist=False, reduce_diff=True, diff_paths=diff_paths)
+        diffs.append(diff)
+
+    repeat = 20
+    start = time.perf_counter()
+    for _ in range(repeat):
+        walk = [any(_is_key_exist(d, ["quotes", s], ["last_price"]) for d in diffs) for s in symbols]
+    walk_cost = (time.perf_counter() - start) / repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        index = [_is_path_changing(diff_paths, ["quotes", s], ["last_price"]) for s in symbols]
+    index_cost = (time.perf_counter() - start) / repeat
+    assert walk == index
+    print(f"{n_quotes} 个合约, {n_diffs} 个 diff, 检查全部合约: "
+          f"遍历 diff {1e3 * walk_cost:.3f}ms, 查 diff_paths {1e3 * index_cost:.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+#!usr/bin/env python3
+# -*- coding:utf-8 -*-
+__author__ = 'mayanqiong'
+
+"""
+TqConnect 可选的 json 编解码 (json / orjson / ujson) 解码真实数据包的吞吐量
+
+读取 tqsdk.recorder 录制的文件 (设置环境变量 TQ_RECORD_FILE 运行策略即可录制)，用每种编解码解码指定连接收到的全部数据包，
+统计解码速度，并检查解码结果与 json 模块一致。没有安装的库会被跳过。
+
+用法: python benchmark/json_codec.py 录制文件 [连接 id，默认为 md]
+"""
+
+import json
+import sys
+import time
+
+from tqsdk.codec import _CODECS
+from tqsdk.recorder import _read_packets
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    path = sys.argv[1]
+    conn_id = sys.argv[2] if len(sys.argv) > 2 else "md"
+    frames = [msg for _, _, msg in _read_packets(path, conn_id)]
+    if not frames:
+        print(f"录制文件 {path} 中没有连接 {conn_id} 收到的数据包")
+        sys.exit(1)
+    expected = [json.loads(f) for f in frames]
+    size = sum(len(f.encode("utf-8")) for f in frames) / 1e6
+    print(f"连接 {conn_id}: {len(frames)} 个数据包, {size:.1f} MB")
+    for name, codec_cls in _CODECS.items():
+        try:
+            codec = codec_cls()
+        except ImportError:
+            print(f"{name:7s}: 没有安装，跳过")
+            continue
+        start = time.perf_counter()
+        result = [codec.loads(f) for f in frames]
+        cost = time.perf_counter() - start
+        assert json.dumps(result) == json.dumps(expected)  # 数据包中可能有 NaN，NaN != NaN，所以比较序列化的结果
+        print(f"{name:7s}: {len(frames) / cost:8.0f} 包/s, {size / cost:6.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
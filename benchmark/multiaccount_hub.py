@@ -0,0 +1,107 @@
+#!usr/bin/env python3
+# -*- coding:utf-8 -*-
+__author__ = 'mayanqiong'
+
+"""
+多账户时行情的延迟: 账户模块依次串联与通过 TqAccountHub 星型连接的对比
+
+N 个 TqSim 账户，模拟上游行情服务: 每收到一个 peek_message 发出一个行情数据包，统计 api 发出 peek_message 到收到包含该行情的
+rtn_data 的耗时 (p50 / p99) 及每秒往返次数，并检查两种连接方式下每次都收到了行情。
+
+用法: python benchmark/multiaccount_hub.py [往返次数]
+"""
+
+import asyncio
+import logging
+import sys
+import time
+
+from tqsdk.channel import TqChan
+from tqsdk.multiaccount import TqMultiAccount
+from tqsdk.tradeable import TqSim
+
+
+class _Api(object):
+    """TqChan、TqMultiAccount 及 TqSim 用到的 TqApi 接口"""
+
+    _logger = logging.getLogger("benchmark")
+    _loop = None
+    _latency_stats = None
+    _pre20_ins_info = {}
+
+    def __init__(self):
+        self.tasks = []
+
+    def create_task(self, coro, _caller_api=False):
+        task = asyncio.get_event_loop().create_task(coro)
+        self.tasks.append(task)
+        return task
+
+    async def _cancel_task(self, task):
+        task.cancel()
+
+    async def _cancel_tasks(self, *tasks):
+        for task in tasks:
+            task.cancel()
+
+    def _print(self, *args, **kwargs):
+        pass
+
+
+def _md_pack(i):
+    return {"aid": "rtn_data", "data": [{"quotes": {"SHFE.cu2401": {
+        "last_price": float(i), "datetime": "2023-12-01 10:%02d:%02d.%06d" % (i // 60000000 % 60, i // 1000000 % 60, i % 1000000)
+    }}}]}
+
+
+async def run(n_accounts, n, hub):
+    api = _Api()
+    accounts = [TqSim(account_id=f"sim_{i}") for i in range(n_accounts)]
+    md_send_chan, md_recv_chan, api_send_chan, api_recv_chan = TqChan(api), TqChan(api), TqChan(api), TqChan(api)
+    if hub:
+        TqMultiAccount(accounts)._setup_connection(api, api_send_chan, api_recv_chan, md_send_chan, md_recv_chan)
+    else:
+        # 之前的串联方式，行情依次经过每个账户模块
+        send_chan, recv_chan = md_send_chan, md_recv_chan
+        for index, account in enumerate(accounts):
+            next_send_chan = api_send_chan if index == n_accounts - 1 else TqChan(api)
+            next_recv_chan = api_recv_chan if index == n_accounts - 1 else TqChan(api)
+            api.create_task(account._run(api, next_send_chan, next_recv_chan, send_chan, recv_chan))
+            send_chan, recv_chan = next_send_chan, next_recv_chan
+
+    async def upstream():
+        i = 0
+        async for pack in md_send_chan:
+            if pack["aid"] == "peek_message":
+                md_recv_chan.send_nowait(_md_pack(i))
+                i += 1
+    api.create_task(upstream())
+    md_recv_chan.send_nowait({"aid": "rtn_data", "data": [{"mdhis_more_data": False}]})
+    api_send_chan.send_nowait({"aid": "peek_message"})
+    await api_recv_chan.recv()  # 各个账户的初始截面
+    latency = []
+    start = time.perf_counter()
+    for _ in range(n):
+        t = time.perf_counter()
+        api_send_chan.send_nowait({"aid": "peek_message"})
+        pack = await asyncio.wait_for(api_recv_chan.recv(), 1)
+        latency.append(time.perf_counter() - t)
+        assert any("quotes" in d for d in pack["data"])
+    cost = time.perf_counter() - start
+    for task in api.tasks:
+        task.cancel()
+    latency.sort()
+    return n / cost, latency[len(latency) // 2], latency[int(len(latency) * 0.99)]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    for n_accounts in (2, 4, 10, 40):
+        for hub in (False, True):
+            rate, p50, p99 = asyncio.run(run(n_accounts, n, hub))
+            print(f"账户数 {n_accounts:3d} {'hub  ' if hub else 'chain'}: {rate:6.0f} 次/s, "
+                  f"p50 {1e6 * p50:6.0f}us, p99 {1e6 * p99:6.0f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!usr/bin/env python3
+# -*- coding:utf-8 -*-
+__author__ = 'mayanqiong'
+
+"""
+删除没有监听者的子树时 _notify_update 的耗时
+
+模拟回测中回收K线: 业务数据树的根节点及一个行情对象有监听者，K线序列没有监听者，通过 _merge_diff 删除全部K线，
+与之前遍历被删除子树中每个节点的方式对比。最后检查移除监听者后业务数据树中登记的路径也被删除。
+
+用法: python benchmark/notify_update.py [K线数量]
+"""
+
+import logging
+import sys
+import time
+
+from tqsdk.channel import TqChan
+from tqsdk.diff import _merge_diff, _get_obj, _register_update_chan
+from tqsdk.entity import Entity
+from tqsdk.objs import Kline, Quote
+
+
+class _Api(object):
+    """TqChan 用到的 TqApi 接口"""
+    _logger = logging.getLogger("benchmark")
+    _loop = None
+    _latency_stats = None
+
+
+def _walk_all(target, content):
+    """之前的方式: 遍历被删除子树中的每个节点"""
+    if isinstance(target, Entity):
+        for q in getattr(target, "_listener", {}):
+            q.send_nowait(content)
+        for v in target.values():
+            _walk_all(v, content)
+
+
+def _build(n_bars):
+    prototype = {"quotes": {"#": Quote(None)}, "klines": {"*": {"*": {"data": {"@": Kline(None)}}}}}
+    data = Entity()
+    data._instance_entity([])
+    _merge_diff(data, {
+        "quotes": {"SHFE.cu2401": {"last_price": 1.0}},
+        "klines": {"SHFE.cu2401": {"60000000000": {"data": {str(i): {"close": float(i)} for i in range(n_bars)}}}},
+    }, prototype, persist=False)
+    return data, prototype
+
+
+def main():
+    n_bars = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    api = _Api()
+    root_chan, quote_chan = TqChan(api), TqChan(api)
+
+    data, prototype = _build(n_bars)
+    _register_update_chan(data, root_chan)
+    _register_update_chan(_get_obj(data, ["quotes", "SHFE.cu2401"]), quote_chan)
+    serial = _get_obj(data, ["klines", "SHFE.cu2401", "60000000000"])
+    start = time.perf_counter()
+    _walk_all(serial["data"], True)
+    walk_cost = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _merge_diff(data, {"klines": {"SHFE.cu2401": {"60000000000": {"data": {str(i): None for i in range(n_bars)}}}}},
+                prototype, persist=False)
+    skip_cost = time.perf_counter() - start
+    assert len(serial["data"]) == 0
+    print(f"删除 {n_bars} 根没有监听者的K线: 遍历全部节点 {1e3 * walk_cost:.1f}ms, "
+          f"跳过没有监听者的子树 (包括删除) {1e3 * skip_cost:.1f}ms")
+
+    data["_listener"].discard(root_chan)
+    assert ("quotes", "SHFE.cu2401") in data._listened_paths and () in data._listened_paths
+    _get_obj(data, ["quotes", "SHFE.cu2401"])["_listener"].discard(quote_chan)
+    assert () not in data._listened_paths
+    print("移除全部监听者后，登记的路径已全部删除")
+
+
+if __name__ == "__main__":
+    main()
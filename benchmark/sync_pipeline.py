@@ -0,0 +1,95 @@
+#!usr/bin/env python3
+# -*- coding:utf-8 -*-
+__author__ = 'mayanqiong'
+
+"""
+TqSymbols -> DataExtension 链路在 task 模式及同步模式 (TqApi(_sync_pipeline=True)) 下的吞吐量
+
+模拟上游行情服务: 每收到一个 peek_message 发出一个行情数据包，统计 api 发出 peek_message 到收到行情数据包的往返次数，
+并检查两种模式下 api 收到的数据相同。
+
+用法: python benchmark/sync_pipeline.py [往返次数]
+"""
+
+import asyncio
+import logging
+import sys
+import time
+
+from tqsdk.channel import TqChan
+from tqsdk.data_extension import DataExtension
+from tqsdk.symbols import TqSymbols
+
+
+class _Api(object):
+    """TqChan、TqSymbols 及 DataExtension 用到的 TqApi 接口"""
+
+    _logger = logging.getLogger("benchmark")
+    _latency_stats = None
+    _stock = True
+    _pre20_ins_info = {}
+
+    def create_task(self, coro, _caller_api=False):
+        return asyncio.get_event_loop().create_task(coro)
+
+    async def _cancel_task(self, task):
+        task.cancel()
+
+
+def _md_pack(i):
+    return {"aid": "rtn_data", "data": [
+        {"quotes": {"SHFE.cu2401": {"last_price": float(i), "datetime": "2023-12-01 10:00:00.000000"}}},
+        {"trade": {"u": {"trade_more_data": False}}}
+    ]}
+
+
+async def run(sync, n):
+    api = _Api()
+    md_send_chan, api_recv_chan = TqChan(api), TqChan(api)
+    tq_symbols, data_extension = TqSymbols(), DataExtension(api)
+    tasks = []
+    if sync:
+        # data_extension 发往上游的 channel 需要在 tq_symbols 的同步链路建立之后才能得到
+        api_send_chan, de_md_recv_chan = data_extension._pipe(api_recv_chan, None)
+        md_recv_chan = tq_symbols._pipe(api, de_md_recv_chan, md_send_chan)
+        data_extension._md_send_chan = tq_symbols._pipe_sim_send()
+    else:
+        symbols_send_chan, symbols_recv_chan, md_recv_chan = TqChan(api), TqChan(api), TqChan(api)
+        api_send_chan = TqChan(api)
+        tasks.append(api.create_task(tq_symbols._run(api, symbols_send_chan, symbols_recv_chan, md_send_chan, md_recv_chan)))
+        tasks.append(api.create_task(data_extension._run(api_send_chan, api_recv_chan, symbols_send_chan, symbols_recv_chan)))
+
+    async def upstream():
+        i = 0
+        async for pack in md_send_chan:
+            if pack["aid"] == "peek_message":
+                await md_recv_chan.send(_md_pack(i))
+                i += 1
+    tasks.append(api.create_task(upstream()))
+    await md_recv_chan.send({"aid": "rtn_data", "data": [
+        {"quotes": {"SHFE.cu2401": {"expire_datetime": 1.7e9}}},
+        {"trade": {"u": {"trade_more_data": False}}},
+        {"mdhis_more_data": False}
+    ]})
+    received = []
+    start = time.perf_counter()
+    for _ in range(n):
+        api_send_chan.send_nowait({"aid": "peek_message"})
+        pack = await asyncio.wait_for(api_recv_chan.recv(), 1)
+        received.append(pack["data"][0].get("quotes", {}).get("SHFE.cu2401", {}).get("last_price"))
+    cost = time.perf_counter() - start
+    for task in tasks:
+        task.cancel()
+    return n / cost, received
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    task_rate, task_received = asyncio.run(run(False, n))
+    sync_rate, sync_received = asyncio.run(run(True, n))
+    assert task_received == sync_received
+    print(f"task 模式: {task_rate:8.0f} 次/s, 同步模式: {sync_rate:8.0f} 次/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,7 @@ from tqsdk.api import TqApi
 from tqsdk.tradeable import TqAccount, TqZq,  TqKq, TqKqStock, TqSim, TqSimStock, TqCtp, TqRohon, TqJees, TqYida, TqTradingUnit
 from tqsdk.auth import TqAuth
 from tqsdk.channel import TqChan
-from tqsdk.backtest import TqBacktest, TqReplay
+from tqsdk.backtest import TqBacktest, TqReplay, TqVectorBacktest, TqBacktestSweep
 from tqsdk.exceptions import BacktestFinished, TqBacktestPermissionError, TqTimeoutError, TqRiskRuleError
 from tqsdk.lib import TargetPosScheduler, TargetPosTask, InsertOrderUntilAllTradedTask, InsertOrderTask, TqNotify
 from tqsdk.multiaccount import TqMultiAccount
@@ -17,9 +17,8 @@ __author__ = 'chengzhi'
 import aiohttp
 import asyncio
 import copy
+import hashlib
 import logging
-import lzma
-import json
 import os
 import platform
 import re
@@ -27,7 +26,7 @@ import sys
 import time
 import warnings
 from datetime import datetime, date, timedelta
-from typing import Union, List, Any, Optional, Coroutine, Callable, Tuple, Dict
+from typing import Union, List, Any, Optional, Coroutine, Callable, Tuple, Dict, Set, Iterable
 from asyncio.events import _get_running_loop, _set_running_loop
 from packaging import version
 
@@ -53,6 +52,7 @@ from tqsdk.baseApi import TqBaseApi
 from tqsdk.multiaccount import TqMultiAccount
 from tqsdk.backtest import TqBacktest, TqReplay
 from tqsdk.channel import TqChan
+from tqsdk.columnar import ColumnarSeries, _ensure_columnar
 from tqsdk.connect import TqConnect, MdReconnectHandler, ReconnectTimer
 from tqsdk.calendar import _get_trading_calendar, TqContCalendar, _init_chinese_rest_days
 from tqsdk.constants import FUTURE_EXCHANGES
@@ -60,17 +60,22 @@ from tqsdk.data_extension import DataExtension
 from tqsdk.data_series import DataSeries
 from tqsdk.datetime import _get_trading_day_from_timestamp, _datetime_to_timestamp_nano, _timestamp_nano_to_datetime, \
     _cst_now, _convert_user_input_to_nano
-from tqsdk.diff import _merge_diff, _get_obj, _is_key_exist, _register_update_chan
-from tqsdk.entity import Entity
+from tqsdk.diff import _merge_diff, _get_obj, _is_path_changing, _register_update_chan, _update_diff_paths
+from tqsdk.entity import Entity, CompactEntity
 from tqsdk.exceptions import TqTimeoutError
-from tqsdk.log import _clear_logs, _get_log_name, _get_disk_free
+from tqsdk.ins_snapshot import InsSnapshot
+from tqsdk.latency import LatencyStats
+from tqsdk.log import _clear_logs, _get_log_name, _get_disk_free, _AsyncLogHandler
+from tqsdk.loop_profiler import LoopProfiler
 from tqsdk.objs import Quote, TradingStatus, Kline, Tick, Account, Position, Order, Trade, RiskManagementRule, RiskManagementData
+from tqsdk.objs import CompactQuote, CompactKline, CompactTick
 from tqsdk.objs import SecurityAccount, SecurityOrder, SecurityTrade, SecurityPosition
-from tqsdk.objs_not_entity import QuoteList, TqDataFrame, TqSymbolDataFrame, SymbolList, SymbolLevelList, \
+from tqsdk.objs_not_entity import QuoteList, QuoteStream, TqDataFrame, TqSymbolDataFrame, SymbolList, SymbolLevelList, \
     TqSymbolRankingDataFrame, TqOptionGreeksDataFrame, TqMdSettlementDataFrame, TqEdbIndexDataFrame
 from tqsdk.risk_manager import TqRiskManager
 from tqsdk.risk_rule import TqRiskRule
 from tqsdk.ins_schema import ins_schema, basic, derivative, future, option
+from tqsdk.subscribe import QuoteSubscribeManager
 from tqsdk.symbols import TqSymbols
 from tqsdk.tradeable import TqAccount, TqZq, TqKq, TqKqStock, TqSim, TqSimStock, BaseSim, BaseOtg, TqCtp, TqRohon, TqJees, TqYida, TqTradingUnit
 from tqsdk.trading_status import TqTradingStatus
@@ -101,7 +106,9 @@ class TqApi(TqBaseApi):
                  url: Optional[str] = None, backtest: Union[TqBacktest, TqReplay, None] = None,
                  web_gui: Union[bool, str] = False, debug: Union[bool, str, None] = None,
                  loop: Optional[asyncio.AbstractEventLoop] = None, disable_print: bool = False, _stock: bool = True,
-                 _ins_url=None, _md_url=None, _td_url=None) -> None:
+                 _ins_url=None, _md_url=None, _td_url=None, _compact_objs: bool = False,
+                 _sync_pipeline: bool = False, _latency_stats: bool = False,
+                 _loop_profile: bool = False, _log_md_sample_rate: float = 1.0) -> None:
         """
         创建天勤接口实例
 
@@ -254,11 +261,13 @@ class TqApi(TqBaseApi):
         self._risk_manager = TqRiskManager()
         self._requests = {
             "trading_status": set(),
-            "quotes": set(),
             "klines": {},
             "ticks": {},
             "margin_rates": {},  # 记录已获取的保证金率, key: (account_key, symbol, direction), value: float
         }  # 记录已发出的请求
+        self._quote_subscribe = QuoteSubscribeManager()  # 记录订阅的合约行情，同一次 EventLoop 迭代中的订阅变更合并为一个 subscribe_quote 包
+        self._quote_subscribe_scheduled = False  # 是否已经安排在 EventLoop 中发送订阅变更
+        self._quote_underlying_refs: Dict[str, List[str]] = {}  # {期权合约: [随该期权订阅的标的合约, ...]}，退订期权时一并退订标的合约
         self._serials = {}  # 记录所有数据序列
         # 记录所有(若有多个serial 则仅data_length不同, right_id相同)合约、周期相同的多合约K线中最大的更新数据范围
         # key:(主合约,(所有副合约),duration), value:(K线的新数据中主合约最小的id, 主合约的right_id)。用于is_changing()中新K线生成的判定
@@ -267,14 +276,21 @@ class TqApi(TqBaseApi):
         self._data._instance_entity([])
         self._diffs = []  # 自上次wait_update返回后收到更新数据的数组 (异步代码)
         self._sync_diffs = []  # 自上次wait_update返回后收到更新数据的数组 (同步代码)
+        self._diff_paths = {}  # _diffs 中有变更的节点路径及字段 {path: set(key)}，is_changing 根据其判断 (异步代码)
+        self._sync_diff_paths = {}  # _sync_diffs 中有变更的节点路径及字段 (同步代码)
         self._pending_diffs = []  # 从网络上收到的待处理的 diffs, 只在 wait_update 函数执行过程中才可能为非空
         self._pending_peek = False  # 是否有发出的 peek_message 还没收到数据回复
+        self._compact_objs = _compact_objs  # 是否使用字段保存在 __slots__ 中的 Quote / Kline / Tick，订阅大量合约时可以节省内存
+        self._sync_pipeline = _sync_pipeline  # 是否将 TqSymbols、TqWebHelper、DataExtension 以同步调用的方式串联，减少 task 切换
+        self._latency_stats = LatencyStats() if _latency_stats else None  # 行情数据在各个模块中的耗时统计，默认不统计
+        self._loop_profiler = LoopProfiler() if _loop_profile else None  # 按照协程统计每次 wait_update 中 EventLoop 回调的耗时，默认不统计
+        self._log_md_sample_rate = _log_md_sample_rate  # 日志中记录行情连接收到的数据包的比例，默认全部记录
         self._prototype = self._gen_prototype()  # 各业务数据的原型, 用于决定默认值及将收到的数据转为特定的类型
         self._security_prototype = self._gen_security_prototype()  # 股票业务数据原型
         self._dividend_cache = {}  # 缓存合约对应的复权系数矩阵，每个合约只计算一次
         self._send_chan, self._recv_chan = TqChan(self), TqChan(self)  # 消息收发队列
         self._ws_md_recv_chan = None  # 记录 ws_md_recv_chan 引用
-        self._pre20_ins_info = {}  # 20年9月份之前的合约信息
+        self._pre20_ins_info = {}  # 20年9月份之前的合约信息，self._stock 为 False 时为旧版合约服务的全部合约信息
         self._http_session_internal = None  # 记录 http 会话
 
         # slave模式的api不需要完整初始化流程
@@ -311,6 +327,8 @@ class TqApi(TqBaseApi):
         # 使用空 list, 使得 is_changing() 返回 false, 因为截面数据不算做更新数据
         self._diffs = []
         self._sync_diffs = []
+        self._diff_paths = {}
+        self._sync_diff_paths = {}
 
     def _print(self, msg: str = "", level: str = "INFO"):
         if self.disable_print:
@@ -337,7 +355,7 @@ class TqApi(TqBaseApi):
         Returns:
             :py:class:`~tqsdk.api.TqApi`: 返回当前TqApi的一个副本. 这个副本可以在另一个线程中使用
         """
-        slave_api = TqApi(self)
+        slave_api = TqApi(self, _compact_objs=self._compact_objs)
         # 将当前api的_data值复制到_copy_diff中, 然后merge到副本api的_data里
         _copy_diff = {}
         TqApi._deep_copy_dict(self._data, _copy_diff)
@@ -372,6 +390,8 @@ class TqApi(TqBaseApi):
             for _, serial in self._serials.items():
                 self._process_serial_extra_array(serial)
             super(TqApi, self)._close_tasks()
+            if self._latency_stats:
+                self._latency_stats.log(self._logger, force=True)
             if self._http_session_internal:
                 self._loop.run_until_complete(self._http_session_internal.close())
             super(TqApi, self)._close_loop()
@@ -513,6 +533,37 @@ class TqApi(TqBaseApi):
                     raise TqTimeoutError(f"获取 {symbols} 的行情信息超时，请检查客户端及网络是否正常")
         return quote_list
 
+    def _get_quote_list_stream(self, symbols: List[str]) -> QuoteStream:
+        """
+        获取指定合约列表的盘口行情，立即返回，不等待收到合约信息及行情，适用于一次请求大量合约 (如全部期权合约) 的场景
+
+        Args:
+            symbols (list of str): 合约代码列表
+
+        Returns:
+            :py:class:`~tqsdk.objs_not_entity.QuoteStream`: 返回一个列表，每个元素为指定合约盘口行情引用，收到数据前各项内容为 NaN 或 0。
+            其 ready 属性为已经收到合约信息及行情的合约，通过 async for 遍历 ready_quotes() 可以依次处理就绪的合约。
+
+        Example::
+
+            from tqsdk import TqApi, TqAuth
+
+            api = TqApi(auth=TqAuth("快期账户", "账户密码"))
+            symbols = api.query_options("SHFE.au2412")
+            quotes = api._get_quote_list_stream(symbols)
+
+            async def scan():
+                async for quote in quotes.ready_quotes():
+                    print(quote.instrument_id, quote.last_price)
+
+            api.create_task(scan())
+            while True:
+                api.wait_update()
+        """
+        if any([s == "" for s in symbols]):
+            raise Exception(f"get_quote_list 中请求合约代码不能为空字符串 {symbols}")
+        return QuoteStream(self, [_get_obj(self._data, ["quotes", s], self._prototype["quotes"]["#"]) for s in symbols])
+
     def _ensure_symbol(self, symbol: Union[str, List[str]]):
         # 已经收到收到合约信息之后返回，同步
         all_symbol_list = symbol if isinstance(symbol, list) else [symbol]
@@ -522,8 +573,8 @@ class TqApi(TqBaseApi):
         if len(symbol_list) == 0:
             return True
 
-        if self._stock is False:
-            raise Exception("代码 %s 不存在, 请检查合约代码是否填写正确" % (symbol_list))
+        if self._stock is False and not all(s in self._pre20_ins_info for s in symbol_list):
+            raise Exception("代码 %s 不存在, 请检查合约代码是否填写正确" % [s for s in symbol_list if s not in self._pre20_ins_info])
         else:
             task = self.create_task(self._ensure_symbol_async(symbol_list), _caller_api=True)
             if not self._loop.is_running():
@@ -541,8 +592,8 @@ class TqApi(TqBaseApi):
         if len(symbol_list) == 0:
             return True
 
-        if self._stock is False:
-            raise Exception("代码 %s 不存在, 请检查合约代码是否填写正确" % symbol_list)
+        if self._stock is False and not all(s in self._pre20_ins_info for s in symbol_list):
+            raise Exception("代码 %s 不存在, 请检查合约代码是否填写正确" % [s for s in symbol_list if s not in self._pre20_ins_info])
         else:
             for query in _query_for_quote(symbol_list, self._pre20_ins_info.keys()):
                 self._send_pack(query)
@@ -860,7 +911,9 @@ class TqApi(TqBaseApi):
         该函数返回的对象不会更新，不建议在循环内调用该方法。
 
         Args:
-            symbol (str): 指定合约代码。当前只支持单个合约。
+            symbol (str/list of str): 指定合约代码或合约代码列表。\
+                为列表时，返回的 K 线按第一个合约对齐，其他合约的列名加上合约在列表中的序号，如 open1、close2、symbol1；\
+                其他合约没有对应时间的 K 线时，该行的 id 为 -1，其他字段为 nan
 
             duration_seconds (int): K 线数据周期, 以秒为单位。例如: 1 分钟线为 60，1 小时线为 3600，日线为 86400。\
                 注意: 周期在日线以内时此参数可以任意填写, 在日线以上时只能是日线(86400)的整数倍
@@ -890,6 +943,8 @@ class TqApi(TqBaseApi):
             * volume: 11 (K线时间范围内的成交量)
             * open_oi: 27354 (K线起始时刻的持仓量)
             * close_oi: 27355 (K线结束时刻的持仓量)
+            * symbol: "SHFE.cu1805" (合约代码)
+            * duration: 60000000000 (K 线周期，单位为纳秒)
 
         Example::
 
@@ -996,7 +1051,9 @@ class TqApi(TqBaseApi):
             raise Exception(f"不支持在回测/复盘中调用 {call_func} 接口")
         dur_nano = duration_seconds * 1000000000
         symbol_list = symbol_list if isinstance(symbol_list, list) else [symbol_list]
-        if len(symbol_list) != 1:
+        if len(symbol_list) == 0:
+            raise Exception(f"{call_func} 合约代码不能为空")
+        if len(symbol_list) != 1 and duration_seconds == 0:
             raise Exception(f"{call_func} 数据获取方式暂不支持多合约请求")
         self._ensure_symbol(symbol_list)  # 检查合约代码是否存在
         start_dt_nano, end_dt_nano = _convert_user_input_to_nano(start_dt, end_dt)
@@ -2000,6 +2057,8 @@ class TqApi(TqBaseApi):
                     _set_running_loop(None)
             return self._wait_update(deadline=deadline, _task=_task)
         finally:
+            if self._loop_profiler is not None:
+                self._loop_profiler.finish(self._logger)
             if other_loop:
                 _set_running_loop(other_loop)
 
@@ -2035,29 +2094,160 @@ class TqApi(TqBaseApi):
                 self._diffs = self._pending_diffs
                 self._sync_diffs = (self._sync_diffs if _task else []) + self._pending_diffs
                 self._pending_diffs = []
+                # merge 时收集有变更的路径，is_changing 查表判断，不需要对每个对象遍历所有 diffs
+                self._diff_paths = {}
                 # 清空K线更新范围，避免在 wait_update 未更新K线时仍通过 is_changing 的判断
                 self._klines_update_range = {}
+                start_time = time.perf_counter() if self._latency_stats else 0
                 for d in self._diffs:
                     # 判断账户类别, 对股票和期货的 trade 数据分别进行处理
                     if "trade" in d:
                         for k, v in d.get('trade').items():
                             prototype = self._security_prototype if self._account._is_stock_type(k) else self._prototype
-                            _merge_diff(self._data, {'trade': {k: v}}, prototype, persist=False, reduce_diff=True)
+                            _merge_diff(self._data, {'trade': {k: v}}, prototype, persist=False, reduce_diff=True,
+                                        diff_paths=self._diff_paths)
                     # 非交易数据均按照期货处理逻辑
                     diff_without_trade = {k: v for k, v in d.items() if k != "trade"}
                     if diff_without_trade:
-                        _merge_diff(self._data, diff_without_trade, self._prototype, persist=False, reduce_diff=True)
+                        _merge_diff(self._data, diff_without_trade, self._prototype, persist=False, reduce_diff=True,
+                                    diff_paths=self._diff_paths)
+                if _task:
+                    _update_diff_paths(self._sync_diff_paths, self._diff_paths)
+                else:
+                    self._sync_diff_paths = {path: set(keys) for path, keys in self._diff_paths.items()}
                 self._risk_manager._on_recv_data(self._diffs)
+                if self._latency_stats:
+                    self._latency_stats.record("TqApi.merge", time.perf_counter() - start_time)
+                    start_time = time.perf_counter()
                 for _, serial in self._serials.items():
                     # K线df的更新与原始数据、left_id、right_id、more_data、last_id相关，其中任何一个发生改变都应重新计算df
                     # 注：订阅某K线后再订阅合约代码、周期相同但长度更短的K线时, 服务器不会再发送已有数据到客户端，即chart发生改变但内存中原始数据未改变。
                     # 检测到K线数据或chart的任何字段发生改变则更新serial的数据
-                    if self._is_obj_changing(serial["df"], diffs=self._diffs, key=[]) \
-                            or self._is_obj_changing(serial["chart"], diffs=self._diffs, key=[]):
+                    if self._is_obj_changing(serial["df"], diff_paths=self._diff_paths, key=[]) \
+                            or self._is_obj_changing(serial["chart"], diff_paths=self._diff_paths, key=[]):
                         if len(serial["root"]) == 1:  # 订阅单个合约
                             self._update_serial_single(serial)
                         else:  # 订阅多个合约
                             self._update_serial_multi(serial)
+                for _, serial in self._serials.items():
+                    for root in serial["root"]:
+                        root["data"]._updated_ids.clear()
+                if self._latency_stats:
+                    self._latency_stats.record("TqApi.serial", time.perf_counter() - start_time)
+                    self._record_latency_stats()
+
+    def _record_latency_stats(self) -> None:
+        """wait_update 处理完一批数据后，记录收到行情到用户可见的耗时，以及本次更新的行情中最新的交易所时间到用户可见的耗时"""
+        # 只有交易数据 (及通知) 的一批数据不包含尚未处理的行情数据包，不能作为其处理完成的时间
+        if any(k not in ("trade", "notify") for d in self._diffs for k in d):
+            self._latency_stats.record_since_md_recv("TqApi", done=True)
+        if not self._backtest:
+            # 行情时间的格式都为 %Y-%m-%d %H:%M:%S.%f，按照字符串比较即可得到最新的时间，只需要解析一次
+            last_datetime = max((q["datetime"] for d in self._diffs for q in (d.get("quotes") or {}).values()
+                                 if q and q.get("datetime")), default=None)
+            if last_datetime:
+                self._latency_stats.record_exchange_time(last_datetime)
+        self._latency_stats.log(self._logger)
+
+    def _get_latency_stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        获取行情数据在各个模块中的耗时统计，需要创建 TqApi 时指定 _latency_stats=True
+
+        Returns:
+            dict: {阶段名称: {"count": 样本数, "p50": 中位数, "p99": 99 分位数, "max": 最大值}}，单位为毫秒
+
+        Example::
+
+            from tqsdk import TqApi, TqAuth
+            api = TqApi(auth=TqAuth("快期账户", "账户密码"), _latency_stats=True)
+            quote = api.get_quote("SHFE.cu2401")
+            for _ in range(100):
+                api.wait_update()
+            print(api._get_latency_stats()["exchange_to_api"])
+        """
+        if self._latency_stats is None:
+            raise Exception("未开启耗时统计，请在创建 TqApi 时指定 _latency_stats=True")
+        return self._latency_stats.get_stats()
+
+    def _get_loop_profile(self, top: int = 10) -> Dict[str, Any]:
+        """
+        获取 EventLoop 耗时分析结果，需要创建 TqApi 时指定 _loop_profile=True
+
+        Args:
+            top (int): [可选] 返回耗时最多的协程个数，默认为 10
+
+        Returns:
+            dict: {"last": 最近一次 wait_update 的统计结果, "total": 开启以来累计的统计结果}，每个统计结果为
+            {"wall": 时长, "busy": 回调总耗时, "runs": ioloop.run_forever 次数, "events": 事件数,
+            "slowest": [{"name": 协程名称[Task 名称], "count": 执行次数, "time": 耗时}, ...]}，时间单位为毫秒
+
+        Example::
+
+            from tqsdk import TqApi, TqAuth, TargetPosTask
+            api = TqApi(auth=TqAuth("快期账户", "账户密码"), _loop_profile=True)
+            target_pos = TargetPosTask(api, "SHFE.rb2410")
+            target_pos.set_target_volume(5)
+            for _ in range(100):
+                api.wait_update()
+            print(api._get_loop_profile()["total"]["slowest"])
+        """
+        if self._loop_profiler is None:
+            raise Exception("未开启 EventLoop 耗时分析，请在创建 TqApi 时指定 _loop_profile=True")
+        return self._loop_profiler.get_profile(top)
+
+    def _unsubscribe_quote(self, symbols: Union[str, List[str]]) -> None:
+        """
+        退订合约行情
+
+        get_quote / get_quote_list 每次调用都会将合约的订阅次数加 1，每次调用本函数减 1，订阅次数为 0 时才会真正退订该合约。
+        内部模块 (如 TargetPosTask) 通过 get_quote 订阅的合约不会被退订。退订后对应的 Quote 对象不再更新。
+        期权合约订阅时一并订阅的标的合约，在退订该期权合约时一并减 1。
+
+        Args:
+            symbols (str / list of str): 合约代码或合约代码列表
+
+        Example::
+
+            from tqsdk import TqApi, TqAuth
+            api = TqApi(auth=TqAuth("快期账户", "账户密码"))
+            quotes = api.get_quote_list(["SHFE.cu2401", "SHFE.cu2402"])
+            api._unsubscribe_quote(["SHFE.cu2401", "SHFE.cu2402"])
+            print(api._get_quote_subscribe_stats())
+        """
+        symbols = [symbols] if isinstance(symbols, str) else list(symbols)
+        underlying_symbols = []
+        for symbol in symbols:
+            refs = self._quote_underlying_refs.get(symbol)
+            if refs:
+                underlying_symbols.append(refs.pop())
+                if not refs:
+                    del self._quote_underlying_refs[symbol]
+        self._quote_subscribe.remove(symbols + underlying_symbols)
+        self._schedule_subscribe_quote()
+
+    def _get_quote_subscribe_stats(self) -> Dict[str, int]:
+        """
+        获取合约行情订阅的统计
+
+        Returns:
+            dict: {"symbols": 订阅的合约个数, "packs": 发出的 subscribe_quote 包的个数, "sent_symbols": 发出的包中合约的总个数}
+        """
+        return self._quote_subscribe.get_stats()
+
+    def _subscribe_quote(self, symbols: Iterable[str]) -> None:
+        """订阅合约行情，订阅变更在当前 EventLoop 迭代结束后合并发出"""
+        if self._quote_subscribe.add(symbols):
+            self._schedule_subscribe_quote()
+
+    def _subscribe_underlying(self, symbol: str, underlying_symbol: str) -> None:
+        """订阅期权 symbol 的标的合约行情，退订 symbol 时一并退订"""
+        self._quote_underlying_refs.setdefault(symbol, []).append(underlying_symbol)
+        self._subscribe_quote([underlying_symbol])
+
+    def _schedule_subscribe_quote(self) -> None:
+        if self._quote_subscribe.changed and not self._quote_subscribe_scheduled:
+            self._quote_subscribe_scheduled = True
+            self._loop.call_soon(self._send_subscribe_quote)
 
     def _wait_update_until(self, cond: Callable[[], bool], deadline: Optional[float] = None) -> bool:
         """
@@ -2135,16 +2325,16 @@ class TqApi(TqBaseApi):
         if obj is None:
             return False
         # is_changing 区分同步 / 异步中，根据不同的 diffs 判断
-        diffs = self._diffs if self._loop.is_running() else self._sync_diffs
+        diff_paths = self._diff_paths if self._loop.is_running() else self._sync_diff_paths
         if not isinstance(key, list):
             key = [key] if key else []
         objs = obj if isinstance(obj, list) else [obj]
         for o in objs:
-            if self._is_obj_changing(o, diffs=diffs, key=key):
+            if self._is_obj_changing(o, diff_paths=diff_paths, key=key):
                 return True
         return False
 
-    def _is_obj_changing(self, obj: Any, diffs: List[Dict[str, Any]], key: List[str]) -> bool:
+    def _is_obj_changing(self, obj: Any, diff_paths: Dict[Tuple, Set[str]], key: List[str]) -> bool:
         try:
             if isinstance(obj, pd.DataFrame):
                 if id(obj) in self._serials:
@@ -2184,28 +2374,27 @@ class TqApi(TqBaseApi):
                 paths = [obj["_path"]]
         except (KeyError, IndexError):
             return False
-        for diff in diffs:
-            # 如果传入key：生成一个dict（key:序号，value: 字段）, 遍历这个dict并在_is_key_exist()判断key是否存在
-            if (isinstance(obj, pd.DataFrame) or isinstance(obj, pd.Series)) and len(key) != 0:
-                k_dict = {}
-                for k in key:
-                    if k not in obj.index:
-                        continue
-                    m = re.match(r'(.*?)(\d+)$', k)  # 匹配key中的数字
-                    if m is None:  # 无数字
-                        k_dict.setdefault(0, []).append(k)
-                    elif int(m.group(2)) < len(paths):
-                        m_k = int(m.group(2))
-                        k_dict.setdefault(m_k, []).append(m.group(1))
-                    else:  # 数字 >= len(paths)，说明是字段本身的数字（如 tick 盘口字段）
-                        k_dict.setdefault(0, []).append(k)  # 保留完整字段名
-                for k_id, v in k_dict.items():
-                    if _is_key_exist(diff, paths[k_id], v):
-                        return True
-            else:  # 如果没有传入key：遍历所有path
-                for path in paths:
-                    if _is_key_exist(diff, path, key):
-                        return True
+        # 如果传入key：生成一个dict（key:序号，value: 字段）, 遍历这个dict并在_is_path_changing()判断key是否有变更
+        if (isinstance(obj, pd.DataFrame) or isinstance(obj, pd.Series)) and len(key) != 0:
+            k_dict = {}
+            for k in key:
+                if k not in obj.index:
+                    continue
+                m = re.match(r'(.*?)(\d+)$', k)  # 匹配key中的数字
+                if m is None:  # 无数字
+                    k_dict.setdefault(0, []).append(k)
+                elif int(m.group(2)) < len(paths):
+                    m_k = int(m.group(2))
+                    k_dict.setdefault(m_k, []).append(m.group(1))
+                else:  # 数字 >= len(paths)，说明是字段本身的数字（如 tick 盘口字段）
+                    k_dict.setdefault(0, []).append(k)  # 保留完整字段名
+            for k_id, v in k_dict.items():
+                if _is_path_changing(diff_paths, paths[k_id], v):
+                    return True
+        else:  # 如果没有传入key：遍历所有path
+            for path in paths:
+                if _is_path_changing(diff_paths, path, key):
+                    return True
         return False
 
     # ----------------------------------------------------------------------
@@ -3523,7 +3712,8 @@ class TqApi(TqBaseApi):
             log_name = self._debug if isinstance(self._debug, str) else _get_log_name()
             if self._debug is not None or _get_disk_free() >= 10:
                 # self._debug is None 并且磁盘剩余空间小于 10G 则不写入日志
-                fh = logging.FileHandler(filename=log_name, encoding="utf-8")
+                # 在后台线程中批量写入日志文件，避免每个数据包的日志都在 EventLoop 所在的线程中同步写文件
+                fh = _AsyncLogHandler(filename=log_name)
                 fh.setFormatter(JSONFormatter())
                 fh.setLevel(logging.DEBUG)
                 self._logger.addHandler(fh)
@@ -3579,31 +3769,18 @@ class TqApi(TqBaseApi):
         ws_md_send_chan = TqChan(self, chan_name="send to md", logger=md_logger)
         ws_md_recv_chan = TqChan(self, chan_name="recv from md", logger=md_logger)
 
+        # 合约信息快照在访问某个合约时才解析，并补充 exercise_year、exercise_month 及回测时的夜盘时间
+        add_night = isinstance(self._backtest, TqBacktest)
         if self._stock is False:  # self._stock == False 需要旧版的合约服务文件
-            quotes = self._fetch_symbol_info(self._ins_url)
+            # 不在开始时发送全部合约信息，访问合约时通过 _query_for_quote 逐个查询，由 TqSymbols 从快照中返回
+            self._pre20_ins_info = self._fetch_symbol_info(self._ins_url, add_night)
         else:  # todo: self._stock == True 新版合约服务没有已下市合约
             dir_path = os.path.dirname(os.path.realpath(__file__))
-            with lzma.open(os.path.join(dir_path, "expired_quotes.json.lzma"), "rt", encoding="utf-8") as f:
-                quotes = json.loads(f.read())
-
-        if isinstance(self._backtest, TqBacktest):
-            _quotes_add_night(quotes)
-        # 期权增加了 exercise_year、exercise_month 在旧版合约服务中没有，需要添加，使用下市日期代替最后行权日
-        for quote in quotes.values():
-            if quote["ins_class"] == "FUTURE_OPTION":
-                quote["exercise_year"] = _timestamp_nano_to_datetime(int(quote["expire_datetime"] * 1000000) * 1000).year
-                quote["exercise_month"] = _timestamp_nano_to_datetime(int(quote["expire_datetime"] * 1000000) * 1000).month
-        if self._stock is False:
-            ws_md_recv_chan.send_nowait({
-                "aid": "rtn_data",
-                "data": [{"quotes": quotes}]
-            })  # 获取合约信息
-        else:
-            self._pre20_ins_info = quotes
+            self._pre20_ins_info = InsSnapshot.from_lzma(os.path.join(dir_path, "expired_quotes.json.lzma"), add_night)
 
         self._ws_md_recv_chan = ws_md_recv_chan  # 记录 ws_md_recv_chan 引用
 
-        conn = TqConnect(md_logger, conn_id="md")
+        conn = TqConnect(md_logger, conn_id="md", log_sample_rate=self._log_md_sample_rate)
         self.create_task(conn._run(self, self._md_url, ws_md_send_chan, ws_md_recv_chan))
 
         md_handler_logger = ShinnyLoggerAdapter(self._logger.getChild("MdReconnect"), url=self._md_url)
@@ -3611,19 +3788,25 @@ class TqApi(TqBaseApi):
         ws_md_recv_chan._logger_bind(chan_to="md_reconn")
         md_reconnect = MdReconnectHandler(md_handler_logger)
         api_send_chan = TqChan(self, chan_name="send to md_reconn", logger=md_handler_logger)
-        api_recv_chan = TqChan(self, chan_name="recv from md_reconn", logger=md_handler_logger)
+        tq_symbols = TqSymbols()  # 合约服务模块，负责将 tqsdk 发送的 query 请求结果转为 quotes
+        tq_symbols_logger = ShinnyLoggerAdapter(self._logger.getChild("TqSymbols"))
+        tq_symbols_recv_chan = TqChan(self, chan_name="recv from tq_symbols", logger=tq_symbols_logger)
+        if self._sync_pipeline:
+            # 同步模式下 md_reconn 收到的数据包直接在 tq_symbols 中处理，tq_symbols 不需要 task
+            api_recv_chan = tq_symbols._pipe(self, tq_symbols_recv_chan, api_send_chan)
+        else:
+            api_recv_chan = TqChan(self, chan_name="recv from md_reconn", logger=md_handler_logger)
         self.create_task(md_reconnect._run(self, api_send_chan, api_recv_chan, ws_md_send_chan, ws_md_recv_chan))
         ws_md_send_chan, ws_md_recv_chan = api_send_chan, api_recv_chan
 
-        # 合约服务模块，负责将 tqsdk 发送的 query 请求结果转为 quotes
-        tq_symbols = TqSymbols()
         ws_md_send_chan._logger_bind(chan_from="tq_symbols")
         ws_md_recv_chan._logger_bind(chan_to="tq_symbols")
-        tq_symbols_logger = ShinnyLoggerAdapter(self._logger.getChild("TqSymbols"))
-        tq_symbols_send_chan = TqChan(self, chan_name="send to tq_symbols", logger=tq_symbols_logger)
-        tq_symbols_recv_chan = TqChan(self, chan_name="recv from tq_symbols", logger=tq_symbols_logger)
-        self.create_task(
-            tq_symbols._run(self, tq_symbols_send_chan, tq_symbols_recv_chan, ws_md_send_chan, ws_md_recv_chan))
+        if self._sync_pipeline:
+            tq_symbols_send_chan = tq_symbols._pipe_sim_send()
+        else:
+            tq_symbols_send_chan = TqChan(self, chan_name="send to tq_symbols", logger=tq_symbols_logger)
+            self.create_task(
+                tq_symbols._run(self, tq_symbols_send_chan, tq_symbols_recv_chan, ws_md_send_chan, ws_md_recv_chan))
         ws_md_send_chan, ws_md_recv_chan = tq_symbols_send_chan, tq_symbols_recv_chan
 
         # 复盘模式，定时发送心跳包, 并将复盘日期发在行情的 recv_chan
@@ -3656,6 +3839,17 @@ class TqApi(TqBaseApi):
             self.create_task(ts._run(self, ts_send_chan, ts_recv_chan, ws_md_send_chan, ws_md_recv_chan))
             ws_md_send_chan, ws_md_recv_chan = ts_send_chan, ts_recv_chan
 
+        if self._sync_pipeline and not self._web_gui:
+            # 同步模式下 web_helper 及 data_extension 不需要 task，账户实例发出的数据包直接在 data_extension 中处理后发到 api
+            data_extension = DataExtension(self)
+            data_extension_recv_chan = self._recv_chan
+            data_extension_send_chan, account_recv_chan = data_extension._pipe(data_extension_recv_chan, tq_web_helper._pipe(self._send_chan))
+            self._account._setup_connection(self, self._send_chan, account_recv_chan, ws_md_send_chan, ws_md_recv_chan)
+            self._send_chan = data_extension_send_chan
+            self._send_chan._logger_bind(chan_from="api")
+            self._recv_chan._logger_bind(chan_to="api")
+            return
+
         # 启动账户实例并连接交易服务器
         self._account._setup_connection(self, self._send_chan, self._recv_chan, ws_md_send_chan, ws_md_recv_chan)
 
@@ -3678,9 +3872,14 @@ class TqApi(TqBaseApi):
         self._send_chan._logger_bind(chan_from="api")
         self._recv_chan._logger_bind(chan_to="api")
 
-    def _fetch_symbol_info(self, url):
-        """获取合约信息"""
-        rsp = requests.get(url, headers=self._base_headers, timeout=30)
+    def _fetch_symbol_info(self, url, add_night=False):
+        """获取合约信息，合约服务返回的 ETag 与本地快照一致时直接使用本地快照"""
+        name = f"symbols.{hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]}"
+        snapshot, etag = InsSnapshot._load(name, add_night)
+        headers = self._base_headers if snapshot is None or etag is None else {**self._base_headers, "If-None-Match": etag}
+        rsp = requests.get(url, headers=headers, timeout=30)
+        if rsp.status_code == 304 and snapshot is not None:
+            return snapshot
         rsp.raise_for_status()
         quotes = {
             k: {
@@ -3713,9 +3912,17 @@ class TqApi(TqBaseApi):
         for k, v in quotes.items():
             if k.startswith("CFFEX.IO") and v["ins_class"] == "OPTION":
                 v["underlying_symbol"] = "SSE.000300"
-        return quotes
+        snapshot = InsSnapshot.from_quotes(quotes, add_night)
+        if rsp.headers.get("ETag"):
+            snapshot._dump(name, rsp.headers["ETag"])
+        return snapshot
 
     def _init_serial(self, root_list, width, default, adj_type):
+        # 单合约序列只需要保留最近 width 条数据；多合约序列初始化时会请求 10000 条主合约数据，
+        # 副合约在相同时间段内的数据条数可能多于主合约（例如副合约有夜盘），所以预留更大的空间
+        capacity = width if len(root_list) == 1 else 4 * 10000
+        for root in root_list:
+            _ensure_columnar(root, default, capacity)
         last_id_list = [root.get("last_id", -1) for root in root_list]
         # 主合约的array字段
         array = [[default["datetime"]] + [i] + [default[k] for k in default if k != "datetime"] for i in
@@ -3797,6 +4004,25 @@ class TqApi(TqBaseApi):
         symbol = serial["chart"]["ins_list"].split(",")[0]  # 合约列表
         quote = self._data.quotes.get(symbol, {})
         duration = serial["chart"]["duration"]  # 周期
+        if not (serial["adj_type"] in ["B", "F"] and quote.ins_class in ["STOCK", "FUND"]):
+            # 不需要复权时，直接从列式存储中批量读取需要更新的行
+            store = serial["root"][0]["data"]
+            first_id = last_id - serial["width"] + 1
+            if serial["update_row"] == 0:
+                ids = np.arange(first_id, last_id + 1)
+            else:
+                # 只更新新生成的K线，以及本次 diff 中收到更新的K线，只更新最后一根K线时与 data_length 无关
+                new_first_id = first_id + serial["update_row"] + 1
+                ids = np.arange(new_first_id, last_id + 1)
+                updated_ids = [i for i in store._updated_ids if first_id <= i < new_first_id]
+                if updated_ids:
+                    ids = np.concatenate([np.array(sorted(updated_ids), dtype=np.int64), ids])
+            rows = ids - first_id
+            datetime_col, values = store._take(ids)
+            array[rows, 0] = datetime_col
+            array[rows, 1] = ids
+            array[rows, 2:] = values
+            return
         keys = list(serial["default"].keys())
         keys.remove('datetime')
         if duration != 0:
@@ -4071,13 +4297,13 @@ class TqApi(TqBaseApi):
         """所有业务数据的原型"""
         return {
             "quotes": {
-                "#": Quote(self),  # 行情的数据原型
+                "#": (CompactQuote if self._compact_objs else Quote)(self),  # 行情的数据原型
             },
             "klines": {
                 "*": {
                     "*": {
                         "data": {
-                            "@": Kline(self),  # K线的数据原型
+                            "@": (CompactKline if self._compact_objs else Kline)(self),  # K线的数据原型
                         }
                     }
                 }
@@ -4085,7 +4311,7 @@ class TqApi(TqBaseApi):
             "ticks": {
                 "*": {
                     "data": {
-                        "@": Tick(self),  # Tick的数据原型
+                        "@": (CompactTick if self._compact_objs else Tick)(self),  # Tick的数据原型
                     }
                 }
             },
@@ -4120,13 +4346,13 @@ class TqApi(TqBaseApi):
         """所有业务数据的原型"""
         return {
             "quotes": {
-                "#": Quote(self),  # 行情的数据原型
+                "#": (CompactQuote if self._compact_objs else Quote)(self),  # 行情的数据原型
             },
             "klines": {
                 "*": {
                     "*": {
                         "data": {
-                            "@": Kline(self),  # K线的数据原型
+                            "@": (CompactKline if self._compact_objs else Kline)(self),  # K线的数据原型
                         }
                     }
                 }
@@ -4134,7 +4360,7 @@ class TqApi(TqBaseApi):
             "ticks": {
                 "*": {
                     "data": {
-                        "@": Tick(self),  # Tick的数据原型
+                        "@": (CompactTick if self._compact_objs else Tick)(self),  # Tick的数据原型
                     }
                 }
             },
@@ -4158,36 +4384,42 @@ class TqApi(TqBaseApi):
 
     @staticmethod
     def _deep_copy_dict(source, dest):
-        for key, value in source.__dict__.items():
-            if isinstance(value, Entity):
+        # CompactEntity 的字段保存在 __slots__ 中，不在 __dict__ 里
+        items = source._items().items() if isinstance(source, CompactEntity) else source.__dict__.items()
+        for key, value in items:
+            if isinstance(value, ColumnarSeries):
+                dest[key] = {k: {f: v for f, v in item.items()} for k, item in value.items()}
+            elif isinstance(value, Entity):
                 dest[key] = {}
                 TqApi._deep_copy_dict(value, dest[key])
             else:
                 dest[key] = value
 
-    def _slave_send_pack(self, pack):
+    def _slave_send_pack(self, pack, slave):
         if pack.get("aid", None) == "subscribe_quote":
-            self._loop.call_soon_threadsafe(lambda: self._send_subscribe_quote(pack))
+            self._loop.call_soon_threadsafe(lambda: self._on_slave_subscribe_quote(slave, pack))
             return
         self._loop.call_soon_threadsafe(lambda: self._send_pack(pack))
 
     def _slave_recv_pack(self, pack):
         self._loop.call_soon_threadsafe(lambda: self._recv_chan.send_nowait(pack))
 
-    def _send_subscribe_quote(self, pack):
-        new_subscribe_set = self._requests["quotes"] | set(pack["ins_list"].split(","))
-        if new_subscribe_set != self._requests["quotes"]:
-            self._requests["quotes"] = new_subscribe_set
-            self._send_pack({
-                "aid": "subscribe_quote",
-                "ins_list": ",".join(self._requests["quotes"])
-            })
+    def _on_slave_subscribe_quote(self, slave, pack):
+        """slave 发来的是其全量订阅列表，与 master 自身的订阅合并后发出"""
+        self._quote_subscribe.set_source(slave, pack["ins_list"].split(","))
+        self._schedule_subscribe_quote()
+
+    def _send_subscribe_quote(self):
+        self._quote_subscribe_scheduled = False
+        pack = self._quote_subscribe.make_pack()
+        if pack:
+            self._send_pack(pack)
 
     def _send_pack(self, pack):
         if not self._is_slave:
             self._send_chan.send_nowait(pack)
         else:
-            self._master._slave_send_pack(pack)
+            self._master._slave_send_pack(pack, self)
 
     def draw_text(self, base_k_dataframe: pd.DataFrame, text: str, x: Optional[int] = None, y: Optional[float] = None,
                   id: Optional[str] = None, board: str = "MAIN", color: Union[str, int] = "red") -> None:
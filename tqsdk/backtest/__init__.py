@@ -4,4 +4,6 @@
 __author__ = 'mayanqiong'
 
 from tqsdk.backtest.backtest import TqBacktest
-from tqsdk.backtest.replay import TqReplay
\ No newline at end of file
+from tqsdk.backtest.replay import TqReplay
+from tqsdk.backtest.vector import TqVectorBacktest
+from tqsdk.backtest.sweep import TqBacktestSweep
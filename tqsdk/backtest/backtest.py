@@ -5,12 +5,19 @@ __author__ = 'mayanqiong'
 
 
 import asyncio
+import heapq
+import itertools
 import math
+import os
 from datetime import date, datetime
 from typing import Union, Any, List, Dict
 
+import numpy as np
+from filelock import FileLock
+
 from tqsdk.backtest.utils import TqBacktestContinuous, TqBacktestDividend
 from tqsdk.channel import TqChan
+from tqsdk.data_series import DataSeries, CACHE_DIR
 from tqsdk.datetime import _get_trading_day_start_time, _get_trading_day_end_time, _get_trading_day_from_timestamp, \
     _timestamp_nano_to_str, _convert_user_input_to_nano
 from tqsdk.diff import _merge_diff, _get_obj
@@ -134,9 +141,14 @@ class TqBacktest(object):
         #   kline_or_tick: 当前 serial 计算行情对应的 kline 或者 tick
         #   when: 'TICK' 表示由 tick 产生的行情，'OPEN' | 'CLOSE' 是 kline 开盘或者收盘时的行情
         #   chart_id_set: 记录当前 serial 对应的所有 chart_id
+        #   order: 当前 serial 创建的顺序，行情时间相同时用于决定归并的先后
 
         # gc 是会循环 self._serials，来计算用户需要的数据，self._serials 不应该被删除，
         self._generators = {}  # 所有用户请求的 chart 序列相应的 generator 对象，创建时与 self._serials 一一对应，会在一个序列计算到最后一根 kline 时被删除
+        # 以 (timestamp, order, key) 组成的小顶堆，每个 generator 在堆中有且只有一项，用于 O(log N) 地取出行情时间最小的序列
+        # order 为序列创建的顺序，行情时间相同时按创建顺序取出，与遍历 self._generators 取最小值的顺序一致
+        self._generators_heap = []
+        self._generators_order = itertools.count()
         self._had_any_generator = False  # 回测过程中是否有过 generator 对象
         self._sim_recv_chan_send_count = 0  # 统计向下游发送的 diff 的次数，每 1w 次执行一次 gc
         self._quotes = {}  # 记录 min_duration 记录某一合约的最小duration； sended_init_quote 是否已经过这个合约的初始行情
@@ -337,8 +349,7 @@ class TqBacktest(object):
         quotes_helper = {}  # 记录生成行情信息的辅助信息, 用于计算最后返回 quote_diffs
         while self._generators:
             # self._generators 存储了 generator，self._serials 记录一些辅助的信息
-            min_request_key = min(self._generators.keys(), key=lambda serial: self._serials[serial]["timestamp"])
-            timestamp = self._serials[min_request_key]["timestamp"]  # 所有已订阅数据中的最小行情时间
+            timestamp, _, min_request_key = self._generators_heap[0]  # 所有已订阅数据中的最小行情时间
             is_before_current_dt = timestamp < self._current_dt  # 生成这笔行情的时间是否小于当前回测时间
             # 推进时间，一次只会推进最多一个(补数据时有可能是0个)行情时间，并确保<=该行情时间的行情都被发出
             # 如果行情时间大于当前回测时间 则 判断是否diff中已有数据；否则表明此行情时间的数据未全部保存在diff中，则继续append
@@ -347,6 +358,7 @@ class TqBacktest(object):
                     break
                 else:
                     self._current_dt = timestamp  # 否则将回测时间更新至最新行情时间
+            heapq.heappop(self._generators_heap)
             diff = self._serials[min_request_key]["diff"]
             self._diffs.append(diff)
             # klines 请求，需要记录已经发送 api 的数据
@@ -438,7 +450,8 @@ class TqBacktest(object):
             })
             quote["min_duration"] = min(quote["min_duration"], dur)
             self._serials[(ins, dur)] = {
-                "chart_id_set": {chart_id} if chart_id else set()  # 记录当前 serial 对应的 chart_id
+                "chart_id_set": {chart_id} if chart_id else set(),  # 记录当前 serial 对应的 chart_id
+                "order": next(self._generators_order)  # 记录当前 serial 创建的顺序
             }
             self._generators[(ins, dur)] = self._gen_serial(ins, dur)
             self._had_any_generator = True
@@ -478,6 +491,7 @@ class TqBacktest(object):
         s = self._serials[key]
         try:
             s["timestamp"], s["diff"], s["kline_or_tick"], s["when"] = await self._generators[key].__anext__()
+            heapq.heappush(self._generators_heap, (s["timestamp"], s["order"], key))
         except StopAsyncIteration:
             del self._generators[key]  # 删除一个行情时间超过结束时间的 generator
 
@@ -505,6 +519,27 @@ class TqBacktest(object):
             serials = [_get_obj(self._data, ["ticks", symbol_list[0]])]
         else:
             serials = [_get_obj(self._data, ["klines", s, str(dur)]) for s in symbol_list]
+        resume_id = None  # 缓存中的数据发送完之后，从服务器继续请求数据的起始 id
+        cache_rows = None  # 从服务器收到的需要写入缓存的数据
+        if dur != 0 and len(symbol_list) == 1:
+            # 单合约 K 线优先使用 DataSeries 的缓存数据，只向服务器请求缓存中没有的部分，并将收到的数据写入缓存
+            cache_rows = []
+            cache_cols = DataSeries._get_data_cols(ins, dur)
+            cached = self._read_serial_cache(symbol_list[0], dur)
+            if cached is not None:
+                names = cached.dtype.names
+                for row in cached.tolist():
+                    item = {k: (int(v) if k in ("volume", "open_oi", "close_oi") and v == v else v)
+                            for k, v in zip(names[1:], row[1:])}
+                    diffs = self._get_kline_diffs(ins, dur, row[0], item, serials)
+                    for d in diffs:
+                        yield d
+                    if len(diffs) < 2:
+                        return
+                resume_id = int(cached[-1]["id"]) + 1
+                chart_info.pop("focus_datetime", None)
+                chart_info.pop("focus_position", None)
+                chart_info["left_kline_id"] = resume_id
         async with TqChan(self._api, last_only=True) as update_chan:
             for serial in serials:
                 serial["_listener"].add(update_chan)
@@ -543,7 +578,7 @@ class TqBacktest(object):
                     left_id = chart.get("left_id", -1)
                     right_id = chart.get("right_id", -1)
                     if current_id is None:
-                        current_id = max(left_id, 0)
+                        current_id = max(left_id, 0) if resume_id is None else max(left_id, resume_id)
                     # 发送下一段 chart 10000 根 kline
                     chart_info["chart_id"] = chart_id_b if chart_info["chart_id"] == chart_id_a else chart_id_a
                     chart_info["left_kline_id"] = right_id
@@ -552,7 +587,8 @@ class TqBacktest(object):
                     await self._md_send_chan.send(chart_info.copy())
                     while True:
                         if current_id > last_id:
-                            # 当前 id 已超过 last_id
+                            # 当前 id 已超过 last_id，收到的 K 线都已经完整，写入缓存
+                            self._write_serial_cache(symbol_list[0], dur, cache_rows)
                             return
                         # 将订阅的10000长度的窗口中的数据都遍历完后，退出循环，然后再次进入并处理下一窗口数据
                         if current_id > right_id:
@@ -574,94 +610,17 @@ class TqBacktest(object):
                                 return
                             yield item["datetime"], diff, item, "TICK"
                         else:
-                            timestamp = item["datetime"] if dur < 86400000000000 else _get_trading_day_start_time(
-                                item["datetime"])
-                            if timestamp > self._end_dt:  # 超过结束时间
+                            if cache_rows is not None and current_id < last_id:
+                                # 最后一根 K 线可能还没有结束，不写入缓存
+                                cache_rows.append([current_id, item["datetime"]] +
+                                                  [DataSeries._get_float_value(item, c) for c in cache_cols])
+                            diffs = self._get_kline_diffs(ins, dur, current_id, item, serials)
+                            for d in diffs:
+                                yield d
+                            if len(diffs) < 2:
+                                # 已经到达回测结束时间，收到的 K 线都已经完整，写入缓存
+                                self._write_serial_cache(symbol_list[0], dur, cache_rows)
                                 return
-                            binding = serials[0].get("binding", {})
-                            diff = {
-                                "klines": {
-                                    symbol_list[0]: {
-                                        str(dur): {
-                                            "last_id": current_id,
-                                            "data": {
-                                                str(current_id): {
-                                                    "datetime": item["datetime"],
-                                                    "open": item["open"],
-                                                    "high": item["open"],
-                                                    "low": item["open"],
-                                                    "close": item["open"],
-                                                    "volume": 0,
-                                                    "open_oi": item["open_oi"],
-                                                    "close_oi": item["open_oi"],
-                                                }
-                                            }
-                                        }
-                                    }
-                                }
-                            }
-                            for chart_id in self._serials[(ins, dur)]["chart_id_set"]:
-                                diff["charts"] = {
-                                    chart_id: {
-                                        "left_id": current_id - 10000 + 1,  # left_id 是当前窗口的左端点
-                                        "right_id": current_id  # api 中处理多合约 kline 需要 right_id 信息
-                                    }
-                                }
-                            for i, symbol in enumerate(symbol_list):
-                                if i == 0:
-                                    diff_binding = diff["klines"][symbol_list[0]][str(dur)].setdefault("binding", {})
-                                    continue
-                                other_id = binding.get(symbol, {}).get(str(current_id), -1)
-                                if other_id >= 0:
-                                    diff_binding[symbol] = {str(current_id): str(other_id)}
-                                    other_item = serials[i]["data"].get(str(other_id), {})
-                                    diff["klines"][symbol] = {
-                                        str(dur): {
-                                            "last_id": other_id,
-                                            "data": {
-                                                str(other_id): {
-                                                    "datetime": other_item["datetime"],
-                                                    "open": other_item["open"],
-                                                    "high": other_item["open"],
-                                                    "low": other_item["open"],
-                                                    "close": other_item["open"],
-                                                    "volume": 0,
-                                                    "open_oi": other_item["open_oi"],
-                                                    "close_oi": other_item["open_oi"],
-                                                }
-                                            }
-                                        }
-                                    }
-                            yield timestamp, diff, item, "OPEN"  # K线刚生成时的数据都为开盘价
-                            timestamp = item["datetime"] + dur - 1000 \
-                                if dur < 86400000000000 else _get_trading_day_start_time(item["datetime"] + dur) - 1000
-                            if timestamp > self._end_dt:  # 超过结束时间
-                                return
-                            diff = {
-                                "klines": {
-                                    symbol_list[0]: {
-                                        str(dur): {
-                                            "data": {
-                                                str(current_id): item,
-                                            }
-                                        }
-                                    }
-                                }
-                            }
-                            for i, symbol in enumerate(symbol_list):
-                                if i == 0:
-                                    continue
-                                other_id = binding.get(symbol, {}).get(str(current_id), -1)
-                                if other_id >= 0:
-                                    diff["klines"][symbol] = {
-                                        str(dur): {
-                                            "data": {
-                                                str(other_id): {k: v for k, v in
-                                                                serials[i]["data"].get(str(other_id), {}).items()}
-                                            }
-                                        }
-                                    }
-                            yield timestamp, diff, item, "CLOSE"  # K线结束时生成quote数据
                         current_id += 1
             finally:
                 # 释放chart资源
@@ -670,6 +629,138 @@ class TqBacktest(object):
                 chart_info["chart_id"] = chart_id_b if chart_info["chart_id"] == chart_id_a else chart_id_a
                 await self._md_send_chan.send(chart_info.copy())
 
+    def _read_serial_cache(self, symbol, dur):
+        """
+        从 DataSeries 的缓存中查找回测需要的 K 线，缓存中没有足够的数据时返回 None
+        与 chart 请求的窗口一致，从当前时间之前的 10000 根 K 线开始，返回 numpy 结构化数组
+        缓存文件在释放文件锁之后可能会被其他进程合并、删除，所以返回的是在持有锁时复制出的数据
+        """
+        DataSeries._ensure_cache_dir()
+        with FileLock(DataSeries._get_lock_path(symbol, dur), timeout=-1):
+            rangeset_id = DataSeries._get_rangeset_id(symbol, dur)
+            data_cols = DataSeries._get_data_cols(symbol, dur)
+            dtype = np.dtype([('id', 'i8'), ('datetime', 'i8')] + [(col, 'f8') for col in data_cols])
+            for index, (start_id, end_id) in enumerate(rangeset_id):
+                filename = os.path.join(CACHE_DIR, f"{symbol}.{dur}.{start_id}.{end_id}")
+                fp = np.memmap(filename, dtype=dtype, mode='r', shape=end_id - start_id)
+                # 最后一个缓存文件的最后一根 K 线可能是过时的，不使用
+                rows = end_id - start_id - 1 if index == len(rangeset_id) - 1 else end_id - start_id
+                focus_row = int(np.searchsorted(fp["datetime"][:rows], self._current_dt, side="left"))
+                if focus_row >= rows:
+                    fp._mmap.close()
+                    continue  # 当前时间之后的 K 线不在此文件中
+                array = np.array(fp[max(focus_row - 10000, 0):rows]) if focus_row >= 10000 or start_id == 0 else None
+                fp._mmap.close()
+                return array  # focus_row 之前不足 10000 根 K 线时，缓存中没有足够的历史 K 线，返回 None
+        return None
+
+    def _write_serial_cache(self, symbol, dur, rows):
+        """将从服务器收到的 K 线写入 DataSeries 的缓存，写入失败不影响回测"""
+        if not rows:
+            return
+        try:
+            with FileLock(DataSeries._get_lock_path(symbol, dur), timeout=-1):
+                DataSeries._write_cache(symbol, dur, rows)
+        except Exception as e:
+            self._logger.debug("write cache failed", symbol=symbol, dur=dur, exception=repr(e))
+
+    def _get_kline_diffs(self, ins, dur, current_id, item, serials):
+        """
+        根据一根 K 线生成开盘及收盘时发送的 diff，返回 [(timestamp, diff, item, when), ...]
+        超过回测结束时间的部分不会返回，返回的列表长度小于 2 时说明 K 线序列已经结束
+        """
+        symbol_list = ins.split(',')
+        diffs = []
+        timestamp = item["datetime"] if dur < 86400000000000 else _get_trading_day_start_time(
+            item["datetime"])
+        if timestamp > self._end_dt:  # 超过结束时间
+            return diffs
+        binding = serials[0].get("binding", {})
+        diff = {
+            "klines": {
+                symbol_list[0]: {
+                    str(dur): {
+                        "last_id": current_id,
+                        "data": {
+                            str(current_id): {
+                                "datetime": item["datetime"],
+                                "open": item["open"],
+                                "high": item["open"],
+                                "low": item["open"],
+                                "close": item["open"],
+                                "volume": 0,
+                                "open_oi": item["open_oi"],
+                                "close_oi": item["open_oi"],
+                            }
+                        }
+                    }
+                }
+            }
+        }
+        for chart_id in self._serials[(ins, dur)]["chart_id_set"]:
+            diff["charts"] = {
+                chart_id: {
+                    "left_id": current_id - 10000 + 1,  # left_id 是当前窗口的左端点
+                    "right_id": current_id  # api 中处理多合约 kline 需要 right_id 信息
+                }
+            }
+        for i, symbol in enumerate(symbol_list):
+            if i == 0:
+                diff_binding = diff["klines"][symbol_list[0]][str(dur)].setdefault("binding", {})
+                continue
+            other_id = binding.get(symbol, {}).get(str(current_id), -1)
+            if other_id >= 0:
+                diff_binding[symbol] = {str(current_id): str(other_id)}
+                other_item = serials[i]["data"].get(str(other_id), {})
+                diff["klines"][symbol] = {
+                    str(dur): {
+                        "last_id": other_id,
+                        "data": {
+                            str(other_id): {
+                                "datetime": other_item["datetime"],
+                                "open": other_item["open"],
+                                "high": other_item["open"],
+                                "low": other_item["open"],
+                                "close": other_item["open"],
+                                "volume": 0,
+                                "open_oi": other_item["open_oi"],
+                                "close_oi": other_item["open_oi"],
+                            }
+                        }
+                    }
+                }
+        diffs.append((timestamp, diff, item, "OPEN"))  # K线刚生成时的数据都为开盘价
+        timestamp = item["datetime"] + dur - 1000 \
+            if dur < 86400000000000 else _get_trading_day_start_time(item["datetime"] + dur) - 1000
+        if timestamp > self._end_dt:  # 超过结束时间
+            return diffs
+        diff = {
+            "klines": {
+                symbol_list[0]: {
+                    str(dur): {
+                        "data": {
+                            str(current_id): item,
+                        }
+                    }
+                }
+            }
+        }
+        for i, symbol in enumerate(symbol_list):
+            if i == 0:
+                continue
+            other_id = binding.get(symbol, {}).get(str(current_id), -1)
+            if other_id >= 0:
+                diff["klines"][symbol] = {
+                    str(dur): {
+                        "data": {
+                            str(other_id): {k: v for k, v in
+                                            serials[i]["data"].get(str(other_id), {}).items()}
+                        }
+                    }
+                }
+        diffs.append((timestamp, diff, item, "CLOSE"))  # K线结束时生成quote数据
+        return diffs
+
     def _gc_data(self):
         # api 应该删除的数据 diff
         need_rangeset = {}
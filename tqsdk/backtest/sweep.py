@@ -0,0 +1,135 @@
+#!usr/bin/env python3
+# -*- coding:utf-8 -*-
+__author__ = 'mayanqiong'
+
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from typing import Callable, Dict, List, Optional, Union
+
+import pandas as pd
+from filelock import FileLock
+
+from tqsdk.backtest.vector import TqVectorBacktest, KLINE_COLS
+from tqsdk.data_series import DataSeries
+
+_worker_klines = {}  # 工作进程中已经打开的缓存数据 {symbol: {col: memmap}}，每个进程只打开一次
+
+
+def _init_worker(cache_keys):
+    """工作进程初始化，以只读 memmap 方式打开缓存文件，所有进程共享同一份磁盘缓存 (Windows 上为复制的数据，参见 DataSeries._read_cache)"""
+    for symbol, dur_nano, start_dt_nano, end_dt_nano in cache_keys:
+        with FileLock(DataSeries._get_lock_path(symbol, dur_nano), timeout=-1):
+            array = DataSeries._read_cache(symbol, dur_nano, start_dt_nano, end_dt_nano)
+        if array is None:
+            raise Exception(f"合约 {symbol} 在回测时间段内没有 K 线数据")
+        _worker_klines[symbol] = {k: array[k] for k in KLINE_COLS}
+
+
+def _run_backtest(start_dt, end_dt, init_balance, strategy, dur_nano, quotes, symbol_list, params):
+    """在工作进程中执行一组参数的回测，返回 TqReport 统计信息"""
+    bt = TqVectorBacktest(start_dt, end_dt, init_balance=init_balance)
+    bt._duration = dur_nano
+    bt._quotes = quotes
+    bt._klines = {s: _worker_klines[s] for s in symbol_list}
+    bt._run(lambda b: strategy(b, **params), symbol_list)
+    return bt.tqsdk_stat
+
+
+class TqBacktestSweep(object):
+    """
+    天勤参数扫描类
+
+    对同一个策略的多组参数分别执行回测，每组参数的回测使用 TqVectorBacktest，在 ProcessPoolExecutor 的工作进程中并行执行。
+
+    K 线数据及合约信息只在主进程中通过 api 获取一次，K 线数据保存在 DataSeries 的缓存目录 (~/.tqsdk/data_series_1) 中，
+    各工作进程以只读 memmap 方式打开同一份缓存文件，不需要各自创建 TqApi、登录及下载数据。
+
+    策略函数需要能被 pickle（即定义在模块顶层），签名为 strategy(bt, **params)，其中 bt 为 TqVectorBacktest 实例。
+
+    Example::
+
+        from datetime import date
+        from tqsdk import TqApi, TqAuth
+        from tqsdk.backtest import TqBacktestSweep
+
+        def strategy(bt, short, long):
+            klines = bt.get_klines("SHFE.cu2105")
+            if len(klines["close"]) < long:
+                return
+            position = bt.get_position("SHFE.cu2105")
+            pos = position["pos_long_his"] + position["pos_long_today"]
+            if klines["close"][-short:].mean() > klines["close"][-long:].mean() and pos == 0:
+                bt.insert_order("SHFE.cu2105", direction="BUY", offset="OPEN", volume=1)
+            elif klines["close"][-short:].mean() < klines["close"][-long:].mean() and pos > 0:
+                bt.insert_order("SHFE.cu2105", direction="SELL", offset="CLOSE", volume=pos)
+
+        if __name__ == "__main__":
+            api = TqApi(auth=TqAuth("快期账户", "账户密码"))
+            sweep = TqBacktestSweep(start_dt=date(2021, 1, 4), end_dt=date(2021, 3, 31))
+            df = sweep.run(api, strategy, {"short": [5, 10], "long": [20, 30, 60]}, "SHFE.cu2105", 60)
+            api.close()
+            print(df.sort_values("sharpe_ratio", ascending=False))
+    """
+
+    def __init__(self, start_dt: Union[date, datetime], end_dt: Union[date, datetime],
+                 init_balance: float = 10000000.0, max_workers: Optional[int] = None) -> None:
+        """
+        创建参数扫描实例
+
+        Args:
+            start_dt (date/datetime): 回测起始时间，如果类型为 date 则指的是交易日，如果为 datetime 则指的是具体时间点
+
+            end_dt (date/datetime): 回测结束时间，如果类型为 date 则指的是交易日，如果为 datetime 则指的是具体时间点
+
+            init_balance (float): [可选]每组参数回测的初始资金, 默认为一千万
+
+            max_workers (int): [可选]工作进程数，默认为 None 表示使用 cpu 核数
+        """
+        self._vector_backtest = TqVectorBacktest(start_dt, end_dt, init_balance=init_balance)  # 用于检查参数
+        self._start_dt, self._end_dt = start_dt, end_dt
+        self._init_balance = init_balance
+        self._max_workers = max_workers
+
+    def run(self, api, strategy: Callable, params: Union[Dict[str, list], List[dict]],
+            symbol: Union[str, List[str]], duration_seconds: int) -> pd.DataFrame:
+        """
+        执行参数扫描
+
+        Args:
+            api (TqApi): 用于获取合约信息及下载 K 线数据的 TqApi 实例，不能是回测或复盘模式
+
+            strategy (Callable): 策略函数，签名为 strategy(bt, **params)
+
+            params (dict/list of dict): 参数网格，如 {"short": [5, 10], "long": [20, 30]} 会生成全部 4 种组合；\
+            也可以直接传入参数组合的列表，如 [{"short": 5, "long": 20}, {"short": 10, "long": 30}]
+
+            symbol (str/list of str): 合约代码，或者合约代码列表
+
+            duration_seconds (int): K 线周期, 以秒为单位
+
+        Returns:
+            pandas.DataFrame: 每组参数一行，列为参数名称及回测统计信息 (TqReport.default_metrics)
+        """
+        if isinstance(params, dict):
+            names = list(params.keys())
+            params = [dict(zip(names, values)) for values in itertools.product(*[params[n] for n in names])]
+        if len(params) == 0:
+            raise Exception("参数组合不能为空")
+        symbol_list = symbol if isinstance(symbol, list) else [symbol]
+        dur_nano = int(duration_seconds) * 1000000000
+        quotes, cache_keys = {}, []
+        for s in symbol_list:
+            quote = api.get_quote(s)
+            if quote.ins_class != "FUTURE":
+                raise Exception(f"TqBacktestSweep 目前只支持期货合约，{s} 合约类型为 {quote.ins_class}")
+            quotes[s] = self._vector_backtest._init_quote(quote)
+            api.get_kline_data_series(s, duration_seconds, self._start_dt, self._end_dt)  # 下载数据到缓存目录
+            # 与 DataSeries 一致，用户需要的时间段为 [start_dt_nano, end_dt_nano + 1)
+            cache_keys.append((s, dur_nano, self._vector_backtest._start_dt, self._vector_backtest._end_dt + 1))
+        with ProcessPoolExecutor(max_workers=self._max_workers, initializer=_init_worker,
+                                 initargs=(cache_keys,)) as executor:
+            futures = [executor.submit(_run_backtest, self._start_dt, self._end_dt, self._init_balance, strategy,
+                                       dur_nano, quotes, symbol_list, p) for p in params]
+            stats = [f.result() for f in futures]
+        return pd.DataFrame([{**p, **stat} for p, stat in zip(params, stats)])
@@ -0,0 +1,300 @@
+#!usr/bin/env python3
+# -*- coding:utf-8 -*-
+__author__ = 'mayanqiong'
+
+from datetime import date, datetime
+from typing import Callable, Dict, List, Optional, Union
+
+import numpy as np
+
+from tqsdk.backtest.backtest import TqBacktest
+from tqsdk.datetime import _convert_user_input_to_nano, _get_trading_day_start_time, _get_trading_day_end_time, \
+    _get_trading_day_from_timestamp, _timestamp_nano_to_str, _str_to_timestamp_nano, _is_in_trading_time
+from tqsdk.report import TqReport
+from tqsdk.tradeable.sim.trade_future import SimTrade
+from tqsdk.utils import _generate_uuid
+
+KLINE_COLS = ["datetime", "open", "high", "low", "close", "volume", "open_oi", "close_oi"]
+
+
+class TqVectorBacktest(object):
+    """
+    天勤向量化回测类
+
+    TqBacktest 回测时每根 K 线都要经过 TqBacktest -> TqSim -> TqApi 的 asyncio 通道传递，并由 _merge_diff 更新数据，
+    对于参数较多、回测区间较长的单账户期货策略，大部分时间消耗在这条管线上。
+
+    TqVectorBacktest 一次性通过 api.get_kline_data_series 把回测区间内的 K 线下载为 numpy 数组，
+    之后不再经过 asyncio 通道，直接在循环中按照与 TqBacktest 相同的规则生成行情、驱动与 TqSim 相同的撮合逻辑 (SimTrade)，
+    并在每根 K 线结束时调用用户的策略函数，因此在相同的 K 线及下单序列下，成交记录与统计结果与 TqBacktest 保持一致。
+
+    限制:
+        * 只支持期货合约，不支持期权、股票
+        * 只支持单一周期的 K 线，策略只在每根 K 线结束时被调用，下单时使用该 K 线的收盘价对应的盘口撮合
+        * 策略函数中只能使用 TqVectorBacktest 提供的接口，不能调用 api.wait_update 等接口
+        * api.get_kline_data_series 为专业版功能，需要有专业版权限
+
+    Example::
+
+        from datetime import date
+        from tqsdk import TqApi, TqAuth
+        from tqsdk.backtest import TqVectorBacktest
+
+        def strategy(bt):
+            klines = bt.get_klines("SHFE.cu2105")
+            if len(klines["close"]) < 20:
+                return
+            ma = klines["close"][-20:].mean()
+            position = bt.get_position("SHFE.cu2105")
+            if klines["close"][-1] > ma and position["pos_long_his"] + position["pos_long_today"] == 0:
+                bt.insert_order("SHFE.cu2105", direction="BUY", offset="OPEN", volume=1)
+            elif klines["close"][-1] < ma and position["pos_long_his"] + position["pos_long_today"] > 0:
+                bt.insert_order("SHFE.cu2105", direction="SELL", offset="CLOSE", volume=1)
+
+        api = TqApi(auth=TqAuth("快期账户", "账户密码"))
+        bt = TqVectorBacktest(start_dt=date(2021, 1, 4), end_dt=date(2021, 3, 31))
+        stat = bt.run(api, strategy, "SHFE.cu2105", 60)
+        print(stat["winning_rate"], stat["sharpe_ratio"])
+        api.close()
+    """
+
+    def __init__(self, start_dt: Union[date, datetime], end_dt: Union[date, datetime],
+                 init_balance: float = 10000000.0, account_id: str = "TQSIM") -> None:
+        """
+        创建向量化回测实例
+
+        Args:
+            start_dt (date/datetime): 回测起始时间，如果类型为 date 则指的是交易日，如果为 datetime 则指的是具体时间点
+
+            end_dt (date/datetime): 回测结束时间，如果类型为 date 则指的是交易日，如果为 datetime 则指的是具体时间点
+
+            init_balance (float): [可选]初始资金, 默认为一千万
+
+            account_id (str): [可选]账户名称，默认为 "TQSIM"，用于生成回测报告
+        """
+        if not isinstance(start_dt, (date, datetime)):
+            raise Exception("回测起始时间(start_dt)类型 %s 错误, 请检查 start_dt 数据类型是否填写正确" % (type(start_dt)))
+        if not isinstance(end_dt, (date, datetime)):
+            raise Exception("回测结束时间(end_dt)类型 %s 错误, 请检查 end_dt 数据类型是否填写正确" % (type(end_dt)))
+        self._start_dt_input, self._end_dt_input = start_dt, end_dt
+        self._start_dt, self._end_dt = _convert_user_input_to_nano(start_dt, end_dt)
+        self._init_balance = init_balance
+        self._account_id = account_id
+        self.trade_log = {}  # 日期->交易记录及收盘时的权益及持仓
+        self.tqsdk_stat = {}  # 回测结束后的统计信息
+
+    def run(self, api, strategy: Callable[["TqVectorBacktest"], None], symbol: Union[str, List[str]],
+            duration_seconds: int) -> dict:
+        """
+        执行回测
+
+        Args:
+            api (TqApi): 用于获取合约信息及下载 K 线数据的 TqApi 实例，不能是回测或复盘模式
+
+            strategy (Callable): 策略函数，每根 K 线结束时以当前 TqVectorBacktest 实例为参数调用一次；\
+            多个合约的 K 线在同一时刻结束时只调用一次
+
+            symbol (str/list of str): 合约代码，或者合约代码列表
+
+            duration_seconds (int): K 线周期, 以秒为单位，不能为 0
+
+        Returns:
+            dict: 回测结束后的统计信息，与 TqSim 回测结束时的 tqsdk_stat 相同
+        """
+        symbol_list = symbol if isinstance(symbol, list) else [symbol]
+        duration_seconds = int(duration_seconds)
+        if duration_seconds <= 0 or (duration_seconds > 86400 and duration_seconds % 86400 != 0):
+            raise Exception("K线数据周期 %d 错误, 请检查 K 线周期数据是否填写正确" % duration_seconds)
+        self._duration = duration_seconds * 1000000000
+        self._quotes = {}
+        self._klines = {}
+        for s in symbol_list:
+            quote = api.get_quote(s)
+            if quote.ins_class != "FUTURE":
+                raise Exception(f"TqVectorBacktest 目前只支持期货合约，{s} 合约类型为 {quote.ins_class}")
+            self._quotes[s] = self._init_quote(quote)
+            df = api.get_kline_data_series(s, duration_seconds, self._start_dt_input, self._end_dt_input)
+            self._klines[s] = {k: df[k].to_numpy() for k in KLINE_COLS}
+        self._run(strategy, symbol_list)
+        return self.tqsdk_stat
+
+    @property
+    def current_datetime(self) -> int:
+        """当前回测时间，纳秒级时间戳"""
+        return _str_to_timestamp_nano(self._current_datetime)
+
+    def get_klines(self, symbol: str) -> Dict[str, np.ndarray]:
+        """
+        获取截止到当前时刻已经结束的 K 线
+
+        Args:
+            symbol (str): 合约代码
+
+        Returns:
+            dict: key 为 datetime/open/high/low/close/volume/open_oi/close_oi，value 为对应列的 numpy 数组（只读视图）
+        """
+        end = self._index[symbol] + 1
+        return {k: v[:end] for k, v in self._klines[symbol].items()}
+
+    def insert_order(self, symbol: str, direction: str, offset: str, volume: int,
+                     limit_price: Optional[float] = None) -> dict:
+        """
+        发送下单指令，参数含义与 TqApi.insert_order 一致
+
+        Args:
+            symbol (str): 合约代码
+
+            direction (str): "BUY" 或 "SELL"
+
+            offset (str): "OPEN", "CLOSE" 或 "CLOSETODAY"
+
+            volume (int): 下单交易数量
+
+            limit_price (float): [可选]下单价格, 默认为 None 表示市价单
+
+        Returns:
+            dict: 委托单，与 TqSim 中的委托单字段一致
+        """
+        if symbol not in self._quotes:
+            raise Exception(f"合约 {symbol} 不在回测合约列表中")
+        order_id = _generate_uuid("PYSDK_insert")
+        exchange_id, instrument_id = symbol.split(".", 1)
+        pack = {
+            "aid": "insert_order",
+            "user_id": self._account_id,
+            "order_id": order_id,
+            "exchange_id": exchange_id,
+            "instrument_id": instrument_id,
+            "direction": direction,
+            "offset": offset,
+            "volume": int(volume),
+            "price_type": "ANY" if limit_price is None else "LIMIT",
+            "time_condition": "IOC" if limit_price is None else "GFD",
+            "volume_condition": "ANY",
+        }
+        if limit_price is not None:
+            pack["limit_price"] = float(limit_price)
+        diffs, orders_events = self._sim_trade.insert_order(symbol, pack)
+        return self._sim_trade._orders.get(symbol, {}).get(order_id) or orders_events[-1]
+
+    def cancel_order(self, order_id: str) -> None:
+        """
+        发送撤单指令
+
+        Args:
+            order_id (str): 委托单号
+        """
+        for symbol, orders in self._sim_trade._orders.items():
+            if order_id in orders:
+                self._sim_trade.cancel_order(symbol, {"aid": "cancel_order", "user_id": self._account_id,
+                                                      "order_id": order_id})
+                return
+
+    def get_account(self) -> dict:
+        """获取账户资金信息，与 TqSim 中的账户字段一致，不能修改"""
+        return self._sim_trade._account
+
+    def get_position(self, symbol: str) -> dict:
+        """获取指定合约的持仓信息，与 TqSim 中的持仓字段一致，不能修改"""
+        return self._sim_trade._ensure_position(symbol, *self._sim_trade._get_quotes_by_symbol(symbol))
+
+    def _init_quote(self, quote) -> dict:
+        """生成撮合及回测报告需要的合约信息，与 TqBacktest 发送给 TqSim 的合约信息一致"""
+        q = {k: v for k, v in quote.items() if not k.startswith("_") and isinstance(v, (str, int, float, bool))}
+        q["trading_time"] = {k: v for k, v in quote.trading_time.items() if not k.startswith("_")}
+        return q
+
+    def _build_events(self, symbol_list: List[str]):
+        """
+        把所有合约的 K 线展开为按时间排序的事件数组，每根 K 线生成开盘 (OPEN) 及收盘 (CLOSE) 两个事件，
+        时间戳的计算规则与 TqBacktest._gen_serial 一致
+        """
+        timestamps, kinds, symbols, indexes = [], [], [], []
+        for i, s in enumerate(symbol_list):
+            dt = self._klines[s]["datetime"].astype(np.int64)
+            if self._duration < 86400000000000:
+                open_ts = dt
+                close_ts = dt + self._duration - 1000
+            else:
+                open_ts = np.array([_get_trading_day_start_time(int(t)) for t in dt], dtype=np.int64)
+                close_ts = np.array([_get_trading_day_start_time(int(t) + self._duration) - 1000 for t in dt],
+                                    dtype=np.int64)
+            for kind, ts in enumerate([open_ts, close_ts]):
+                timestamps.append(ts)
+                kinds.append(np.full(len(ts), kind, dtype=np.int8))
+                symbols.append(np.full(len(ts), i, dtype=np.int32))
+                indexes.append(np.arange(len(ts), dtype=np.int64))
+        timestamps, kinds = np.concatenate(timestamps), np.concatenate(kinds)
+        symbols, indexes = np.concatenate(symbols), np.concatenate(indexes)
+        # 按时间排序，同一时刻按合约在列表中的顺序及 K 线顺序，与 TqBacktest 中多个序列的合并顺序一致
+        order = np.lexsort((kinds, indexes, symbols, timestamps))
+        mask = timestamps[order] <= self._end_dt
+        order = order[mask]
+        return timestamps[order], kinds[order], symbols[order], indexes[order]
+
+    def _run(self, strategy, symbol_list: List[str]) -> None:
+        self.trade_log = {}
+        self.tqsdk_stat = {}
+        self._index = {s: -1 for s in symbol_list}
+        for s in symbol_list:
+            # get_klines 返回这些数组的切片，参数扫描时同一个工作进程的多次回测共用同一份数组，不允许策略修改
+            for v in self._klines[s].values():
+                v.flags.writeable = False
+        self._current_datetime = "1990-01-01 00:00:00.000000"
+        self._trading_day_end = "1990-01-01 18:00:00.000000"
+        self._sim_trade = SimTrade(account_key="vector", account_id=self._account_id, init_balance=self._init_balance,
+                                   get_trade_timestamp=lambda: _str_to_timestamp_nano(self._current_datetime),
+                                   is_in_trading_time=lambda quote: _is_in_trading_time(quote, self._current_datetime, float("nan")))
+        timestamps, kinds, symbols, indexes = self._build_events(symbol_list)
+        price_ticks = [self._quotes[s]["price_tick"] for s in symbol_list]
+        klines = [self._klines[s] for s in symbol_list]
+        sent_init_quote = set()
+        pending_close = False
+        for n in range(len(timestamps)):
+            ts, kind, i, index = int(timestamps[n]), kinds[n], symbols[n], int(indexes[n])
+            symbol = symbol_list[i]
+            if pending_close and ts != int(timestamps[n - 1]):
+                # 同一时刻所有合约的 K 线都已经结束后调用策略
+                pending_close = False
+                strategy(self)
+            current_datetime = _timestamp_nano_to_str(ts)
+            if current_datetime > self._current_datetime:
+                self._current_datetime = current_datetime
+            if self._current_datetime > self._trading_day_end:  # 结算
+                self._settle()
+                trading_day = _get_trading_day_from_timestamp(ts)
+                self._trading_day_end = _timestamp_nano_to_str(_get_trading_day_end_time(trading_day) - 999)
+            kline = {k: v[index] for k, v in klines[i].items()}
+            if kind == 0:
+                froms = ["open"]
+            elif self._sim_trade._orders.get(symbol):
+                froms = ["high", "low", "close"]  # 有挂单时才需要用最高最低价撮合
+            else:
+                froms = ["close"]
+            diffs = TqBacktest._get_quote_diffs_from_kline(symbol, price_ticks[i], ts, kline, froms)
+            if symbol not in sent_init_quote:
+                # 第一笔行情中带上合约信息
+                sent_init_quote.add(symbol)
+                diffs[0]["quotes"][symbol] = {**self._quotes[symbol], **diffs[0]["quotes"][symbol]}
+            for diff in diffs:
+                self._sim_trade.update_quotes(symbol, diff)
+            if kind == 1:
+                self._index[symbol] = index
+                pending_close = True
+        if pending_close:
+            strategy(self)
+        self._settle()
+        self._report()
+
+    def _settle(self):
+        if self._trading_day_end[:10] == "1990-01-01":
+            return
+        # 结算并记录账户截面
+        diffs, orders_events, trade_log = self._sim_trade.settle()
+        self.trade_log[self._trading_day_end[:10]] = trade_log
+
+    def _report(self):
+        if not self.trade_log:
+            return
+        report = TqReport(report_id=self._account_id, trade_log=self.trade_log, quotes=self._quotes)
+        self.tqsdk_stat = report.default_metrics
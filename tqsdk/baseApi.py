@@ -9,6 +9,8 @@ import time
 from asyncio import Future
 from typing import Optional, Coroutine
 
+from tqsdk.loop_profiler import LoopProfiler
+
 
 class TqBaseApi(object):
     """
@@ -28,6 +30,7 @@ class TqBaseApi(object):
         self._wait_timeout = False  # wait_update 是否触发超时
         self._tasks = set()  # 由api维护的所有根task，不包含子task，子task由其父task维护
         self._exceptions = []  # 由api维护的所有task抛出的例外
+        self._loop_profiler: Optional[LoopProfiler] = None  # 不为 None 时按照协程统计 EventLoop 中回调的耗时
         # 回测需要行情和交易 lockstep, 而 asyncio 没有将内部的 _ready 队列暴露出来,
         # 因此 monkey patch call_soon 函数用来判断是否有任务等待执行
         self._loop.call_soon = functools.partial(self._call_soon, self._loop.call_soon)
@@ -73,10 +76,14 @@ class TqBaseApi(object):
     def _call_soon(self, org_call_soon, callback, *args, **kargs):
         """ioloop.call_soon的补丁, 用来追踪是否有任务完成并等待执行"""
         self._event_rev += 1
+        if self._loop_profiler is not None:
+            callback = self._loop_profiler.wrap(callback)
         return org_call_soon(callback, *args, **kargs)
 
     def _run_once(self):
         """执行 ioloop 直到 ioloop.stop 被调用"""
+        if self._loop_profiler is not None:
+            self._loop_profiler.on_run()
         if not self._exceptions:
             self._loop.run_forever()
         if self._exceptions:
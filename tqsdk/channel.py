@@ -4,11 +4,16 @@ __author__ = 'yanqiong'
 
 import asyncio
 import sys
+import time
+import weakref
+from collections import deque
 from logging import Logger
-from typing import Any, TYPE_CHECKING, Union
+from typing import Any, Callable, Dict, List, Optional, TYPE_CHECKING, Tuple, Union
 
 from shinny_structlog import ShinnyLoggerAdapter
 
+from tqsdk.diff import _is_diff_recreating, _merge_diff_keep_deletions
+
 if TYPE_CHECKING:
     from tqsdk.api import TqApi
 
@@ -22,13 +27,31 @@ class TqChan(asyncio.Queue):
     from tqsdk import TqChan
     TqChan._level = 10
     ```
+    TqChan._level = 0 时不会调用日志接口，channel 收发数据没有额外开销。
+
+    排查问题时可以在运行过程中打开环形缓冲区记录，每个 channel 只保留最近收发的 N 个数据，不写日志文件
+    ```
+    TqChan._enable_trace(100)  # 每个 channel 保留最近 100 个数据
+    ...
+    traces = TqChan._get_traces()  # {"chan_id:chan_name": [(时间, 操作, 数据), ...]}
+    TqChan._disable_trace()
+    ```
+
+    消费者处理较慢时，可以通过 maxsize 限制 channel 中保存的数据个数，channel 已满时按照 policy 处理新发送的数据:
+    * "block": send 等待消费者取走数据，send_nowait 抛出 asyncio.QueueFull
+    * "drop_oldest": 丢弃最早发送的数据
+    * "coalesce": 将新的数据合并到最后一个数据中，只适用于 diff 或者 rtn_data 数据包，合并后 diff 中为 None 的字段 (删除) 仍然保留；
+      重新创建已删除节点的 diff 在 rtn_data 中作为新的一项保留，在单独的 diff 中无法表示，与其他不能合并的数据一样按照 "block" 处理
     """
 
     _chan_id: int = 0
     _level: int = 0
+    _trace_size: int = 0  # 大于 0 时每个 channel 记录最近收发的 _trace_size 个数据
+    _traced_chans: "weakref.WeakSet[TqChan]" = weakref.WeakSet()
+    _policies = ("block", "drop_oldest", "coalesce")
 
     def __init__(self, api: 'TqApi', last_only: bool = False, logger: Union[Logger, ShinnyLoggerAdapter, None] = None,
-                 chan_name: str = "") -> None:
+                 chan_name: str = "", maxsize: int = 0, policy: str = "block") -> None:
         """
         创建channel实例
 
@@ -36,17 +59,30 @@ class TqChan(asyncio.Queue):
             api (tqsdk.api.TqApi): TqApi 实例
 
             last_only (bool): 为True时只存储最后一个发送到channel的对象
+
+            maxsize (int): channel 中最多保存的数据个数，默认为 0 表示不限制
+
+            policy (str): channel 已满时对新发送数据的处理方式，"block" / "drop_oldest" / "coalesce"，默认为 "block"
         """
+        if policy not in TqChan._policies:
+            raise Exception(f"不支持的 channel 策略 {policy}，可选值为 {', '.join(TqChan._policies)}")
         logger = logger if logger else api._logger
         if isinstance(logger, Logger):
             self._logger = ShinnyLoggerAdapter(logger, chan_id=TqChan._chan_id, chan_name=chan_name)
         elif isinstance(logger, ShinnyLoggerAdapter):
             self._logger = logger.bind(chan_id=TqChan._chan_id, chan_name=chan_name)
+        self._chan_key = f"{TqChan._chan_id}:{chan_name}"
+        self._trace: Optional[deque] = None
         TqChan._chan_id += 1
         py_ver = sys.version_info
-        asyncio.Queue.__init__(self, loop=api._loop) if (py_ver.major == 3 and py_ver.minor < 10) else asyncio.Queue.__init__(self)
+        asyncio.Queue.__init__(self, maxsize, loop=api._loop) if (py_ver.major == 3 and py_ver.minor < 10) else asyncio.Queue.__init__(self, maxsize)
         self._last_only = last_only
         self._closed = False
+        self._policy = policy
+        self._high_water = 0  # channel 中数据个数的最大值
+        self._dropped = 0  # 因为 channel 已满丢弃的数据个数
+        self._coalesced = 0  # 因为 channel 已满合并到最后一个数据中的数据个数
+        self._coalesced_tail = None  # 合并时生成的队尾数据，只有这个对象可以直接修改，其他数据可能被发送方引用
 
     def _logger_bind(self, **kwargs):
         self._logger = self._logger.bind(**kwargs)
@@ -57,14 +93,107 @@ class TqChan(asyncio.Queue):
 
         Current policy: only sensitive password in req_login packs.
         """
-        if not self._logger.logger.isEnabledFor(TqChan._level):
-            return item
         if isinstance(item, dict) and item.get("aid") == "req_login":
             log_item = item.copy()
             log_item.pop("password", None)
             return log_item
         return item
 
+    def _log_item(self, op: str, item: Any) -> None:
+        """记录 channel 收发的数据，调用方需要先判断 TqChan._level 或 TqChan._trace_size 不为 0"""
+        if TqChan._level and self._logger.isEnabledFor(TqChan._level):
+            self._logger.log(TqChan._level, f"tqchan {op}", item=self._sanitize_log_item(item))
+        if TqChan._trace_size:
+            if self._trace is None or self._trace.maxlen != TqChan._trace_size:
+                self._trace = deque(self._trace or (), maxlen=TqChan._trace_size)
+                TqChan._traced_chans.add(self)
+            self._trace.append((time.time(), op, self._sanitize_log_item(item)))
+
+    @staticmethod
+    def _enable_trace(size: int = 100) -> None:
+        """打开环形缓冲区记录，每个 channel 保留最近收发的 size 个数据"""
+        if size <= 0:
+            raise Exception(f"环形缓冲区大小 {size} 应该大于 0")
+        TqChan._trace_size = size
+
+    @staticmethod
+    def _disable_trace() -> None:
+        """关闭环形缓冲区记录，并清空已经记录的数据"""
+        TqChan._trace_size = 0
+        for chan in list(TqChan._traced_chans):
+            chan._trace = None
+        TqChan._traced_chans.clear()
+
+    @staticmethod
+    def _get_traces() -> Dict[str, List[Tuple[float, str, Any]]]:
+        """返回每个 channel 记录的最近收发的数据 {"chan_id:chan_name": [(时间, 操作, 数据), ...]}"""
+        return {chan._chan_key: list(chan._trace) for chan in list(TqChan._traced_chans) if chan._trace}
+
+    def full(self) -> bool:
+        # 关闭时发送的 None 不受 maxsize 限制，避免消费者停止接收后 close 无法返回
+        return not self._closed and asyncio.Queue.full(self)
+
+    def _on_full(self, item: Any) -> bool:
+        """channel 已满时按照 policy 处理，返回 True 表示 item 已经合并到最后一个数据中，不需要再放入 channel"""
+        if self._policy == "drop_oldest":
+            asyncio.Queue.get_nowait(self)
+            self._dropped += 1
+        elif self._policy == "coalesce" and self._coalesce(item):
+            self._coalesced += 1
+            return True
+        return False
+
+    def _coalesce(self, item: Any) -> bool:
+        """将 item 合并到队尾的数据中，返回是否合并成功"""
+        tail = self._queue[-1]
+        if not isinstance(tail, dict) or not isinstance(item, dict) or tail.get("aid") != item.get("aid"):
+            return False
+        if item.get("aid") not in (None, "rtn_data"):
+            return False
+        if tail is not self._coalesced_tail:
+            # 第一次合并时复制队尾数据，不修改发送方的对象
+            if "aid" in tail:
+                tail = {"aid": "rtn_data", "data": self._merge_diffs(tail.get("data", []))}
+            else:
+                diffs = self._merge_diffs([tail])
+                if len(diffs) > 1:
+                    return False
+                tail = diffs[0]
+        if "aid" in item:
+            diffs = tail["data"]
+            for d in item.get("data", []):
+                self._merge_diffs([d], diffs)
+        else:
+            if _is_diff_recreating(tail, item):
+                return False
+            _merge_diff_keep_deletions(tail, item)
+        self._queue[-1] = tail
+        self._coalesced_tail = tail
+        return True
+
+    @staticmethod
+    def _merge_diffs(datas: List[Dict], diffs: Optional[List[Dict]] = None) -> List[Dict]:
+        """
+        将 datas 中的 diff 依次合并到 diffs 的最后一个 diff 中 (diffs 中的 diff 都是新建的)，返回 diffs
+        重新创建已删除节点的 diff 无法合并，会复制一份添加到 diffs 中，使删除和新的数据都能按顺序发给消费者
+        """
+        diffs = [{}] if not diffs else diffs
+        for d in datas:
+            if _is_diff_recreating(diffs[-1], d):
+                diffs.append({})
+            _merge_diff_keep_deletions(diffs[-1], d)
+        return diffs
+
+    def _get_stats(self) -> Dict[str, int]:
+        """返回 channel 的统计信息: 当前数据个数、最大数据个数、丢弃及合并的数据个数"""
+        return {
+            "qsize": self.qsize(),
+            "maxsize": self.maxsize,
+            "high_water": self._high_water,
+            "dropped": self._dropped,
+            "coalesced": self._coalesced,
+        }
+
     async def close(self) -> None:
         """
         关闭channel
@@ -86,8 +215,13 @@ class TqChan(asyncio.Queue):
             if self._last_only:
                 while not self.empty():
                     asyncio.Queue.get_nowait(self)
+            elif self.full() and self._on_full(item):
+                return
             await asyncio.Queue.put(self, item)
-            self._logger.log(TqChan._level, "tqchan send", item=self._sanitize_log_item(item))
+            if self.qsize() > self._high_water:
+                self._high_water = self.qsize()
+            if TqChan._level or TqChan._trace_size:
+                self._log_item("send", item)
 
     def send_nowait(self, item: Any) -> None:
         """
@@ -103,8 +237,13 @@ class TqChan(asyncio.Queue):
             if self._last_only:
                 while not self.empty():
                     asyncio.Queue.get_nowait(self)
+            elif self.full() and self._on_full(item):
+                return
             asyncio.Queue.put_nowait(self, item)
-            self._logger.log(TqChan._level, "tqchan send_nowait", item=self._sanitize_log_item(item))
+            if self.qsize() > self._high_water:
+                self._high_water = self.qsize()
+            if TqChan._level or TqChan._trace_size:
+                self._log_item("send_nowait", item)
 
     async def recv(self) -> Any:
         """
@@ -116,7 +255,8 @@ class TqChan(asyncio.Queue):
         if self._closed and self.empty():
             return None
         item = await asyncio.Queue.get(self)
-        self._logger.log(TqChan._level, "tqchan recv", item=self._sanitize_log_item(item))
+        if TqChan._level or TqChan._trace_size:
+            self._log_item("recv", item)
         return item
 
     def recv_nowait(self) -> Any:
@@ -132,7 +272,8 @@ class TqChan(asyncio.Queue):
         if self._closed and self.empty():
             return None
         item = asyncio.Queue.get_nowait(self)
-        self._logger.log(TqChan._level, "tqchan recv_nowait", item=self._sanitize_log_item(item))
+        if TqChan._level or TqChan._trace_size:
+            self._log_item("recv_nowait", item)
         return item
 
     def recv_latest(self, latest: Any) -> Any:
@@ -147,7 +288,8 @@ class TqChan(asyncio.Queue):
         """
         while (self._closed and self.qsize() > 1) or (not self._closed and not self.empty()):
             latest = asyncio.Queue.get_nowait(self)
-        self._logger.log(TqChan._level, "tqchan recv_latest", item=self._sanitize_log_item(latest))
+        if TqChan._level or TqChan._trace_size:
+            self._log_item("recv_latest", latest)
         return latest
 
     def __aiter__(self):
@@ -157,7 +299,8 @@ class TqChan(asyncio.Queue):
         value = await asyncio.Queue.get(self)
         if self._closed and self.empty():
             raise StopAsyncIteration
-        self._logger.log(TqChan._level, "tqchan recv_next", item=self._sanitize_log_item(value))
+        if TqChan._level or TqChan._trace_size:
+            self._log_item("recv_next", value)
         return value
 
     async def __aenter__(self):
@@ -165,3 +308,37 @@ class TqChan(asyncio.Queue):
 
     async def __aexit__(self, exc_type, exc, tb):
         await self.close()
+
+
+class TqPipeChan(TqChan):
+    """
+    同步转发的 channel，发送到 channel 中的数据直接交给 handler 处理，不经过队列，也不需要接收数据的 task
+
+    用于把不需要等待 I/O 的模块 (如 DataExtension、TqSymbols) 以函数调用的方式串联起来，
+    handler 中不能 await，需要继续发送的数据应该使用下一个 channel 的 send_nowait
+    """
+
+    def __init__(self, api: 'TqApi', handler: Callable[[Any], None],
+                 logger: Union[Logger, ShinnyLoggerAdapter, None] = None, chan_name: str = "") -> None:
+        """
+        创建同步转发的 channel 实例
+
+        Args:
+            api (tqsdk.api.TqApi): TqApi 实例
+
+            handler (Callable): 处理发送到 channel 中数据的函数
+        """
+        TqChan.__init__(self, api, logger=logger, chan_name=chan_name)
+        self._handler = handler
+
+    async def close(self) -> None:
+        self._closed = True
+
+    async def send(self, item: Any) -> None:
+        self.send_nowait(item)
+
+    def send_nowait(self, item: Any) -> None:
+        if not self._closed:
+            if TqChan._level or TqChan._trace_size:
+                self._log_item("pipe", item)
+            self._handler(item)
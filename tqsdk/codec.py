@@ -0,0 +1,88 @@
+#!usr/bin/env python3
+# -*- coding:utf-8 -*-
+__author__ = 'mayanqiong'
+
+"""
+websocket 收发数据包使用的 json 编解码
+
+默认按照 orjson > ujson > json 的顺序使用第一个可以 import 的库，也可以通过环境变量 TQ_JSON_CODEC 指定 (orjson / ujson / json)。
+* 解码: orjson / ujson 遇到不支持的数据 (如 NaN、Infinity) 时使用 json 模块解码，解码的结果与 json 模块一致
+* 编码: orjson 会把 NaN、Infinity 编码为 null，而发出的数据包 (如委托单价格) 中可能有这些值，所以 OrjsonCodec 使用 json 模块编码；
+  ujson 遇到 NaN、Infinity 时抛出异常，此时使用 json 模块编码。发出的数据包很少且都很小，编码的耗时可以忽略
+"""
+
+import json
+import os
+from typing import Optional
+
+
+class JsonCodec(object):
+    """使用标准库 json 模块的编解码"""
+
+    name = "json"
+
+    def loads(self, msg):
+        return json.loads(msg)
+
+    def dumps(self, pack) -> str:
+        return json.dumps(pack)
+
+
+class OrjsonCodec(JsonCodec):
+    """使用 orjson 解码，编码使用继承自 JsonCodec 的 json 模块"""
+
+    name = "orjson"
+
+    def __init__(self) -> None:
+        import orjson
+        self._orjson = orjson
+
+    def loads(self, msg):
+        try:
+            return self._orjson.loads(msg)
+        except self._orjson.JSONDecodeError:  # orjson 不支持 NaN、Infinity
+            return json.loads(msg)
+
+
+class UjsonCodec(JsonCodec):
+    """使用 ujson 的编解码"""
+
+    name = "ujson"
+
+    def __init__(self) -> None:
+        import ujson
+        self._ujson = ujson
+
+    def loads(self, msg):
+        try:
+            return self._ujson.loads(msg)
+        except ValueError:
+            return json.loads(msg)
+
+    def dumps(self, pack) -> str:
+        try:
+            return self._ujson.dumps(pack)
+        except (TypeError, ValueError, OverflowError):
+            return json.dumps(pack)
+
+
+_CODECS = {c.name: c for c in [OrjsonCodec, UjsonCodec, JsonCodec]}
+
+
+def _get_codec(name: Optional[str] = None) -> JsonCodec:
+    """
+    获取 json 编解码实例
+
+    Args:
+        name (str): [可选] orjson / ujson / json，默认为环境变量 TQ_JSON_CODEC 的值，都没有指定时使用第一个可以 import 的库
+    """
+    name = name if name else os.getenv("TQ_JSON_CODEC")
+    if name:
+        if name not in _CODECS:
+            raise Exception(f"不支持的 json 编解码 {name}，可选值为 {', '.join(_CODECS)}")
+        return _CODECS[name]()
+    for codec_cls in _CODECS.values():
+        try:
+            return codec_cls()
+        except ImportError:
+            continue
@@ -0,0 +1,298 @@
+#!usr/bin/env python3
+#-*- coding:utf-8 -*-
+__author__ = 'mayanqiong'
+
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+
+from tqsdk.entity import Entity
+
+
+class ColumnarSeries(Entity):
+    """
+    K线 / Tick 序列数据 (即 api._data 中 klines/ticks 下的 data 节点) 的列式存储
+
+    每个 (合约, 周期) 一个预分配的环形缓冲区，以整数 id 定位行: row = id % capacity
+    * _ids: 每行当前存放的数据 id，-1 表示空行
+    * _datetime: datetime 列，单独以 int64 保存，避免纳秒时间戳转为 float 后丢失精度
+    * _values: 其余字段，按数据原型中字段的顺序保存为 float64 的二维数组，与 serial["array"] 中的列顺序一致
+
+    新的数据写入与其 id 同余的行，该行原有的旧数据移到 _overflow 中；
+    比环形缓冲区中已有数据还要旧的数据（例如复权计算时请求的历史K线）也保存在 _overflow 中，都仍然可以通过 id 访问。
+
+    对外仍然保持 Mapping 接口（key 为字符串形式的 id），通过 key 取到的是根据列数据新生成的只读 Kline / Tick 对象，
+    修改其字段会抛出异常，需要修改数据时应通过 _merge_diff 或者 __setitem__。
+    """
+
+    def __init__(self, default: Entity, capacity: int) -> None:
+        self._default = default
+        self._fields = [k for k in default.keys() if k != "datetime"]
+        self._field_index = {k: i for i, k in enumerate(self._fields)}
+        self._int_fields = {k for k in self._fields if type(default[k]) is int}
+        self._default_datetime = default["datetime"]
+        self._default_values = np.array([default[k] for k in self._fields], dtype=np.float64)
+        self._capacity = 0
+        self._ids = np.full(0, -1, dtype=np.int64)
+        self._datetime = np.full(0, self._default_datetime, dtype=np.int64)
+        self._values = np.empty((0, len(self._fields)), dtype=np.float64)
+        self._overflow: Dict[str, Entity] = {}
+        self._updated_ids: Set[int] = set()  # 自上次 wait_update 以来写入过数据的 id，由 api 在更新完所有序列后清空
+        self._reserve(capacity)
+
+    def _reserve(self, capacity: int) -> None:
+        """保证环形缓冲区至少可以容纳 capacity 行数据"""
+        if capacity <= self._capacity:
+            return
+        valid = np.sort(self._ids[self._ids >= 0])
+        old_rows = valid % self._capacity if self._capacity else valid
+        old_datetime, old_values = self._datetime[old_rows], self._values[old_rows]
+        self._capacity = capacity
+        self._ids = np.full(capacity, -1, dtype=np.int64)
+        self._datetime = np.full(capacity, self._default_datetime, dtype=np.int64)
+        self._values = np.tile(self._default_values, (capacity, 1))
+        for i in range(len(valid)):
+            row = self._row_for_write(int(valid[i]))
+            if row is None:
+                self._overflow[str(valid[i])] = self._build_item(str(valid[i]), old_datetime[i], old_values[i])
+            else:
+                self._datetime[row], self._values[row] = old_datetime[i], old_values[i]
+
+    def _row_for_write(self, id: int):
+        """返回 id 对应的行号，如果该行被更新的数据占据则返回 None；如果该行存放的是更旧的数据，则清空该行"""
+        if id < 0:
+            return None
+        row = id % self._capacity
+        current = self._ids[row]
+        if current == id:
+            return row
+        if current > id:
+            return None
+        if current >= 0:
+            self._overflow[str(current)] = self._build_item(str(current), self._datetime[row], self._values[row])
+        self._ids[row] = id
+        self._datetime[row] = self._default_datetime
+        self._values[row] = self._default_values
+        return row
+
+    def _find_row(self, id: int):
+        if id < 0:
+            return None
+        row = id % self._capacity
+        return row if self._ids[row] == id else None
+
+    def _build_item(self, key: str, datetime, values, readonly: bool = False) -> Entity:
+        cls = type(self._default)
+        item = _copy_as(self._default, _readonly_class(cls) if readonly else cls)
+        item._instance_entity(self._path + [key], self._listened_paths)
+        object.__setattr__(item, "datetime", int(datetime))
+        for k, v in zip(self._fields, values.tolist()):
+            object.__setattr__(item, k, int(v) if k in self._int_fields and v == v else v)
+        return item
+
+    def _take(self, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        按 id 批量读取数据，不存在的 id 以数据原型中的默认值填充
+
+        Returns:
+            tuple: (datetime 列, 其余字段组成的二维数组)
+        """
+        rows = ids % self._capacity
+        hit = (ids >= 0) & (self._ids[rows] == ids)
+        datetime = np.where(hit, self._datetime[rows], self._default_datetime)
+        values = np.where(hit[:, None], self._values[rows], self._default_values)
+        return datetime, values
+
+    def _take_fields(self, ids: np.ndarray, fields: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        按 id 批量读取 fields 字段 (包括 _overflow 中的数据)，用于按列取出整段数据，例如 DataDownloader 的列式输出
+
+        Returns:
+            tuple: (datetime 列, fields 组成的 float64 二维数组, 每个 id 是否有数据)，没有数据的 id datetime 为 0，其余字段为 NaN
+        """
+        rows = ids % self._capacity
+        hit = (ids >= 0) & (self._ids[rows] == ids)
+        datetime = np.where(hit, self._datetime[rows], 0)
+        values = np.where(hit[:, None], self._values[rows[:, None], [self._field_index[f] for f in fields]], np.nan)
+        if self._overflow:
+            for i in np.nonzero(~hit)[0]:
+                item = self._overflow.get(str(ids[i]))
+                if item is not None:
+                    hit[i] = True
+                    datetime[i] = item["datetime"]
+                    values[i] = [item[f] for f in fields]
+        return datetime, values, hit
+
+    def _merge_columns(self, diff: dict, persist: bool, reduce_diff: bool) -> None:
+        """
+        将 diff 直接写入列数据，语义与 diff._merge_diff 处理 "@" 原型节点时保持一致
+        """
+        for key in list(diff.keys()):
+            item_diff = diff[key]
+            if item_diff is None:
+                if persist and reduce_diff:
+                    del diff[key]
+                else:
+                    self._discard(key)
+                continue
+            row = self._row_for_write(int(key))
+            if row is None:
+                target = self._overflow.get(key)
+                if target is None:
+                    target = self._build_item(key, self._default_datetime, self._default_values)
+                    self._overflow[key] = target
+            for k in list(item_diff.keys()):
+                if k == "datetime":
+                    default_v = self._default_datetime
+                elif k in self._field_index:
+                    default_v = self._default_values[self._field_index[k]]
+                else:
+                    continue  # 原型中没有的字段不保存
+                v = item_diff[k]
+                if type(v) is str:
+                    # 与 _merge_diff 一致，非字符串类型的字段收到字符串时使用原型中的默认值
+                    v = item_diff[k] = self._default[k]
+                if row is None:
+                    old = target[k]
+                elif k == "datetime":
+                    old = self._datetime[row]
+                else:
+                    old = self._values[row, self._field_index[k]]
+                if v is None:
+                    v = default_v  # 删除字段时恢复为默认值
+                elif reduce_diff and (old == v or (v != v and old != old)):
+                    del item_diff[k]
+                    continue
+                if row is None:
+                    target[k] = v
+                elif k == "datetime":
+                    self._datetime[row] = v
+                else:
+                    self._values[row, self._field_index[k]] = v
+            if reduce_diff and len(item_diff) == 0:
+                del diff[key]
+            else:
+                self._updated_ids.add(int(key))
+
+    def _discard(self, key: str) -> None:
+        self._overflow.pop(key, None)
+        row = self._find_row(int(key))
+        if row is not None:
+            self._ids[row] = -1
+
+    def __setitem__(self, key, value):
+        if key.startswith("_"):
+            return self.__dict__.__setitem__(key, value)
+        self._discard(key)
+        self._merge_columns({key: {k: v for k, v in value.items()}}, persist=False, reduce_diff=False)
+
+    def __delitem__(self, key):
+        if key.startswith("_"):
+            return self.__dict__.__delitem__(key)
+        if key not in self:
+            raise KeyError(key)
+        self._discard(key)
+
+    def __getitem__(self, key):
+        if key.startswith("_"):
+            return self.__dict__.__getitem__(key)
+        if key in self._overflow:
+            return self._overflow[key]
+        try:
+            row = self._find_row(int(key))
+        except ValueError:
+            row = None
+        if row is None:
+            raise KeyError(key)
+        return self._build_item(key, self._datetime[row], self._values[row], readonly=True)
+
+    def __contains__(self, key):
+        if key in self._overflow:
+            return True
+        try:
+            return self._find_row(int(key)) is not None
+        except (TypeError, ValueError):
+            return False
+
+    def __iter__(self):
+        ids = sorted(self._ids[self._ids >= 0].tolist() + [int(k) for k in self._overflow])
+        return iter([str(i) for i in ids])
+
+    def __len__(self):
+        return int(np.count_nonzero(self._ids >= 0)) + len(self._overflow)
+
+    def __str__(self):
+        return str({k: v for k, v in self.items()})
+
+    def __repr__(self):
+        return '{}, D({})'.format(object.__repr__(self), {k: v for k, v in self.items()})
+
+
+class _ReadOnlyItem(object):
+    """
+    ColumnarSeries 根据列数据生成的对象，修改字段不会写回缓冲区，所以禁止修改，避免修改静默丢失
+
+    copy 得到的是原类型的对象，可以修改
+    """
+    __slots__ = ()
+    _writable_class = None
+
+    def __setitem__(self, key, value):
+        if key.startswith("_"):
+            return super(_ReadOnlyItem, self).__setitem__(key, value)
+        raise Exception("K线 / Tick 序列中的数据为只读，不能修改字段 %s，如需修改请先 copy" % key)
+
+    def __setattr__(self, key, value):
+        if key.startswith("_"):
+            return super(_ReadOnlyItem, self).__setattr__(key, value)
+        raise Exception("K线 / Tick 序列中的数据为只读，不能修改字段 %s，如需修改请先 copy" % key)
+
+    def __delitem__(self, key):
+        raise Exception("K线 / Tick 序列中的数据为只读，不能删除字段 %s" % key)
+
+    def __delattr__(self, key):
+        raise Exception("K线 / Tick 序列中的数据为只读，不能删除字段 %s" % key)
+
+    def __copy__(self):
+        return _copy_as(self, self._writable_class)
+
+
+_readonly_classes: Dict[type, type] = {}
+
+
+def _readonly_class(cls: type) -> type:
+    """返回 cls 对应的只读类型"""
+    if cls not in _readonly_classes:
+        _readonly_classes[cls] = type(cls.__name__, (_ReadOnlyItem, cls), {
+            "__slots__": (),
+            "__module__": cls.__module__,
+            "_writable_class": cls,
+        })
+    return _readonly_classes[cls]
+
+
+def _copy_as(source: Entity, cls: type) -> Entity:
+    """浅拷贝 source 的全部属性 (包括 __slots__ 中的属性)，生成 cls 类型的对象"""
+    obj = cls.__new__(cls)
+    for k in getattr(cls, "_slot_names", ()):
+        try:
+            object.__setattr__(obj, k, object.__getattribute__(source, k))
+        except AttributeError:
+            pass
+    obj.__dict__.update(source.__dict__)
+    return obj
+
+
+def _ensure_columnar(root: Entity, default: Entity, capacity: int) -> ColumnarSeries:
+    """保证 klines/ticks 节点下的 data 为列式存储，已有的数据会迁移到列式存储中"""
+    data = root.get("data")
+    if isinstance(data, ColumnarSeries):
+        data._reserve(capacity)
+        return data
+    store = ColumnarSeries(default, capacity)
+    store._instance_entity(root["_path"] + ["data"], getattr(root, "_listened_paths", None))
+    if data is not None:
+        for key in sorted(data.keys(), key=int):
+            store[key] = data[key]
+    root["data"] = store
+    return store
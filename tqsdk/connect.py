@@ -3,7 +3,7 @@
 __author__ = 'yanqiong'
 
 import asyncio
-import json
+import itertools
 import random
 import ssl
 import time
@@ -20,10 +20,12 @@ import websockets.exceptions
 from packaging import version
 from shinny_structlog import ShinnyLoggerAdapter
 
+from tqsdk.codec import JsonCodec, _get_codec
 from tqsdk.datetime import _cst_now
 from tqsdk.diff import _merge_diff, _get_obj
 from tqsdk.entity import Entity
 from tqsdk.exceptions import TqBacktestPermissionError, TqContextManagerError
+from tqsdk.recorder import ReplayConnection, REPLAY_SCHEME, _get_recorder
 from tqsdk.utils import _generate_uuid
 from tqsdk.sm import SMContext, NullContext
 from tqsdk.zq_otg import ZqOtgContext
@@ -75,11 +77,23 @@ else:
 class TqConnect(object):
     """用于与 websockets 服务器通讯"""
 
-    def __init__(self, logger, conn_id: Optional[str] = None) -> None:
+    _conn_seq = itertools.count()  # 没有指定 conn_id 的连接的序号
+
+    def __init__(self, logger, conn_id: Optional[str] = None, codec: Optional[JsonCodec] = None,
+                 log_sample_rate: float = 1.0) -> None:
         """
         创建 TqConnect 实例
+
+        Args:
+            codec (JsonCodec): [可选] 收发数据包使用的 json 编解码，默认根据已安装的库选择，参见 tqsdk.codec
+
+            log_sample_rate (float): [可选] 日志中记录收到的数据包的比例，取值范围 [0, 1]，默认为 1 即全部记录。
+                行情连接数据量大时可以只记录一部分，例如 0.1 为每 10 个数据包记录 1 个
         """
-        self._conn_id = conn_id if conn_id else _generate_uuid()
+        if not 0 <= log_sample_rate <= 1:
+            raise Exception(f"log_sample_rate 参数 {log_sample_rate} 错误，取值范围为 [0, 1]")
+        # 没有指定 conn_id 时按创建顺序编号，多次运行之间保持不变，录制的数据包可以按 conn_id 回放
+        self._conn_id = conn_id if conn_id else f"conn_{next(TqConnect._conn_seq)}"
         self._logger = logger
         if isinstance(logger, Logger):
             self._logger = ShinnyLoggerAdapter(logger, conn_id=self._conn_id)
@@ -87,10 +101,15 @@ class TqConnect(object):
             self._logger = logger.bind(conn_id=self._conn_id)
         self._first_connect = True
         self._keywords = {"max_size": None}
+        self._codec = codec if codec else _get_codec()
+        self._recorder = _get_recorder()  # 设置了环境变量 TQ_RECORD_FILE 时录制收发的数据包
+        self._log_sample_rate = log_sample_rate
+        self._log_sample_credit = 1.0  # 累计到 1 时记录一个收到的数据包，保证第一个数据包一定会被记录
 
     async def _run(self, api, url, send_chan, recv_chan):
         """启动websocket客户端"""
         self._api = api
+        latency_stats = self._api._latency_stats  # 开启耗时统计时记录解码耗时
         # 调整代码位置，方便 monkey patch
         self._query_max_length = 50000  # ins_query 最大长度
         self._ins_list_max_length = 100000  # subscribe_quote 最大长度
@@ -145,7 +164,11 @@ class TqConnect(object):
                                 }
                             }]
                         })
-                    async with websockets.connect(url, **self._keywords) as client:
+                    if url_info.scheme == REPLAY_SCHEME:  # 回放录制文件，参见 tqsdk.recorder
+                        connection = ReplayConnection.from_url(url, self._conn_id)
+                    else:
+                        connection = websockets.connect(url, **self._keywords)
+                    async with connection as client:
                         # 发送网络连接建立的通知，code = 2019112901
                         notify_id = _generate_uuid()
                         notify = {
@@ -179,9 +202,18 @@ class TqConnect(object):
                         send_task = self._api.create_task(self._send_handler(send_chan, client))
                         try:
                             async for msg in client:
-                                pack = json.loads(msg)
+                                if latency_stats:
+                                    start_time = time.perf_counter()
+                                    pack = self._codec.loads(msg)
+                                    latency_stats.record(f"TqConnect.{self._conn_id}", time.perf_counter() - start_time)
+                                    if self._conn_id == "md":
+                                        latency_stats.on_md_recv()
+                                else:
+                                    pack = self._codec.loads(msg)
+                                if self._recorder:
+                                    self._recorder.write(self._conn_id, "recv", pack.get("aid") if isinstance(pack, dict) else None, msg)
                                 await self._api._wait_until_idle()
-                                self._logger.debug("websocket received data", pack=msg)
+                                self._log_recv(msg)
                                 await recv_chan.send(pack)
                         finally:
                             await self._api._cancel_task(send_task)
@@ -224,6 +256,13 @@ class TqConnect(object):
                     count += 1
                     self._api._reconnect_timer.set_count(count)
 
+    def _log_recv(self, msg) -> None:
+        """按照 log_sample_rate 记录收到的数据包"""
+        self._log_sample_credit += self._log_sample_rate
+        if self._log_sample_credit >= 1:
+            self._log_sample_credit -= 1
+            self._logger.debug("websocket received data", pack=msg)
+
     async def _send_handler(self, send_chan, client):
         """websocket客户端数据发送协程"""
         try:
@@ -238,18 +277,22 @@ class TqConnect(object):
                 if pack.get("aid") == "ins_query":
                     if len(pack.get("query", "")) > self._query_max_length:
                         warnings.warn(f"订阅合约信息字段总长度大于 {self._query_max_length}，可能会引起服务器限制。", stacklevel=3)
-                msg = json.dumps(pack)
+                msg = self._codec.dumps(pack)
                 await client.send(msg)
                 if pack.get("aid") == "req_login":
                     log_pack = pack.copy()
                     log_pack.pop("password", None)
-                    msg = json.dumps(log_pack)
+                    msg = self._codec.dumps(log_pack)
+                if self._recorder:
+                    self._recorder.write(self._conn_id, "send", pack.get("aid"), msg)
                 self._logger.debug("websocket send data", pack=msg)
         except asyncio.CancelledError:  # 取消任务不抛出异常，不然等待者无法区分是该任务抛出的取消异常还是有人直接取消等待者
             pass
 
 
 class TqReconnect(object):
+    _latency_stage = None  # 开启耗时统计时，记录从收到行情数据包到转发给下游的耗时使用的名称
+
     def __init__(self, logger):
         self._logger = logger
         self._resend_request = {}  # 重连时需要重发的请求
@@ -308,6 +351,8 @@ class TqReconnect(object):
                         await ws_send_chan.send({"aid": "peek_message"})
                         self._logger.debug("wait for data completed", pack={"aid": "peek_message"})
                 else:
+                    if self._latency_stage and self._api._latency_stats:
+                        self._api._latency_stats.record_since_md_recv(self._latency_stage)
                     await api_recv_chan.send(pack)
         finally:
             await self._api._cancel_task(send_task)
@@ -336,6 +381,7 @@ class TqReconnect(object):
 
 
 class MdReconnectHandler(TqReconnect):
+    _latency_stage = "MdReconnect"
 
     def _record_lower_data(self, pack):
         """从下游收到的数据中，记录下重连时需要的数据"""
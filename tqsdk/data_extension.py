@@ -2,7 +2,9 @@
 #  -*- coding: utf-8 -*-
 __author__ = 'mayanqiong'
 
+import time
 
+from tqsdk.channel import TqPipeChan
 from tqsdk.datetime import _get_expire_rest_days
 from tqsdk.datetime_state import TqDatetimeState
 from tqsdk.diff import _simple_merge_diff, _is_key_exist, _simple_merge_diff_and_collect_paths, _get_obj
@@ -72,43 +74,65 @@ class DataExtension(object):
         }
 
     async def _run(self, api_send_chan, api_recv_chan, md_send_chan, md_recv_chan):
-        self._logger = self._api._logger.getChild("DataExtension")
+        self._setup(api_recv_chan, md_send_chan)
         self._api_send_chan = api_send_chan
-        self._api_recv_chan = api_recv_chan
-        self._md_send_chan = md_send_chan
         self._md_recv_chan = md_recv_chan
-        self._datetime_state = TqDatetimeState()
         md_task = self._api.create_task(self._md_handler())
-        self._pending_peek = False  # True 表示收到下游的 peek_message ，并且没有发给过下游回复；False 表示发给过下游回复，没有 pending_peek_message
-        self._pending_peek_md = False  # True 表示发给过上游 peek_message；False 表示对上游没有 pending_peek_message
         try:
             async for pack in api_send_chan:
                 if "_md_recv" in pack:
-                    if pack['aid'] == 'rtn_data':
-                        self._pending_peek_md = False
-                        await self._md_recv(pack)
-                        await self._send_diff()
-                    if self._pending_peek and self._pending_peek_md is False:
-                        self._pending_peek_md = True
-                        await self._md_send_chan.send({"aid": "peek_message"})
-                elif pack["aid"] == "peek_message":
-                    self._pending_peek = True
-                    await self._send_diff()
-                    if self._pending_peek and self._pending_peek_md is False:
-                        self._pending_peek_md = True
-                        await self._md_send_chan.send(pack)
+                    pack.pop("_md_recv")
+                    self._handle_md_pack(pack)
                 else:
-                    await self._md_send_chan.send(pack)
+                    self._handle_api_pack(pack)
         finally:
             await self._api._cancel_task(md_task)
 
+    def _setup(self, api_recv_chan, md_send_chan):
+        self._logger = self._api._logger.getChild("DataExtension")
+        self._api_recv_chan = api_recv_chan
+        self._md_send_chan = md_send_chan
+        self._datetime_state = TqDatetimeState()
+        self._pending_peek = False  # True 表示收到下游的 peek_message ，并且没有发给过下游回复；False 表示发给过下游回复，没有 pending_peek_message
+        self._pending_peek_md = False  # True 表示发给过上游 peek_message；False 表示对上游没有 pending_peek_message
+
+    def _pipe(self, api_recv_chan, md_send_chan):
+        """
+        同步模式，不创建 task，返回 (下游发送数据的 channel, 上游发送数据的 channel)，
+        数据包在发送方调用 send / send_nowait 时就处理完成，处理结果直接发到 api_recv_chan / md_send_chan
+        """
+        self._setup(api_recv_chan, md_send_chan)
+        return TqPipeChan(self._api, self._handle_api_pack, chan_name="pipe to data_extension"), \
+            TqPipeChan(self._api, self._handle_md_pack, chan_name="pipe from md to data_extension")
+
+    def _handle_md_pack(self, pack):
+        """处理上游发送的数据包"""
+        if pack['aid'] == 'rtn_data':
+            self._pending_peek_md = False
+            self._md_recv(pack)
+            self._send_diff()
+        if self._pending_peek and self._pending_peek_md is False:
+            self._pending_peek_md = True
+            self._md_send_chan.send_nowait({"aid": "peek_message"})
+
+    def _handle_api_pack(self, pack):
+        """处理下游发送的数据包"""
+        if pack["aid"] == "peek_message":
+            self._pending_peek = True
+            self._send_diff()
+            if self._pending_peek and self._pending_peek_md is False:
+                self._pending_peek_md = True
+                self._md_send_chan.send_nowait(pack)
+        else:
+            self._md_send_chan.send_nowait(pack)
+
     async def _md_handler(self):
         """0 接收上游数据包 """
         async for pack in self._md_recv_chan:
             pack["_md_recv"] = True
             await self._api_send_chan.send(pack)
 
-    async def _md_recv(self, pack):
+    def _md_recv(self, pack):
         """将行情数据和交易数据合并至 self._data """
         for d in pack.get("data", []):
             self._datetime_state.update_state(d)
@@ -204,14 +228,21 @@ class DataExtension(object):
             sum_amount = sum([trades[t_id]['volume'] * trades[t_id]['price'] for t_id in trade_id_list])
             return sum_amount / sum_volume
 
-    async def _send_diff(self):
+    def _send_diff(self):
         if self._datetime_state.data_ready and self._pending_peek and self._diffs:
             # 生成增量业务截面, 该截面包含补充的字段，只在真正需要给下游发送数据时，才将需要发送的数据放在 _diffs 中
-            ext_diff = self._generate_ext_diff()
+            latency_stats = self._api._latency_stats
+            if latency_stats:
+                start_time = time.perf_counter()
+                ext_diff = self._generate_ext_diff()
+                latency_stats.record("DataExtension._generate_ext_diff", time.perf_counter() - start_time)
+                latency_stats.record_since_md_recv("DataExtension")
+            else:
+                ext_diff = self._generate_ext_diff()
             rtn_data = {
                 "aid": "rtn_data",
                 "data": self._diffs + [ext_diff],
             }
             self._diffs = []
             self._pending_peek = False
-            await self._api_recv_chan.send(rtn_data)
+            self._api_recv_chan.send_nowait(rtn_data)
@@ -5,6 +5,7 @@ __author__ = 'mayanqiong'
 import os
 import shutil
 import struct
+import sys
 
 import numpy as np
 import pandas as pd
@@ -36,7 +37,8 @@ class DataSeries:
 
     **功能限制说明**
     * 该接口返回的 df 不会随着行情更新
-    * 暂不支持多合约 Kline 缓存
+    * 多合约 Kline 每个合约分别缓存，其他合约按第一个合约的 K 线时间对齐，列名加上合约序号后缀，如 open1、symbol1；没有对应 K 线时 id 为 -1，其他字段为 nan
+    * 暂不支持多合约 Tick
     * 不支持用户回测/复盘使用。get_data_series() 是直接连接行情服务器，是会下载到未来数据的。
     * 不支持多进程/线程/协程。每个合约+周期只能在同一个线程/进程里下载，因为需要写/读/修改文件，多个线程/进程会造成冲突。
 
@@ -75,7 +77,62 @@ class DataSeries:
         return self._task.done()
 
     async def _run(self):
-        symbol = self._symbol_list[0]  # todo: 目前只处理一个合约的情况
+        # 每个合约分别使用各自的缓存文件，多合约时其他合约按第一个合约的 K 线时间对齐
+        arrays = [await self._ensure_data(symbol) for symbol in self._symbol_list]
+        if arrays[0] is None:  # 用户请求的时间段内没有任何数据
+            return
+        symbol = self._symbol_list[0]
+        data_cols = DataSeries._get_data_cols(symbol=symbol, dur_nano=self._dur_nano)
+
+        # 按列赋值，df.append 方法会返回一个新的 df，初始化构造的 df 可能（如果是异步代码下）已经返回给用户代码中；df.update 方法会导致更新的列的 type 都是 object
+        self.df["id"] = arrays[0]["id"]
+        self.df["datetime"] = arrays[0]["datetime"]
+        for c in data_cols:
+            self.df[c] = arrays[0][c]
+        main_dt = arrays[0]["datetime"]
+        for i in range(1, len(self._symbol_list)):
+            # 在其他合约中查找与第一个合约 K 线时间相同的 K 线，找不到时 id 为 -1，其他字段为 nan
+            other = arrays[i]
+            if other is None or len(other) == 0:
+                self.df[f"id{i}"] = -1
+                for c in data_cols:
+                    self.df[f"{c}{i}"] = np.nan
+                continue
+            pos = np.minimum(np.searchsorted(other["datetime"], main_dt), len(other) - 1)
+            hit = other["datetime"][pos] == main_dt
+            self.df[f"id{i}"] = np.where(hit, other["id"][pos], -1)
+            for c in data_cols:
+                self.df[f"{c}{i}"] = np.where(hit, other[c][pos], np.nan)
+        self.df["symbol"] = symbol
+        for i in range(1, len(self._symbol_list)):
+            self.df[f"symbol{i}"] = self._symbol_list[i]
+        self.df["duration"] = self._dur_nano
+
+        # 复权, 如果存在 STOCK / FUND 并且 adj_type is not None, 这里需要提前准备下载时间段内的复权因子
+        for i, symbol in enumerate(self._symbol_list):
+            quote = self._api.get_quote(symbol)
+            if self._adj_type and quote.ins_class in ["STOCK", "FUND"]:
+                factor_df = await _get_dividend_factor(self._api, quote, self._start_dt_nano, self._end_dt_nano,
+                                                       chart_id_prefix="PYSDK_data_factor")  # 复权需要根据日线计算除权因子，todo: 如果本地下载过日线，不需要再从服务器获取日线数据
+                adj_cols = [c + (str(i) if i else "") for c in DataSeries._get_adj_cols(symbol, self._dur_nano)]
+                if self._adj_type == "F":
+                    # 倒序循环 factor_df, 对于小于当前 factor_df[datetime] 的行 乘以 factor_df[factor]
+                    for j in range(factor_df.shape[0] - 1, -1, -1):
+                        dt = factor_df.iloc[j].datetime
+                        factor = factor_df.iloc[j].factor
+                        lt = self.df["datetime"].lt(dt)
+                        for col in adj_cols:
+                            self.df.loc[lt, col] = self.df.loc[lt, col] * factor
+                if self._adj_type == "B":
+                    # 正序循环 factor_df, 对于大于等于当前 factor_df[datetime] 的行 乘以 1 / factor_df[factor]
+                    for j in range(factor_df.shape[0]):
+                        dt = factor_df.iloc[j].datetime
+                        factor = factor_df.iloc[j].factor
+                        ge = self.df["datetime"].ge(dt)
+                        self.df.loc[ge, adj_cols] = self.df.loc[ge, adj_cols] / factor
+
+    async def _ensure_data(self, symbol):
+        """下载合约缓存中缺少的数据，返回用户请求时间段内的数据 (参见 _read_cache)，没有数据时返回 None"""
         lock_path = DataSeries._get_lock_path(symbol, self._dur_nano)
         with FileLock(lock_path, timeout=-1):
             # 检查缓存文件，计算需要下载的数据段
@@ -94,84 +151,24 @@ class DataSeries:
 
             # 下载数据并全部完成
             if len(diff_rangeset) > 0:
-                await self._download_data_series(diff_rangeset)
-                self._merge_rangeset()  # 归并文件
+                await self._download_data_series(symbol, diff_rangeset)
+                DataSeries._merge_rangeset(symbol, self._dur_nano)  # 归并文件
                 rangeset_id = DataSeries._get_rangeset_id(symbol, self._dur_nano)
                 rangeset_dt = DataSeries._get_rangeset_dt(symbol, self._dur_nano, rangeset_id)
                 DataSeries._assert_rangeset_asce_sorted(rangeset_id)
                 DataSeries._assert_rangeset_asce_sorted(rangeset_dt)
 
-            assert len(rangeset_id) == len(rangeset_dt)  # rangeset_id 和 rangeset_dt 的长度应该相等, 且一一对应，有可能长度都为 0 ，即没有下载任何数据
-
-            # 查找用户请求时间段与已有数据时间段的交集
-            target_rangeset_dt = _rangeset_intersection([(self._start_dt_nano, self._end_dt_nano)], rangeset_dt)
-            assert len(target_rangeset_dt) <= 1  # 用户请求应该落在一个时间段内，或者用户请求的时间段内没有任何数据
-            if len(target_rangeset_dt) == 0:  # 用户请求的时间段内没有任何数据
-                return
-
-            # 此时用户请求时间范围，转化为 target_rangeset_dt[0]
-            # 找到 self._start_dt_nano, self._end_dt_nano 对应的 range_id
-            (start_dt, end_dt) = target_rangeset_dt[0]
-            range_id = None
-            for index in range(len(rangeset_dt)):
-                range_dt = rangeset_dt[index]
-                if range_dt[0] <= start_dt and end_dt <= range_dt[1]:
-                    range_id = rangeset_id[index]
-                    break
-            assert range_id
-
-            # 返回 dataframe, 目标文件为
-            filename = os.path.join(CACHE_DIR, f"{symbol}.{self._dur_nano}.{range_id[0]}.{range_id[1]}")
-            data_cols = DataSeries._get_data_cols(symbol=self._symbol_list[0], dur_nano=self._dur_nano)
-            dtype = np.dtype([('id', 'i8'), ('datetime', 'i8')] + [(col, 'f8') for col in data_cols])
-            fp = np.memmap(filename, dtype=dtype, mode='r', shape=range_id[1] - range_id[0])
-
-            # target_rangeset_dt[0] 对应的 id 范围是 [start_id, end_id)
-            start_id = fp[fp['datetime'] <= start_dt][-1]["id"]
-            end_id = fp[fp['datetime'] < end_dt][-1]["id"]
-            rows = end_id - start_id + 1  # 读取数据行数
-            array = fp[start_id - range_id[0]: start_id - range_id[0] + rows]
-
-            # 按列赋值，df.append 方法会返回一个新的 df，初始化构造的 df 可能（如果是异步代码下）已经返回给用户代码中；df.update 方法会导致更新的列的 type 都是 object
-            self.df["id"] = array["id"]
-            self.df["datetime"] = array["datetime"]
-            for c in data_cols:
-                self.df[c] = array[c]
-            self.df["symbol"] = symbol
-            self.df["duration"] = self._dur_nano
-
-            # 复权, 如果存在 STOCK / FUND 并且 adj_type is not None, 这里需要提前准备下载时间段内的复权因子
-            quote = self._api.get_quote(symbol)
-            if self._adj_type and quote.ins_class in ["STOCK", "FUND"]:
-                factor_df = await _get_dividend_factor(self._api, quote, self._start_dt_nano, self._end_dt_nano,
-                                                       chart_id_prefix="PYSDK_data_factor")  # 复权需要根据日线计算除权因子，todo: 如果本地下载过日线，不需要再从服务器获取日线数据
-                if self._adj_type == "F":
-                    # 倒序循环 factor_df, 对于小于当前 factor_df[datetime] 的行 乘以 factor_df[factor]
-                    for i in range(factor_df.shape[0] - 1, -1, -1):
-                        dt = factor_df.iloc[i].datetime
-                        factor = factor_df.iloc[i].factor
-                        adj_cols = DataSeries._get_adj_cols(symbol, self._dur_nano)
-                        lt = self.df["datetime"].lt(dt)
-                        for col in adj_cols:
-                            self.df.loc[lt, col] = self.df.loc[lt, col] * factor
-                if self._adj_type == "B":
-                    # 正序循环 factor_df, 对于大于等于当前 factor_df[datetime] 的行 乘以 1 / factor_df[factor]
-                    for i in range(factor_df.shape[0]):
-                        dt = factor_df.iloc[i].datetime
-                        factor = factor_df.iloc[i].factor
-                        adj_cols = DataSeries._get_adj_cols(symbol, self._dur_nano)
-                        ge = self.df["datetime"].ge(dt)
-                        self.df.loc[ge, adj_cols] = self.df.loc[ge, adj_cols] / factor
+            return DataSeries._read_cache(symbol, self._dur_nano, self._start_dt_nano, self._end_dt_nano,
+                                          rangeset_id, rangeset_dt)
 
-    async def _download_data_series(self, rangeset):
-        symbol = self._symbol_list[0]
+    async def _download_data_series(self, symbol, rangeset):
         for start_dt, end_dt in rangeset:
             try:
                 start_id, end_id = None, None
                 temp_filename = os.path.join(CACHE_DIR, f"{symbol}.{self._dur_nano}.temp")
                 temp_file = open(temp_filename, "wb")
                 data_chan = TqChan(self._api)
-                task = self._api.create_task(self._download_data(start_dt, end_dt, data_chan))
+                task = self._api.create_task(self._download_data(symbol, start_dt, end_dt, data_chan))
                 async for item in data_chan:
                     temp_file.write(struct.pack("@qq" + "d" * (len(item) - 2), *item))
                     if start_id is None:
@@ -187,9 +184,8 @@ class DataSeries:
             finally:
                 await self._api._cancel_task(task)
 
-    async def _download_data(self, start_dt, end_dt, data_chan):
+    async def _download_data(self, symbol, start_dt, end_dt, data_chan):
         # 下载的数据应该是 [start_dt, end_dt）
-        symbol = self._symbol_list[0]
         chart_info = {
             "aid": "set_chart",
             "chart_id": _generate_uuid("PYSDK_data_series"),
@@ -243,9 +239,9 @@ class DataSeries:
                 "view_width": 2000,
             })
 
-    def _merge_rangeset(self):
-        symbol = self._symbol_list[0]
-        rangeset = DataSeries._get_rangeset_id(symbol, self._dur_nano)
+    @staticmethod
+    def _merge_rangeset(symbol, dur_nano):
+        rangeset = DataSeries._get_rangeset_id(symbol, dur_nano)
         if len(rangeset) <= 1:
             return
         # 可以 merge 的 rangset 分组, rangset_group 类型是 list_of_list, [[(start, end, rows), ], [], ....]
@@ -278,18 +274,18 @@ class DataSeries:
                 else:
                     rangset_group.append([r + (r[1] - r[0], )])
 
-        data_cols = DataSeries._get_data_cols(symbol, self._dur_nano)
+        data_cols = DataSeries._get_data_cols(symbol, dur_nano)
         dtype = np.dtype([('id', 'i8'), ('datetime', 'i8')] + [(col, 'f8') for col in data_cols])
         for rangeset in rangset_group:
             if len(rangeset) == 1:
                 continue
             first_r_0, first_r_1, first_r_rows = rangeset[0]
             # 将第一个文件作为临时文件
-            temp_filename = os.path.join(CACHE_DIR, f"{symbol}.{self._dur_nano}.{first_r_0}.{first_r_1}")
+            temp_filename = os.path.join(CACHE_DIR, f"{symbol}.{dur_nano}.{first_r_0}.{first_r_1}")
             all_rows = first_r_rows  # 临时文件中已经写入的总行数
             last_r_1 = None
             for s, e, rows_number in rangeset[1:]:
-                filename = os.path.join(CACHE_DIR, f"{symbol}.{self._dur_nano}.{s}.{e}")
+                filename = os.path.join(CACHE_DIR, f"{symbol}.{dur_nano}.{s}.{e}")
                 fp = np.memmap(filename, dtype=dtype, mode='r+', shape=rows_number)
                 temp_fp = np.memmap(temp_filename, dtype=dtype, mode='r+', offset=dtype.itemsize*all_rows, shape=rows_number)
                 temp_fp[0:rows_number] = fp[0:rows_number]
@@ -298,7 +294,80 @@ class DataSeries:
                 os.remove(filename)  # 写完后删除源文件
                 all_rows += rows_number
                 last_r_1 = e
-            os.rename(temp_filename, os.path.join(CACHE_DIR, f"{symbol}.{self._dur_nano}.{first_r_0}.{last_r_1}"))
+            os.rename(temp_filename, os.path.join(CACHE_DIR, f"{symbol}.{dur_nano}.{first_r_0}.{last_r_1}"))
+
+    @staticmethod
+    def _read_cache(symbol, dur_nano, start_dt_nano, end_dt_nano, rangeset_id=None, rangeset_dt=None):
+        """
+        从缓存文件中读取 [start_dt_nano, end_dt_nano) 时间段内的数据，返回只读的 numpy.memmap 结构化数组，不会复制数据，
+        多个进程读取同一份缓存时共享操作系统的页缓存
+
+        调用方需要持有该合约及周期的文件锁，缓存中没有该时间段的数据时返回 None。
+        释放文件锁之后缓存文件可能被其他进程合并 (追加写入后 rename)、删除，在 POSIX 系统上已经打开的映射依然有效；
+        Windows 上文件被映射时不能删除及重命名，会导致其他进程合并缓存失败，所以在 Windows 上返回持有锁时复制出的数据并关闭映射
+        """
+        if rangeset_id is None:
+            rangeset_id = DataSeries._get_rangeset_id(symbol, dur_nano)
+            rangeset_dt = DataSeries._get_rangeset_dt(symbol, dur_nano, rangeset_id)
+        assert len(rangeset_id) == len(rangeset_dt)  # rangeset_id 和 rangeset_dt 的长度应该相等, 且一一对应，有可能长度都为 0 ，即没有下载任何数据
+
+        # 查找用户请求时间段与已有数据时间段的交集
+        target_rangeset_dt = _rangeset_intersection([(start_dt_nano, end_dt_nano)], rangeset_dt)
+        assert len(target_rangeset_dt) <= 1  # 用户请求应该落在一个时间段内，或者用户请求的时间段内没有任何数据
+        if len(target_rangeset_dt) == 0:  # 用户请求的时间段内没有任何数据
+            return None
+
+        # 此时用户请求时间范围，转化为 target_rangeset_dt[0]
+        # 找到 start_dt_nano, end_dt_nano 对应的 range_id
+        (start_dt, end_dt) = target_rangeset_dt[0]
+        range_id = None
+        for index in range(len(rangeset_dt)):
+            range_dt = rangeset_dt[index]
+            if range_dt[0] <= start_dt and end_dt <= range_dt[1]:
+                range_id = rangeset_id[index]
+                break
+        assert range_id
+
+        # 目标文件为
+        filename = os.path.join(CACHE_DIR, f"{symbol}.{dur_nano}.{range_id[0]}.{range_id[1]}")
+        data_cols = DataSeries._get_data_cols(symbol=symbol, dur_nano=dur_nano)
+        dtype = np.dtype([('id', 'i8'), ('datetime', 'i8')] + [(col, 'f8') for col in data_cols])
+        fp = np.memmap(filename, dtype=dtype, mode='r', shape=range_id[1] - range_id[0])
+
+        # target_rangeset_dt[0] 对应的 id 范围是 [start_id, end_id)
+        start_id = fp[fp['datetime'] <= start_dt][-1]["id"]
+        end_id = fp[fp['datetime'] < end_dt][-1]["id"]
+        rows = end_id - start_id + 1  # 读取数据行数
+        array = fp[start_id - range_id[0]: start_id - range_id[0] + rows]
+        if sys.platform.startswith("win"):
+            array = np.array(array)
+            fp._mmap.close()
+        return array
+
+    @staticmethod
+    def _write_cache(symbol, dur_nano, rows):
+        """
+        把 id 连续的数据行 [id, datetime, *data_cols] 写入缓存，已经缓存过的 id 会被跳过，写入后合并相邻的缓存文件
+
+        调用方需要持有该合约及周期的文件锁
+        """
+        if len(rows) == 0:
+            return
+        data_cols = DataSeries._get_data_cols(symbol, dur_nano)
+        dtype = np.dtype([('id', 'i8'), ('datetime', 'i8')] + [(col, 'f8') for col in data_cols])
+        array = np.array([tuple(row) for row in rows], dtype=dtype)
+        first_id = int(array[0]["id"])
+        rangeset_id = DataSeries._get_rangeset_id(symbol, dur_nano)
+        if len(rangeset_id) > 0:
+            # 与 _run 一致，已有数据的最后一根 k 线可能是过时的，需要用新的数据覆盖
+            rangeset_id[-1] = (rangeset_id[-1][0], rangeset_id[-1][1] - 1)
+            if rangeset_id[-1][0] == rangeset_id[-1][1]:
+                rangeset_id.pop(-1)
+        for start_id, end_id in _rangeset_difference([(first_id, first_id + len(array))], rangeset_id):
+            temp_filename = os.path.join(CACHE_DIR, f"{symbol}.{dur_nano}.temp")
+            array[start_id - first_id: end_id - first_id].tofile(temp_filename)
+            shutil.move(temp_filename, os.path.join(CACHE_DIR, f"{symbol}.{dur_nano}.{start_id}.{end_id}"))
+        DataSeries._merge_rangeset(symbol, dur_nano)
 
     @staticmethod
     def _assert_rangeset_asce_sorted(rangeset):
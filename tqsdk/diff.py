@@ -5,10 +5,11 @@ __author__ = 'yanqiong'
 import copy
 from typing import Set, Union, Dict, Tuple
 
-from tqsdk.entity import Entity
+from tqsdk.columnar import ColumnarSeries
+from tqsdk.entity import Entity, _ListenerSet
 
 
-def _merge_diff(result, diff, prototype, persist, reduce_diff=False, notify_update_diff=False):
+def _merge_diff(result, diff, prototype, persist, reduce_diff=False, notify_update_diff=False, diff_paths=None):
     """
     更新业务数据,并同步发送更新通知，保证业务数据的更新和通知是原子操作
     :param result: 更新结果
@@ -17,9 +18,21 @@ def _merge_diff(result, diff, prototype, persist, reduce_diff=False, notify_upda
     :param reduce_diff: 表示是否修改 diff 对象本身，如果为 True 函数运行完成后，diff 会更新为与 result 真正的有区别的字段；如果为 False，diff 不会修改
         默认不会修改 diff，只有 api 中 is_changing 接口需要 diffs 为真正有变化的数据
     :param notify_update_diff: 为 True 表示发送更新通知的发送的是包含 diff 的完整数据包（方便 TqSim 中能每个合约的 task 可以单独维护自己的数据），反之只发送 True
+    :param diff_paths: 收集有变更的节点路径，{节点路径 tuple: 该节点下有变更的字段集合}，与 reduce_diff=True 一起使用，
+        记录的内容与 reduce_diff 之后的 diff 一致，is_changing 可以直接查表，不需要遍历 diff
     :return:
     """
-    for key in list(diff.keys()):
+    if isinstance(result, ColumnarSeries):
+        # K线 / Tick 序列数据为列式存储，直接写入列数据，不再为每条数据创建对象
+        result._merge_columns(diff, persist=persist, reduce_diff=reduce_diff)
+        diff_keys = []
+        if diff_paths is not None:
+            for key, item_diff in diff.items():
+                if item_diff:
+                    diff_paths.setdefault(tuple(result["_path"]) + (key, ), set()).update(item_diff.keys())
+    else:
+        diff_keys = list(diff.keys())
+    for key in diff_keys:
         value_type = type(diff[key])
         if value_type is str and key in prototype and not type(prototype[key]) is str:
             diff[key] = prototype[key]
@@ -50,7 +63,8 @@ def _merge_diff(result, diff, prototype, persist, reduce_diff=False, notify_upda
             else:
                 tpt = {}
             target = _get_obj(result, [key], default=default)
-            _merge_diff(target, diff[key], tpt, persist=tpersist, reduce_diff=reduce_diff, notify_update_diff=notify_update_diff)
+            _merge_diff(target, diff[key], tpt, persist=tpersist, reduce_diff=reduce_diff,
+                        notify_update_diff=notify_update_diff, diff_paths=diff_paths)
             if reduce_diff and len(diff[key]) == 0:
                 del diff[key]
         elif reduce_diff and key in result and (
@@ -60,6 +74,8 @@ def _merge_diff(result, diff, prototype, persist, reduce_diff=False, notify_upda
         else:
             result[key] = diff[key]
     if len(diff) != 0:
+        if diff_paths is not None:
+            diff_paths.setdefault(tuple(result["_path"]), set()).update(diff.keys())
         diff_obj = True
         if notify_update_diff:
             # 这里发的数据目前是不需要 copy (浅拷贝会有坑，深拷贝的话性能不知道有多大影响)
@@ -78,13 +94,22 @@ def _gen_diff_obj(diff, path):
 
 
 def _notify_update(target, recursive, content):
-    """同步通知业务数据更新"""
-    if isinstance(target, dict) or isinstance(target, Entity):
-        for q in getattr(target, "_listener", {}):
+    """同步通知业务数据更新，只遍历所在业务数据树的 _listened_paths 中登记过的节点，没有监听者的子树 (如回测中回收的K线) 不会被遍历"""
+    if isinstance(target, Entity):
+        listened_paths = getattr(target, "_listened_paths", None)
+        if listened_paths is not None and tuple(target._path) not in listened_paths:
+            return
+        listener = getattr(target, "_listener", {})
+        for q in listener:
             q.send_nowait(content)
+        if isinstance(listener, _ListenerSet):
+            listener._check_empty()
         if recursive:
             for v in target.values():
                 _notify_update(v, recursive, content)
+    elif isinstance(target, dict) and recursive:
+        for v in target.values():
+            _notify_update(v, recursive, content)
 
 
 def _get_obj(root, path, default=None):
@@ -96,7 +121,7 @@ def _get_obj(root, path, default=None):
                 dv = Entity()
             else:
                 dv = copy.copy(default)
-            dv._instance_entity(d["_path"] + [path[i]])
+            dv._instance_entity(d["_path"] + [path[i]], getattr(d, "_listened_paths", None))
             d[path[i]] = dv
         d = d[path[i]]
     return d
@@ -124,6 +149,23 @@ def _is_key_exist(diff, path, key):
     return len(key) == 0
 
 
+def _is_path_changing(diff_paths, path, key):
+    """根据 _merge_diff 收集的 diff_paths 判断指定数据是否有变更，与 _is_key_exist 在 reduce_diff 之后的 diff 中的判断结果一致"""
+    changed_keys = diff_paths.get(tuple(path))
+    if changed_keys is None:
+        return False
+    for k in key:
+        if k in changed_keys:
+            return True
+    return len(key) == 0
+
+
+def _update_diff_paths(result, diff_paths):
+    """将 diff_paths 合并到 result 中"""
+    for path, keys in diff_paths.items():
+        result.setdefault(path, set()).update(keys)
+
+
 def _simple_merge_diff(result, diff):
     """
     更新业务数据
@@ -131,7 +173,13 @@ def _simple_merge_diff(result, diff):
     :param diff: diff pack
     :return:
     """
-    for key in list(diff.keys()):
+    if isinstance(result, ColumnarSeries):
+        # K线 / Tick 序列数据为列式存储，直接写入列数据，不再为每条数据创建对象
+        result._merge_columns(diff, persist=False, reduce_diff=False)
+        diff_keys = []
+    else:
+        diff_keys = list(diff.keys())
+    for key in diff_keys:
         if diff[key] is None:
             result.pop(key, None)
         elif isinstance(diff[key], dict):
@@ -141,6 +189,33 @@ def _simple_merge_diff(result, diff):
             result[key] = diff[key]
 
 
+def _is_diff_recreating(result, diff):
+    """diff 中是否有节点在 result 中为 None (已删除)，这样的两个 diff 合并后无法同时表示删除和新的数据"""
+    for key, value in diff.items():
+        if isinstance(value, dict):
+            target = result.get(key, {})
+            if target is None and key in result:
+                return True
+            if isinstance(target, dict) and _is_diff_recreating(target, value):
+                return True
+    return False
+
+
+def _merge_diff_keep_deletions(result, diff):
+    """
+    将 diff 合并到 result 中，与 _simple_merge_diff 不同，diff 中为 None 的字段 (删除) 会保留在 result 中，合并的结果仍然是 diff
+    调用方需要先用 _is_diff_recreating 检查，result 中的字典都是新建的，不会修改 diff
+    """
+    for key, value in diff.items():
+        if isinstance(value, dict):
+            target = result.get(key)
+            if not isinstance(target, dict):
+                target = result[key] = {}
+            _merge_diff_keep_deletions(target, value)
+        else:
+            result[key] = value
+
+
 def _simple_merge_diff_and_collect_paths(result, diff, path: Tuple, diff_paths: Set, prototype: Union[Dict, None]):
     """
     更新业务数据并收集指定节点的路径
@@ -152,7 +227,13 @@ def _simple_merge_diff_and_collect_paths(result, diff, path: Tuple, diff_paths:
     :param prototype: 数据原型, 为 None 的节点路径会被记录在 diff_paths 集合中
     :return:
     """
-    for key in list(diff.keys()):
+    if isinstance(result, ColumnarSeries):
+        # K线 / Tick 序列数据为列式存储，直接写入列数据，不再为每条数据创建对象
+        result._merge_columns(diff, persist=False, reduce_diff=False)
+        diff_keys = []
+    else:
+        diff_keys = list(diff.keys())
+    for key in diff_keys:
         if diff[key] is None:
             result.pop(key, None)
             if prototype and ('*' in prototype or key in prototype) and prototype['*' if '*' in prototype else key] is None:
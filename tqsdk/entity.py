@@ -3,14 +3,77 @@
 __author__ = 'yanqiong'
 
 import copy
+import operator
 import weakref
 from collections.abc import MutableMapping
 
+class _ListenedPaths(object):
+    """
+    一棵业务数据树中有监听者的节点路径，通知更新时不在其中的节点 (及其所有子节点) 一定没有监听者，可以直接跳过
+
+    每个路径记录以它为上级 (包括它本身) 的有监听者的节点个数，节点的最后一个监听者移除后，该节点及其上级路径的计数减一，减到 0 时删除该路径
+    """
+
+    def __init__(self):
+        self._counts = {}
+
+    def __contains__(self, path):
+        return path in self._counts
+
+    def add(self, path):
+        for i in range(len(path) + 1):
+            self._counts[path[:i]] = self._counts.get(path[:i], 0) + 1
+
+    def remove(self, path):
+        for i in range(len(path) + 1):
+            count = self._counts[path[:i]] - 1
+            if count:
+                self._counts[path[:i]] = count
+            else:
+                del self._counts[path[:i]]
+
+
+class _ListenerSet(weakref.WeakSet):
+    """
+    节点的监听者集合，有监听者时将节点路径登记到所在业务数据树的 _ListenedPaths 中，没有监听者时删除
+
+    监听者被回收时 WeakSet 不会通知，由 _check_empty 在下次通知该节点时删除
+    """
+
+    def __init__(self, path=(), listened_paths=None):
+        super(_ListenerSet, self).__init__()
+        self._path = tuple(path)
+        self._listened_paths = listened_paths
+        self._registered = False
+
+    def add(self, item):
+        super(_ListenerSet, self).add(item)
+        if not self._registered and self._listened_paths is not None:
+            self._registered = True
+            self._listened_paths.add(self._path)
+
+    def discard(self, item):
+        super(_ListenerSet, self).discard(item)
+        self._check_empty()
+
+    def remove(self, item):
+        super(_ListenerSet, self).remove(item)
+        self._check_empty()
+
+    def _check_empty(self):
+        if self._registered and len(self) == 0:
+            self._registered = False
+            self._listened_paths.remove(self._path)
+
 
 class Entity(MutableMapping):
-    def _instance_entity(self, path):
+    def _instance_entity(self, path, listened_paths=None):
+        """listened_paths 为所在业务数据树的 _ListenedPaths，根节点 (path 为空) 不指定时新建"""
+        if listened_paths is None and not path:
+            listened_paths = _ListenedPaths()
         self._path = path
-        self._listener = weakref.WeakSet()
+        self._listened_paths = listened_paths
+        self._listener = _ListenerSet(path, listened_paths)
 
     def __setitem__(self, key, value):
         return self.__dict__.__setitem__(key, value)
@@ -36,3 +99,99 @@ class Entity(MutableMapping):
 
     def copy(self):
         return copy.copy(self)
+
+
+class CompactEntity(Entity):
+    """
+    字段固定的业务对象，预定义的字段保存在 __slots__ 中，不占用 __dict__
+
+    子类需要同时继承具体的业务对象类型 (如 Quote)，并在 __slots__ 中列出该业务对象的全部字段，
+    原型中没有的字段 (如服务器新增的字段) 仍然保存在 __dict__ 中；监听者集合在第一次使用时才创建。
+    对外保持与 Entity 相同的 Mapping 接口，_merge_diff 等函数不需要区分两种对象。
+    创建 TqApi 时指定 _compact_objs=True，行情、K线及 Tick 对象会使用这种方式保存。
+    """
+    __slots__ = ("_path", "_listened_paths", "_listener_set", "_api")
+    _fields = ()  # 业务字段，按照原型中的顺序，由子类指定
+
+    @property
+    def _listener(self):
+        if self._listener_set is None:
+            self._listener_set = _ListenerSet(self._path, self._listened_paths)
+        return self._listener_set
+
+    @_listener.setter
+    def _listener(self, value):
+        # _instance_entity 时设置的是空集合，等到添加监听者时再创建
+        self._listener_set = value if len(value) else None
+
+    def __setitem__(self, key, value):
+        return object.__setattr__(self, key, value)
+
+    def __delitem__(self, key):
+        try:
+            object.__delattr__(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __getitem__(self, key):
+        if key in self._slot_set:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        return self.__dict__.__getitem__(key)
+
+    def __contains__(self, key):
+        if key in self._slot_set:
+            return hasattr(self, key)
+        return key in self.__dict__
+
+    def _items(self):
+        try:
+            d = dict(zip(self._fields, self._fields_getter(self)))
+        except AttributeError:  # 有字段被删除
+            d = {k: object.__getattribute__(self, k) for k in self._fields if hasattr(self, k)}
+        for k, v in self.__dict__.items():
+            if not k.startswith("_"):
+                d[k] = v
+        return d
+
+    def __iter__(self):
+        return iter(self._items())
+
+    def __len__(self):
+        return len(self._items())
+
+    def __str__(self):
+        return str(self._items())
+
+    def __repr__(self):
+        return '{}, D({})'.format(object.__repr__(self), self._items())
+
+    def items(self):
+        return self._items().items()
+
+    def values(self):
+        return self._items().values()
+
+    def __copy__(self):
+        cls = self.__class__
+        obj = cls.__new__(cls)
+        for k in cls._slot_names:
+            try:
+                object.__setattr__(obj, k, object.__getattribute__(self, k))
+            except AttributeError:
+                pass
+        obj.__dict__.update(self.__dict__)
+        return obj
+
+    def __init_subclass__(cls, **kwargs):
+        super(CompactEntity, cls).__init_subclass__(**kwargs)
+        names = []
+        for c in cls.__mro__:
+            if "__slots__" in c.__dict__:
+                names.extend(c.__dict__["__slots__"])
+        cls._slot_names = tuple(dict.fromkeys(names))
+        cls._slot_set = frozenset(cls._slot_names) | {"_listener"}
+        cls._fields_getter = operator.attrgetter(*cls._fields) if len(cls._fields) > 1 else \
+            (lambda obj: tuple(getattr(obj, k) for k in cls._fields))
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+__author__ = 'mayanqiong'
+
+import hashlib
+import json
+import lzma
+import mmap
+import os
+import struct
+from collections.abc import Mapping
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from tqsdk.datetime import _timestamp_nano_to_datetime
+from tqsdk.utils import _quote_add_night
+
+SNAPSHOT_DIR = os.path.join(os.path.expanduser('~'), ".tqsdk/ins_snapshot")
+SNAPSHOT_VERSION = 1  # 快照文件格式或者合约信息补丁逻辑变化时需要修改版本号，旧版本的快照文件会被忽略
+_HEADER = struct.Struct("<4sIQQ")  # magic, 版本号, 合约代码部分的字节数, 合约数量
+_MAGIC = b"TQIS"
+
+
+class InsSnapshot(Mapping):
+    """
+    合约信息快照，按合约代码懒加载
+
+    快照文件格式：header | 以 \\n 分隔的合约代码 | int64 偏移量数组 (合约数量 + 1) | 每个合约信息的 json
+    打开快照时只读取合约代码及偏移量，某个合约的信息在第一次访问时才通过 mmap 读取并解析，同时补充以下字段:
+    * 期权的 exercise_year、exercise_month 在旧版合约服务中没有，使用下市日期代替最后行权日
+    * 回测时为应该有夜盘但是合约文件中没有夜盘的合约添加夜盘时间
+    """
+
+    def __init__(self, symbols: List[str], offsets: np.ndarray, data, add_night: bool = False) -> None:
+        self._index = {s: i for i, s in enumerate(symbols)}
+        self._symbols = symbols
+        self._offsets = offsets
+        self._data = data  # bytes 或者 mmap
+        self._add_night = add_night
+        self._quotes = {}  # 已经解析过的合约信息
+
+    def __getitem__(self, symbol: str) -> dict:
+        quote = self._quotes.get(symbol)
+        if quote is None:
+            i = self._index[symbol]
+            quote = json.loads(self._data[int(self._offsets[i]):int(self._offsets[i + 1])])
+            if quote.get("ins_class") == "FUTURE_OPTION":
+                expire_datetime = _timestamp_nano_to_datetime(int(quote["expire_datetime"] * 1000000) * 1000)
+                quote["exercise_year"] = expire_datetime.year
+                quote["exercise_month"] = expire_datetime.month
+            if self._add_night:
+                _quote_add_night(quote)
+            self._quotes[symbol] = quote
+        return quote
+
+    def __contains__(self, symbol) -> bool:
+        return symbol in self._index
+
+    def __iter__(self):
+        return iter(self._symbols)
+
+    def __len__(self) -> int:
+        return len(self._symbols)
+
+    @staticmethod
+    def from_quotes(quotes: Dict[str, dict], add_night: bool = False) -> "InsSnapshot":
+        """由完整的合约信息生成快照"""
+        symbols = list(quotes.keys())
+        blobs = [json.dumps(quotes[s], ensure_ascii=False).encode("utf-8") for s in symbols]
+        offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in blobs], out=offsets[1:])
+        return InsSnapshot(symbols, offsets, b"".join(blobs), add_night)
+
+    @staticmethod
+    def from_lzma(path: str, add_night: bool = False) -> "InsSnapshot":
+        """
+        读取 sdk 自带的 lzma 压缩的合约信息文件，本地快照以文件内容的 hash 校验，文件内容变化后会重新生成快照
+        """
+        with open(path, "rb") as f:
+            content = f.read()
+        name = f"{os.path.basename(path)}.{hashlib.sha256(content).hexdigest()[:16]}"
+        snapshot, _ = InsSnapshot._load(name, add_night)
+        if snapshot is None:
+            snapshot = InsSnapshot.from_quotes(json.loads(lzma.decompress(content).decode("utf-8")), add_night)
+            snapshot._dump(name)
+        return snapshot
+
+    @staticmethod
+    def _get_path(name: str) -> str:
+        return os.path.join(SNAPSHOT_DIR, f"{name}.v{SNAPSHOT_VERSION}")
+
+    @staticmethod
+    def _load(name: str, add_night: bool = False) -> Tuple[Optional["InsSnapshot"], Optional[str]]:
+        """读取本地快照及其 ETag，快照不存在或者格式不对时返回 (None, None)"""
+        path = InsSnapshot._get_path(name)
+        try:
+            with open(path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, symbols_size, count = _HEADER.unpack_from(data, 0)
+            if magic != _MAGIC or version != SNAPSHOT_VERSION:
+                return None, None
+            pos = _HEADER.size
+            symbols = data[pos:pos + symbols_size].decode("utf-8").split("\n") if count else []
+            pos += symbols_size
+            offsets = np.frombuffer(data, dtype=np.int64, count=count + 1, offset=pos) + (pos + 8 * (count + 1))
+            etag = None
+            if os.path.exists(path + ".etag"):
+                with open(path + ".etag", "r", encoding="utf-8") as f:
+                    etag = f.read()
+            return InsSnapshot(symbols, offsets, data, add_night), etag
+        except (OSError, ValueError, struct.error):
+            return None, None
+
+    def _dump(self, name: str, etag: Optional[str] = None) -> None:
+        """保存本地快照，先写临时文件再重命名，多个进程同时写入时不会读到不完整的文件；写入失败时忽略"""
+        path = InsSnapshot._get_path(name)
+        temp_path = f"{path}.{os.getpid()}.temp"
+        try:
+            os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+            symbols = "\n".join(self._symbols).encode("utf-8")
+            with open(temp_path, "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, SNAPSHOT_VERSION, len(symbols), len(self._symbols)))
+                f.write(symbols)
+                f.write((self._offsets - self._offsets[0]).astype(np.int64).tobytes())
+                f.write(self._data[int(self._offsets[0]):int(self._offsets[-1])])
+            os.replace(temp_path, path)
+            if etag:
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    f.write(etag)
+                os.replace(temp_path, path + ".etag")
+            elif os.path.exists(path + ".etag"):
+                os.remove(path + ".etag")
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
@@ -0,0 +1,78 @@
+#!usr/bin/env python3
+# -*- coding:utf-8 -*-
+__author__ = 'mayanqiong'
+
+"""
+行情数据在各个模块中的耗时统计
+
+通过 TqApi(..., _latency_stats=True) 开启，开启后:
+* 各个模块处理数据包的耗时: TqConnect 解码 (TqConnect.md / TqConnect.td_0 ...)、TqSim._md_recv、DataExtension._generate_ext_diff、
+  TqApi 中 merge 数据 (TqApi.merge) 及更新 K线 / Tick 序列 (TqApi.serial)
+* 从 TqConnect 收到行情数据包到各个模块处理完成的累计耗时: MdReconnect、DataExtension、TqApi (md_recv_to_xxx)
+  链路中的数据包由 peek_message 控制，同一时刻只有一批数据在处理，所以以尚未被 api 处理的最早的行情数据包的接收时间作为起点
+* 交易所时间到用户可见的耗时 (exchange_to_api): wait_update 返回时本地时间与本次更新的行情中最新的 quote.datetime 之差，
+  包含本地与交易所的时钟误差，回测时不统计
+
+每项只保留最近的 LatencyStats.SAMPLE_SIZE 个样本，记录一个样本只有一次 deque.append 的开销；
+通过 api._get_latency_stats() 获取各项的样本数、p50、p99、最大值 (毫秒)，开启后每隔 LOG_INTERVAL 秒以及 api.close() 时会打印在日志中。
+"""
+
+import time
+from collections import deque
+from typing import Dict, Optional
+
+import numpy as np
+
+from tqsdk.datetime import _str_to_timestamp_nano
+
+
+class LatencyStats(object):
+    """各个阶段的耗时样本"""
+
+    SAMPLE_SIZE = 4096  # 每项保留的样本个数
+    LOG_INTERVAL = 60  # 打印日志的间隔 (秒)
+
+    def __init__(self) -> None:
+        self._samples: Dict[str, deque] = {}
+        self._md_recv_time: Optional[float] = None  # 尚未被 api 处理的最早的行情数据包的接收时间
+        self._last_log_time = time.time()
+
+    def record(self, stage: str, seconds: float) -> None:
+        """记录 stage 一次的耗时"""
+        samples = self._samples.get(stage)
+        if samples is None:
+            samples = self._samples[stage] = deque(maxlen=LatencyStats.SAMPLE_SIZE)
+        samples.append(seconds)
+
+    def on_md_recv(self) -> None:
+        """TqConnect 收到行情数据包"""
+        if self._md_recv_time is None:
+            self._md_recv_time = time.time()
+
+    def record_since_md_recv(self, stage: str, done: bool = False) -> None:
+        """记录从收到行情数据包到 stage 处理完成的耗时，done 为 True 表示这批数据已经被 api 处理完"""
+        if self._md_recv_time is not None:
+            self.record(f"md_recv_to_{stage}", time.time() - self._md_recv_time)
+            if done:
+                self._md_recv_time = None
+
+    def record_exchange_time(self, quote_datetime: str) -> None:
+        """记录交易所时间 quote_datetime 到当前的耗时"""
+        self.record("exchange_to_api", time.time() - _str_to_timestamp_nano(quote_datetime) / 1e9)
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """返回各项的样本数、p50、p99、最大值，单位为毫秒"""
+        stats = {}
+        for stage, samples in list(self._samples.items()):
+            if samples:
+                arr = np.fromiter(samples, dtype=np.float64, count=len(samples)) * 1000
+                p50, p99 = np.percentile(arr, [50, 99])
+                stats[stage] = {"count": len(arr), "p50": float(p50), "p99": float(p99), "max": float(arr.max())}
+        return stats
+
+    def log(self, logger, force: bool = False) -> None:
+        """距离上次打印超过 LOG_INTERVAL 秒时在日志中打印统计结果"""
+        now = time.time()
+        if force or now - self._last_log_time >= LatencyStats.LOG_INTERVAL:
+            self._last_log_time = now
+            logger.info("latency stats", stats=self.get_stats())
@@ -3,7 +3,12 @@
 __author__ = 'yanqiong'
 
 import datetime
+import logging
 import os
+import queue
+import threading
+import time
+from typing import List
 
 import psutil
 
@@ -57,3 +62,128 @@ def _clear_logs():
             _remove_log(path)
         else:
             break
+
+
+class _AsyncLogHandler(logging.Handler):
+    """
+    在后台线程中批量写入日志文件的 Handler
+
+    emit 只把日志放入队列，文件写入都在后台线程中完成，不会阻塞 EventLoop 所在的线程:
+    * 附加字段都是不可变的值 (如 TqConnect 收到的原始数据包 str) 时，日志在后台线程中格式化，否则在 emit 时格式化，避免格式化时数据已经被修改
+    * 后台线程每次最多写入 BATCH_SIZE 条日志后 flush，队列中没有日志时每隔 FLUSH_INTERVAL 秒检查一次
+    * 文件大小超过 max_bytes 时将当前文件重命名为 xxx.log.1 (原有的 xxx.log.1 重命名为 xxx.log.2，以此类推)，最多保留 backup_count 个
+    * 队列中的日志超过 QUEUE_SIZE 条时 (磁盘写入跟不上) 丢弃新的日志，并在日志文件中记录丢弃的条数
+    """
+
+    BATCH_SIZE = 1000  # 每次最多批量写入的日志条数
+    FLUSH_INTERVAL = 0.2  # 队列为空时后台线程检查的间隔 (秒)
+    QUEUE_SIZE = 100000  # 队列中最多缓存的日志条数
+    MAX_BYTES = 500 * 1024 * 1024  # 单个日志文件的最大字节数
+    BACKUP_COUNT = 10  # 最多保留的历史日志文件个数
+
+    _IMMUTABLE_TYPES = (str, int, float, bool, type(None), bytes)
+    _CLOSE = object()  # 通知后台线程退出
+
+    def __init__(self, filename: str, max_bytes: int = MAX_BYTES, backup_count: int = BACKUP_COUNT) -> None:
+        super(_AsyncLogHandler, self).__init__()
+        self._filename = os.path.abspath(filename)
+        self._max_bytes = max_bytes
+        self._backup_count = backup_count
+        self._queue = queue.Queue(maxsize=_AsyncLogHandler.QUEUE_SIZE)
+        self._dropped = 0  # 队列满时丢弃的日志条数，由 emit 所在线程增加
+        self._dropped_written = 0  # 已经记录在日志文件中的丢弃条数，只在后台线程中使用
+        # 以二进制方式写入，_size 为文件的字节数，与 max_bytes 比较
+        self._file = open(self._filename, "ab")
+        self._size = self._file.tell()
+        self._thread = threading.Thread(target=self._write_loop, name="TqLogWriter", daemon=True)
+        self._thread.start()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            item = record if self._is_immutable(record) else self.format(record)
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self._dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def _is_immutable(self, record: logging.LogRecord) -> bool:
+        """日志的参数及附加字段都是不可变的值时可以在后台线程中格式化"""
+        if record.args or record.exc_info:
+            return False
+        extra = getattr(record, "extra", None)
+        if extra is None:
+            return True
+        return isinstance(extra, dict) and all(isinstance(v, _AsyncLogHandler._IMMUTABLE_TYPES) for v in extra.values())
+
+    def _write_loop(self) -> None:
+        closed = False
+        while not closed:
+            try:
+                batch = [self._queue.get(timeout=_AsyncLogHandler.FLUSH_INTERVAL)]
+            except queue.Empty:
+                continue
+            try:
+                while len(batch) < _AsyncLogHandler.BATCH_SIZE:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            lines = []
+            for item in batch:
+                if item is _AsyncLogHandler._CLOSE:
+                    closed = True
+                elif isinstance(item, logging.LogRecord):
+                    try:
+                        lines.append(self.format(item))
+                    except Exception:
+                        self.handleError(item)
+                else:
+                    lines.append(item)
+            dropped = self._dropped
+            if dropped != self._dropped_written:
+                lines.append(self.format(logging.makeLogRecord({
+                    "name": "TqLogWriter", "levelno": logging.WARNING, "levelname": "WARNING",
+                    "msg": "log records dropped", "extra": {"count": dropped - self._dropped_written}
+                })))
+                self._dropped_written = dropped
+            if lines:
+                self._write(lines)
+        self._file.close()
+
+    def _write(self, lines: List[str]) -> None:
+        """写入一批日志，按照 utf-8 编码后的字节数判断是否需要切分文件"""
+        chunk, chunk_size = [], 0
+        for line in lines:
+            encoded = (line + "\n").encode("utf-8")
+            if self._size + chunk_size > 0 and self._size + chunk_size + len(encoded) > self._max_bytes:
+                self._file.write(b"".join(chunk))
+                self._rotate()
+                chunk, chunk_size = [], 0
+            chunk.append(encoded)
+            chunk_size += len(encoded)
+        self._file.write(b"".join(chunk))
+        self._file.flush()
+        self._size += chunk_size
+
+    def _rotate(self) -> None:
+        self._file.close()
+        if self._backup_count > 0:
+            for i in range(self._backup_count - 1, 0, -1):
+                src = f"{self._filename}.{i}"
+                if os.path.exists(src):
+                    os.replace(src, f"{self._filename}.{i + 1}")
+            os.replace(self._filename, f"{self._filename}.1")
+        self._file = open(self._filename, "wb")
+        self._size = 0
+
+    def flush(self, timeout: float = 5) -> None:
+        """等待队列中的日志写入文件"""
+        deadline = time.time() + timeout
+        while self._thread.is_alive() and not self._queue.empty() and time.time() < deadline:
+            time.sleep(0.01)
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._queue.put(_AsyncLogHandler._CLOSE)
+            self._thread.join(timeout=5)
+        super(_AsyncLogHandler, self).close()
@@ -0,0 +1,108 @@
+#!usr/bin/env python3
+# -*- coding:utf-8 -*-
+__author__ = 'mayanqiong'
+
+"""
+EventLoop 耗时分析
+
+通过 TqApi(..., _loop_profile=True) 开启，开启后 TqBaseApi 的 call_soon 补丁会包装每个回调，按照回调所属的协程 (Task 的 coroutine 名称及
+Task 名称) 统计执行次数及耗时，同时统计 TqBaseApi._run_once 的次数 (即 ioloop.run_forever 的次数，每次 run_forever 可能包含多次 loop 迭代)
+及 call_soon 的次数 (事件数)。
+
+每次 wait_update 为一个统计周期:
+* api._get_loop_profile() 返回最近一次 wait_update 及开启以来累计的统计结果，包括耗时最多的协程
+* 一次 wait_update 中回调的总耗时超过 LoopProfiler.SLOW_THRESHOLD 秒时，在日志中打印这次的统计结果，用于找到占用 EventLoop 影响行情处理的策略代码
+"""
+
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+
+class LoopProfile(object):
+    """一个统计周期内的统计结果"""
+
+    def __init__(self) -> None:
+        self.start_time = time.time()
+        self.wall = 0.0  # 统计周期的时长
+        self.busy = 0.0  # 执行回调的总耗时
+        self.runs = 0  # TqBaseApi._run_once (ioloop.run_forever) 的次数
+        self.events = 0  # call_soon 的次数
+        self.callbacks: Dict[str, List[float]] = {}  # {协程名称: [执行次数, 耗时]}
+
+    def add(self, other: "LoopProfile") -> None:
+        self.wall += other.wall
+        self.busy += other.busy
+        self.runs += other.runs
+        self.events += other.events
+        for name, (count, seconds) in other.callbacks.items():
+            item = self.callbacks.setdefault(name, [0, 0.0])
+            item[0] += count
+            item[1] += seconds
+
+    def to_dict(self, top: int = 10) -> Dict[str, Any]:
+        """返回统计结果，slowest 为耗时最多的 top 个协程，时间单位为毫秒"""
+        slowest = sorted(self.callbacks.items(), key=lambda item: item[1][1], reverse=True)[:top]
+        return {
+            "wall": self.wall * 1000,
+            "busy": self.busy * 1000,
+            "runs": self.runs,
+            "events": self.events,
+            "slowest": [{"name": name, "count": count, "time": seconds * 1000} for name, (count, seconds) in slowest],
+        }
+
+
+class LoopProfiler(object):
+    """按照协程统计 EventLoop 中回调的执行次数及耗时"""
+
+    SLOW_THRESHOLD = 0.1  # 一次 wait_update 中回调总耗时超过该值 (秒) 时打印日志
+
+    def __init__(self) -> None:
+        self._current = LoopProfile()  # 当前统计周期
+        self._last: Optional[LoopProfile] = None  # 上一次 wait_update 的统计结果
+        self._total = LoopProfile()  # 开启以来累计的统计结果
+
+    def wrap(self, callback: Callable) -> Callable:
+        """包装 call_soon 的回调，执行时统计其所属协程的耗时"""
+        self._current.events += 1
+        owner = getattr(callback, "__self__", None)
+        if isinstance(owner, asyncio.Task):
+            # Task 的 __step / __wakeup 回调，按照 Task 统计，同一个协程函数创建的多个 Task (例如不同合约的 TargetPosTask) 分别统计
+            coro_name = getattr(owner.get_coro(), "__qualname__", None)
+            name = f"{coro_name}[{owner.get_name()}]" if coro_name else owner.get_name()
+        else:
+            name = getattr(callback, "__qualname__", None) or repr(callback)
+
+        def profiled_callback(*args):
+            start_time = time.perf_counter()
+            try:
+                return callback(*args)
+            finally:
+                seconds = time.perf_counter() - start_time
+                profile = self._current
+                profile.busy += seconds
+                item = profile.callbacks.get(name)
+                if item is None:
+                    profile.callbacks[name] = [1, seconds]
+                else:
+                    item[0] += 1
+                    item[1] += seconds
+        return profiled_callback
+
+    def on_run(self) -> None:
+        self._current.runs += 1
+
+    def finish(self, logger=None) -> None:
+        """结束当前统计周期 (一次 wait_update)，回调耗时超过 SLOW_THRESHOLD 时打印日志"""
+        profile, self._current = self._current, LoopProfile()
+        profile.wall = time.time() - profile.start_time
+        self._last = profile
+        self._total.add(profile)
+        if logger is not None and profile.busy > LoopProfiler.SLOW_THRESHOLD:
+            logger.info("slow wait_update", **profile.to_dict(top=5))
+
+    def get_profile(self, top: int = 10) -> Dict[str, Any]:
+        return {
+            "last": self._last.to_dict(top) if self._last else None,
+            "total": self._total.to_dict(top),
+        }
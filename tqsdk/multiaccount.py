@@ -3,16 +3,19 @@
 __time__ = '2020/8/5 22:45'
 __author__ = 'Hong Yan'
 
-from typing import List, Union, Optional, TYPE_CHECKING
+import functools
+from typing import Dict, List, Union, Optional, TYPE_CHECKING
 
 from shinny_structlog import ShinnyLoggerAdapter
 
 if TYPE_CHECKING:
     from tqsdk.api import UnionTradeable
 
-from tqsdk.channel import TqChan
+from tqsdk.channel import TqChan, TqPipeChan
+from tqsdk.subscribe import QuoteSubscribeManager
 from tqsdk.tradeable import TqSim, BaseSim
 from tqsdk.tradeable.mixin import StockMixin
+from tqsdk.tradeable.tradeable import Tradeable
 
 
 class TqMultiAccount(object):
@@ -127,18 +130,156 @@ class TqMultiAccount(object):
 
     def _setup_connection(self, api, api_send_chan, api_recv_chan, ws_md_send_chan, ws_md_recv_chan):
         self._api = api
-        # 将多个 account chain 起来
-        log = ShinnyLoggerAdapter(self._api._logger.getChild("TqMultiAccount"))
+        if len(self._account_list) == 1:
+            account = self._account_list[0]
+            ws_md_send_chan._logger_bind(chan_from="account_0")
+            ws_md_recv_chan._logger_bind(chan_to="account_0")
+            conn_id = account._connect_td(self._api, 0)
+            if conn_id:
+                self._map_conn_id[conn_id] = account
+            self._api.create_task(account._run(self._api, api_send_chan, api_recv_chan, ws_md_send_chan, ws_md_recv_chan))
+            return
+        # 多个账户通过 TqAccountHub 并联，行情只需要经过一个账户模块
+        hub = TqAccountHub(self._api, self._account_list)
         for index, account in enumerate(self._account_list):
-            _send_chan = api_send_chan if index == len(self._account_list) - 1 else TqChan(self._api, logger=log)
-            _recv_chan = api_recv_chan if index == len(self._account_list) - 1 else TqChan(self._api, logger=log)
-            _send_chan._logger_bind(chan_name=f"send to account_{index}")
-            _recv_chan._logger_bind(chan_name=f"recv from account_{index}")
-            ws_md_send_chan._logger_bind(chan_from=f"account_{index}")
-            ws_md_recv_chan._logger_bind(chan_to=f"account_{index}")
             conn_id = account._connect_td(self._api, index)
             if conn_id:
                 self._map_conn_id[conn_id] = account
             # 启动账户实例
-            self._api.create_task(account._run(self._api, _send_chan, _recv_chan, ws_md_send_chan, ws_md_recv_chan))
-            ws_md_send_chan, ws_md_recv_chan = _send_chan, _recv_chan
+            self._api.create_task(account._run(self._api, *hub._get_account_chans(index)))
+        ws_md_send_chan._logger_bind(chan_from="account_hub")
+        ws_md_recv_chan._logger_bind(chan_to="account_hub")
+        self._api.create_task(hub._run(api_send_chan, api_recv_chan, ws_md_send_chan, ws_md_recv_chan))
+
+
+class TqAccountHub(object):
+    """
+    多账户的星型连接模块，所有账户模块都连接在 hub 上，而不是依次串联:
+
+    * 上游的行情数据包由 hub 分别发给每个账户，并且只转发一次给下游。各个账户仍然在同一个 EventLoop 中依次处理行情，
+      hub 减少的是行情依次经过每个账户时的 channel 转发，而不是并行处理
+    * 下游的交易请求按照 account_key 只发给对应的账户，其他请求直接发给上游
+    * 各个账户的 subscribe_quote 合并后发给上游
+    * 各个账户发出的数据包中，行情部分 (与 hub 发给账户的 diff 是同一个对象) 去掉，其余部分合并在一个 rtn_data 中发给下游
+
+    与串联时一致，hub 发给账户的每个行情数据包都要等到所有账户处理完成才会发给下游，所有账户都向上游请求数据时才会向上游发送 peek_message，
+    所以模拟账户根据某个行情撮合的成交与该行情在同一个 rtn_data 中。
+    账户发给 hub 的数据包直接在账户的 task 中处理 (TqPipeChan)，hub 只需要处理上游行情及下游请求。
+    """
+
+    def __init__(self, api, accounts: List['UnionTradeable']) -> None:
+        self._api = api
+        self._account_index = {account._account_key: index for index, account in enumerate(accounts)}
+        count = len(accounts)
+        log = ShinnyLoggerAdapter(self._api._logger.getChild("TqMultiAccount"))
+        # hub 与每个账户之间的 4 个 channel，account 发给 hub 的数据包直接由 hub 处理
+        self._account_send_chans = [TqChan(api, logger=log, chan_name=f"send to account_{i}") for i in range(count)]
+        self._account_recv_chans = [TqPipeChan(api, functools.partial(self._on_account_pack, i), logger=log,
+                                               chan_name=f"recv from account_{i}") for i in range(count)]
+        self._account_md_send_chans = [TqPipeChan(api, functools.partial(self._on_account_md_pack, i), logger=log,
+                                                  chan_name=f"send from account_{i} to md") for i in range(count)]
+        self._account_md_recv_chans = [TqChan(api, logger=log, chan_name=f"recv md to account_{i}") for i in range(count)]
+        self._diffs = []
+        self._pending_peek = False  # 下游发过 peek_message，没有回复
+        self._pending_peek_md = False  # 发给上游 peek_message，没有收到回复
+        self._account_peek_md = [False] * count  # 每个账户是否向 hub 请求行情数据
+        self._account_waiting = [0] * count  # 每个账户收到的行情 diff 中还没有发回的个数
+        self._md_diffs: Dict[int, list] = {}  # 发给账户的行情 diff {id: [diff, 还没有发回的账户个数]}，账户发回时据此去掉行情部分
+        self._quote_subscribe = QuoteSubscribeManager()  # 下游 ("api") 及各个账户订阅的合约
+
+    def _get_account_chans(self, index: int):
+        """返回第 index 个账户模块的 api_send_chan, api_recv_chan, md_send_chan, md_recv_chan"""
+        return self._account_send_chans[index], self._account_recv_chans[index], \
+            self._account_md_send_chans[index], self._account_md_recv_chans[index]
+
+    async def _run(self, api_send_chan, api_recv_chan, md_send_chan, md_recv_chan):
+        self._api_recv_chan = api_recv_chan
+        self._md_send_chan = md_send_chan
+        for chan in self._account_send_chans:
+            chan.send_nowait({"aid": "peek_message"})
+        md_task = self._api.create_task(self._md_handler(md_recv_chan))
+        try:
+            async for pack in api_send_chan:
+                self._on_api_pack(pack)
+        finally:
+            await self._api._cancel_task(md_task)
+
+    async def _md_handler(self, md_recv_chan):
+        async for pack in md_recv_chan:
+            self._on_md_pack(pack)
+
+    def _on_api_pack(self, pack):
+        """处理下游发送的数据包"""
+        if pack["aid"] == "peek_message":
+            self._pending_peek = True
+            self._send_diff()
+        elif pack["aid"] in Tradeable._trade_pack_aids and pack.get("account_key") in self._account_index:
+            self._account_send_chans[self._account_index[pack["account_key"]]].send_nowait(pack)
+        elif pack["aid"] == "subscribe_quote":
+            self._update_subscribe("api", pack["ins_list"])
+        else:
+            self._md_send_chan.send_nowait(pack)
+
+    def _on_md_pack(self, pack):
+        """处理上游发送的数据包，行情数据包发给所有账户"""
+        if pack["aid"] != "rtn_data":
+            self._api_recv_chan.send_nowait(pack)
+            return
+        self._pending_peek_md = False
+        data = pack.get("data", [])
+        self._diffs.extend(data)
+        for d in data:
+            self._md_diffs[id(d)] = [d, len(self._account_md_recv_chans)]
+        for i, chan in enumerate(self._account_md_recv_chans):
+            self._account_peek_md[i] = False
+            self._account_waiting[i] += len(data)
+            chan.send_nowait({"aid": "rtn_data", "data": data})
+        self._send_diff()
+
+    def _on_account_pack(self, index, pack):
+        """处理第 index 个账户发给下游的数据包"""
+        if pack["aid"] != "rtn_data":
+            self._api_recv_chan.send_nowait(pack)
+            return
+        for d in pack.get("data", []):
+            md_diff = self._md_diffs.get(id(d))
+            if md_diff is None or md_diff[0] is not d:
+                self._diffs.append(d)
+                continue
+            self._account_waiting[index] -= 1
+            md_diff[1] -= 1
+            if md_diff[1] == 0:
+                del self._md_diffs[id(d)]
+        self._account_send_chans[index].send_nowait({"aid": "peek_message"})
+        self._send_diff()
+
+    def _on_account_md_pack(self, index, pack):
+        """处理第 index 个账户发给上游的数据包"""
+        if pack["aid"] == "peek_message":
+            self._account_peek_md[index] = True
+            self._send_diff()
+        elif pack["aid"] == "subscribe_quote":
+            self._update_subscribe(index, pack["ins_list"])
+        else:
+            self._md_send_chan.send_nowait(pack)
+
+    def _update_subscribe(self, source, ins_list: str):
+        if self._quote_subscribe.set_source(source, ins_list.split(",")):
+            pack = self._quote_subscribe.make_pack()
+            if pack:
+                self._md_send_chan.send_nowait(pack)
+
+    def _send_diff(self):
+        if not self._pending_peek:
+            return
+        if self._diffs and not any(self._account_waiting):
+            rtn_data = {
+                "aid": "rtn_data",
+                "data": self._diffs,
+            }
+            self._diffs = []
+            self._pending_peek = False
+            self._api_recv_chan.send_nowait(rtn_data)
+        elif not self._diffs and not self._pending_peek_md and all(self._account_peek_md):
+            self._pending_peek_md = True
+            self._md_send_chan.send_nowait({"aid": "peek_message"})
@@ -7,7 +7,7 @@ import json
 from typing import List
 
 from tqsdk.diff import _get_obj
-from tqsdk.entity import Entity
+from tqsdk.entity import Entity, CompactEntity
 
 
 class Quote(Entity):
@@ -160,10 +160,10 @@ class Quote(Entity):
         #: 持仓限额
         self.position_limit: int = 0
 
-    def _instance_entity(self, path):
-        super(Quote, self)._instance_entity(path)
+    def _instance_entity(self, path, listened_paths=None):
+        super(Quote, self)._instance_entity(path, listened_paths)
         self.trading_time = copy.copy(self.trading_time)
-        self.trading_time._instance_entity(path + ["trading_time"])
+        self.trading_time._instance_entity(path + ["trading_time"], self._listened_paths)
 
     @property
     def underlying_quote(self):
@@ -309,6 +309,40 @@ class Tick(Entity):
         self.open_interest: int = 0
 
 
+def _entity_fields(cls):
+    """业务对象的全部字段，按照 __init__ 中定义的顺序"""
+    return tuple(k for k in cls(None).__dict__ if not k.startswith("_"))
+
+
+class CompactTradingTime(CompactEntity, TradingTime):
+    """ 字段保存在 __slots__ 中的 TradingTime """
+    __slots__ = _entity_fields(TradingTime)
+    _fields = __slots__
+    __repr__ = TradingTime.__repr__
+
+
+class CompactQuote(CompactEntity, Quote):
+    """ 字段保存在 __slots__ 中的 Quote，用法与 Quote 完全相同，占用内存更少 """
+    __slots__ = _entity_fields(Quote)
+    _fields = __slots__
+
+    def __init__(self, api):
+        super(CompactQuote, self).__init__(api)
+        self.trading_time = CompactTradingTime(api)
+
+
+class CompactKline(CompactEntity, Kline):
+    """ 字段保存在 __slots__ 中的 Kline，用法与 Kline 完全相同，占用内存更少 """
+    __slots__ = _entity_fields(Kline)
+    _fields = __slots__
+
+
+class CompactTick(CompactEntity, Tick):
+    """ 字段保存在 __slots__ 中的 Tick，用法与 Tick 完全相同，占用内存更少 """
+    __slots__ = _entity_fields(Tick)
+    _fields = __slots__
+
+
 class Account(Entity):
     """ Account 是一个账户对象 """
 
@@ -554,14 +588,14 @@ class RiskManagementRule(Entity):
         self.frequent_cancellation = FrequentCancellationRule(self._api)
         self.trade_position_ratio = TradePositionRatioRule(self._api)
 
-    def _instance_entity(self, path):
-        super(RiskManagementRule, self)._instance_entity(path)
+    def _instance_entity(self, path, listened_paths=None):
+        super(RiskManagementRule, self)._instance_entity(path, listened_paths)
         self.self_trade = copy.copy(self.self_trade)
-        self.self_trade._instance_entity(path + ["self_trade"])
+        self.self_trade._instance_entity(path + ["self_trade"], self._listened_paths)
         self.frequent_cancellation = copy.copy(self.frequent_cancellation)
-        self.frequent_cancellation._instance_entity(path + ["frequent_cancellation"])
+        self.frequent_cancellation._instance_entity(path + ["frequent_cancellation"], self._listened_paths)
         self.trade_position_ratio = copy.copy(self.trade_position_ratio)
-        self.trade_position_ratio._instance_entity(path + ["trade_position_ratio"])
+        self.trade_position_ratio._instance_entity(path + ["trade_position_ratio"], self._listened_paths)
 
 
 class SelfTradeRule(Entity):
@@ -630,14 +664,14 @@ class RiskManagementData(Entity):
         #: 成交持仓比情况
         self.trade_position_ratio = TradePositionRatio(self._api)
 
-    def _instance_entity(self, path):
-        super(RiskManagementData, self)._instance_entity(path)
+    def _instance_entity(self, path, listened_paths=None):
+        super(RiskManagementData, self)._instance_entity(path, listened_paths)
         self.self_trade = copy.copy(self.self_trade)
-        self.self_trade._instance_entity(path + ["self_trade"])
+        self.self_trade._instance_entity(path + ["self_trade"], self._listened_paths)
         self.frequent_cancellation = copy.copy(self.frequent_cancellation)
-        self.frequent_cancellation._instance_entity(path + ["frequent_cancellation"])
+        self.frequent_cancellation._instance_entity(path + ["frequent_cancellation"], self._listened_paths)
         self.trade_position_ratio = copy.copy(self.trade_position_ratio)
-        self.trade_position_ratio._instance_entity(path + ["trade_position_ratio"])
+        self.trade_position_ratio._instance_entity(path + ["trade_position_ratio"], self._listened_paths)
 
 
 class SelfTrade(Entity):
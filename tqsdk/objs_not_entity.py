@@ -4,19 +4,20 @@ __author__ = 'mayanqiong'
 
 from collections import namedtuple
 import datetime
-from typing import Callable, Tuple, Optional
+from typing import AsyncIterator, Callable, Tuple, Optional, List
 
 import numpy
 from pandas import DataFrame, Series, Index
 from sgqlc.operation import Operation
 from tqsdk.backtest import TqBacktest
+from tqsdk.channel import TqChan
 
 from tqsdk.datetime import _get_expire_rest_days, _str_to_timestamp_nano
 from tqsdk.ins_schema import ins_schema, _add_all_frags
 from tqsdk.objs import Quote
 from tqsdk.diff import _get_obj
-from tqsdk.utils import _generate_uuid
-from tqsdk.tafunc import _get_t_series, get_impv, _get_d1, get_delta, get_theta, get_gamma, get_vega, get_rho
+from tqsdk.utils import _generate_uuid, _query_for_quote
+from tqsdk.tafunc import _get_t_series, get_option_chain_greeks
 
 """
 这两个类只在 api 中用到，主要为了支持用户异步中 await 
@@ -25,11 +26,11 @@ from tqsdk.tafunc import _get_t_series, get_impv, _get_d1, get_delta, get_theta,
 
 
 async def ensure_quote(api, quote):
-    if quote.price_tick > 0 and (quote.datetime != "" or (hasattr(quote, "_backtest_no_kline") and quote._backtest_no_kline)):
+    if _is_quote_ready(quote):
         return quote
     async with api.register_update_notify(quote) as update_chan:
         async for _ in update_chan:
-            if quote.price_tick > 0 and (quote.datetime != "" or (hasattr(quote, "_backtest_no_kline") and quote._backtest_no_kline)):
+            if _is_quote_ready(quote):
                 return quote
 
 
@@ -58,17 +59,14 @@ class QuoteList(list):
         await self._api._ensure_symbol_async([q._path[-1] for q in self])
         self._api._auth._has_md_grants([q._path[-1] for q in self])  # 权限检查
         # 发送的请求会请求到所有字段，如果是期权也会请求标的的合约信息
-        underlying_symbols = set([q.underlying_symbol for q in self if q.underlying_symbol])
-        need_quotes = set([q._path[-1] for q in self]).union(underlying_symbols)
-        if need_quotes - self._api._requests["quotes"] != set():
-            self._api._requests["quotes"] = self._api._requests["quotes"].union(need_quotes)
-            self._api._send_pack({
-                "aid": "subscribe_quote",
-                "ins_list": ",".join(self._api._requests["quotes"]),
-            })
+        self._api._subscribe_quote(set([q._path[-1] for q in self]))
+        underlying_symbols = {q._path[-1]: q.underlying_symbol for q in self if q.underlying_symbol}  # {期权: 标的合约}
+        for symbol, underlying_symbol in underlying_symbols.items():
+            # 每个期权订阅一次标的合约，退订期权时一并退订
+            self._api._subscribe_underlying(symbol, underlying_symbol)
         if all([q.datetime != "" or (hasattr(q, "_backtest_no_kline") and q._backtest_no_kline) for q in self]):
             return self
-        all_quotes = self + [_get_obj(self._api._data, ["quotes", s], self._api._prototype["quotes"]["#"]) for s in underlying_symbols]
+        all_quotes = self + [_get_obj(self._api._data, ["quotes", s], self._api._prototype["quotes"]["#"]) for s in set(underlying_symbols.values())]
         async with self._api.register_update_notify(self) as update_chan:
             async for _ in update_chan:
                 if all([q.datetime != "" or (hasattr(q, "_backtest_no_kline") and q._backtest_no_kline) for q in all_quotes]):
@@ -78,6 +76,104 @@ class QuoteList(list):
         return self._task.__await__()
 
 
+def _is_quote_ready(quote):
+    """quote 是否已经收到了合约信息及行情"""
+    return quote.price_tick > 0 and (quote.datetime != "" or (hasattr(quote, "_backtest_no_kline") and quote._backtest_no_kline))
+
+
+class QuoteStream(list):
+    """
+    get_quote_list 的流式版本，创建后立即返回，不等待合约信息及行情
+
+    * 列表中的 Quote 对象在收到数据之前各项内容为 NaN 或 0，收到数据后随 wait_update 更新
+    * 缺少合约信息的合约按照每个请求 2000 个合约批量查询，所有合约的行情合并为一个订阅请求，期权在收到合约信息后订阅标的合约行情
+    * self.ready 为已经收到合约信息及行情的 Quote 对象，按照就绪的先后排列，可以通过 async for 遍历 self.ready_quotes() 依次处理就绪的合约
+    * await 该对象时，所有合约都就绪后返回
+    """
+
+    def __init__(self, api, quotes):
+        self._api = api
+        list.__init__(self, quotes)
+        self._pending = {q._path[-1]: q for q in quotes}  # 还没有就绪的合约
+        self._ready: List[Quote] = []  # 已经就绪的合约
+        self._underlying_subscribed = set()  # 已经订阅了标的合约的期权
+        self._ready_chans: List[TqChan] = []  # 有新的合约就绪时通知 ready_quotes 迭代器
+        self._task = api.create_task(self._run(), _caller_api=True)
+
+    @property
+    def ready(self) -> List[Quote]:
+        """已经收到合约信息及行情的 Quote 对象"""
+        return self._ready
+
+    async def ready_quotes(self) -> AsyncIterator[Quote]:
+        """按照就绪的先后依次返回 Quote 对象，所有合约都返回后结束"""
+        chan = TqChan(self._api, last_only=True)
+        self._ready_chans.append(chan)
+        try:
+            i = 0
+            while True:
+                while i < len(self._ready):
+                    i += 1
+                    yield self._ready[i - 1]
+                if self._task.done():
+                    self._task.result()  # 请求出错时抛出异常
+                    if i == len(self._ready):
+                        return
+                else:
+                    await chan.recv()
+        finally:
+            self._ready_chans.remove(chan)
+            await chan.close()
+
+    async def _run(self):
+        try:
+            symbols = list(self._pending)
+            self._api._auth._has_md_grants(symbols)  # 权限检查
+            query_symbols = [s for s in symbols if not self._pending[s].price_tick > 0]
+            if query_symbols:
+                unknown_symbols = [s for s in query_symbols if s not in self._api._pre20_ins_info]
+                if self._api._stock is False and unknown_symbols:
+                    raise Exception("代码 %s 不存在, 请检查合约代码是否填写正确" % unknown_symbols)
+                for query_pack in _query_for_quote(query_symbols, self._api._pre20_ins_info.keys()):
+                    self._api._send_pack(query_pack)
+            self._api._subscribe_quote(symbols)
+            self._check_quotes(symbols)
+            if not self._pending:
+                return self
+            async with self._api.register_update_notify() as update_chan:
+                async for _ in update_chan:
+                    # 只检查本次有更新的合约，不需要每次更新都遍历所有未就绪的合约
+                    self._check_quotes([path[1] for path in self._api._diff_paths
+                                        if len(path) == 2 and path[0] == "quotes" and path[1] in self._pending])
+                    if not self._pending:
+                        return self
+        finally:
+            self._notify_ready()
+
+    def _check_quotes(self, symbols):
+        ready_count = len(self._ready)
+        for symbol in symbols:
+            quote = self._pending.get(symbol)
+            if quote is None:
+                continue
+            if quote.underlying_symbol and symbol not in self._underlying_subscribed:
+                # 每个期权订阅一次标的合约，退订期权时一并退订
+                self._underlying_subscribed.add(symbol)
+                self._api._subscribe_underlying(symbol, quote.underlying_symbol)
+            if _is_quote_ready(quote):
+                del self._pending[symbol]
+                self._ready.append(quote)
+        if len(self._ready) > ready_count:
+            self._notify_ready()
+
+    def _notify_ready(self):
+        for chan in self._ready_chans:
+            chan.send_nowait(True)
+
+    def __await__(self):
+        return self._task.__await__()
+
+
 async def _query_graphql_async(api, query_id, query):
     api._send_pack({
         "aid": "ins_query",
@@ -563,16 +659,11 @@ class TqOptionGreeksDataFrame(DataFrame):
         series_datetime = Series(data=[_str_to_timestamp_nano(q.datetime) for q in quotes])
         series_expire_datetime = Series(data=[q.expire_datetime for q in quotes])
         series_t = _get_t_series(series_datetime, 0, series_expire_datetime)  # 到期时间
-        if self.__dict__["_v_list"] is None:
-            series_v = get_impv(series_close1, series_close, self["strike_price"], self.__dict__["_r"], 0.3, series_t, series_o)
-        else:
-            series_v = Series(data=self.__dict__["_v_list"])
-        series_d1 = _get_d1(series_close1, self["strike_price"], self.__dict__["_r"], series_v, series_t)
-        self["delta"] = get_delta(series_close1, self["strike_price"], self.__dict__["_r"], series_v, series_t, series_o, series_d1)
-        self["theta"] = get_theta(series_close1, self["strike_price"], self.__dict__["_r"], series_v, series_t, series_o, series_d1)
-        self["gamma"] = get_gamma(series_close1, self["strike_price"], self.__dict__["_r"], series_v, series_t, series_d1)
-        self["vega"] = get_vega(series_close1, self["strike_price"], self.__dict__["_r"], series_v, series_t, series_d1)
-        self["rho"] = get_rho(series_close1, self["strike_price"], self.__dict__["_r"], series_v, series_t, series_o, series_d1)
+        # 所有期权的隐含波动率及希腊指标一次计算
+        greeks = get_option_chain_greeks(series_close1, series_close, self["strike_price"], self.__dict__["_r"], series_t,
+                                         series_o, v=self.__dict__["_v_list"])
+        for col in ["delta", "theta", "gamma", "vega", "rho"]:
+            self[col] = greeks[col]
 
     def __await__(self):
         return self.__dict__["_task"].__await__()
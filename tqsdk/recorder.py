@@ -0,0 +1,178 @@
+#!usr/bin/env python3
+# -*- coding:utf-8 -*-
+__author__ = 'mayanqiong'
+
+"""
+websocket 数据包的录制及回放
+
+录制：设置环境变量 TQ_RECORD_FILE=/path/to/file.tqrec.gz，所有 TqConnect (md / td_0 / ts ...) 收发的原始数据包会带上时间戳写入 gzip 压缩的文件中，
+每行一个 json: {"t": 收发时间, "conn_id": 连接 id, "dir": "recv" / "send", "aid": 数据包的 aid, "msg": 原始数据包}，登录包中的密码不会被记录。
+aid 由 TqConnect 从已经解析的数据包中取得，回放时不需要再次解析原始数据包。
+数据包在后台线程中批量压缩写入，不会阻塞 EventLoop 所在的线程。
+连接 id 在多次运行之间保持不变：行情为 md，交易为 td_<账户在账户列表中的序号>，交易状态为 ts，所以录制及回放时账户列表的顺序需要一致。
+
+回放：将行情 / 交易服务器地址设置为 tqrec://<录制文件的绝对路径>?speed=N，TqConnect 不再连接服务器，而是按照录制时的时间间隔回放该连接收到的数据包，
+整个模块链路 (MdReconnectHandler -> TqSymbols -> TqTradingStatus -> TqSim -> DataExtension -> TqApi) 与连接真实服务器时完全一致。
+* speed: 回放速度，1 为按录制时的速度回放，N 为 N 倍速，0 为不等待 (默认)
+* conn_id: 回放哪个连接的数据包，默认与当前 TqConnect 的 conn_id 相同
+
+与服务器的行为一致，每个 rtn_data 包都要等到收到客户端的 peek_message 之后才会发出，所以回放的结果是确定的。
+回放完所有数据包后连接保持打开，不会再收到数据。
+
+Example::
+
+    # 录制 (在 shell 中设置环境变量 TQ_RECORD_FILE=/tmp/md.tqrec.gz 后运行策略)
+
+    # 回放
+    from tqsdk import TqApi, TqAuth
+    api = TqApi(auth=TqAuth("快期账户", "账户密码"), _md_url="tqrec:///tmp/md.tqrec.gz?speed=0")
+"""
+
+import asyncio
+import atexit
+import gzip
+import json
+import os
+import queue
+import threading
+import time
+from typing import Dict, Iterator, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+RECORD_FILE_ENV = "TQ_RECORD_FILE"
+REPLAY_SCHEME = "tqrec"
+
+_recorders: Dict[str, "PacketRecorder"] = {}  # 同一个进程中录制到同一个文件的所有连接共用一个 PacketRecorder
+
+
+class PacketRecorder(object):
+    """
+    将数据包写入 gzip 压缩的录制文件
+
+    write 只记录收发时间并把数据包放入队列，序列化、压缩及写入文件都在后台线程中完成；
+    回放需要完整的数据，所以队列不限制长度，不会丢弃数据包
+    """
+
+    BATCH_SIZE = 1000  # 每次最多批量写入的数据包个数
+    FLUSH_INTERVAL = 0.2  # 队列为空时后台线程检查的间隔 (秒)
+
+    _CLOSE = object()  # 通知后台线程退出
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._file = gzip.open(path, "at", encoding="utf-8")
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._write_loop, name="TqRecorder", daemon=True)
+        self._thread.start()
+
+    def write(self, conn_id: str, direction: str, aid: Optional[str], msg: str) -> None:
+        if self._file is None:
+            return
+        self._queue.put_nowait((time.time(), conn_id, direction, aid, msg))
+
+    def _write_loop(self) -> None:
+        closed = False
+        while not closed:
+            try:
+                batch = [self._queue.get(timeout=PacketRecorder.FLUSH_INTERVAL)]
+            except queue.Empty:
+                continue
+            try:
+                while len(batch) < PacketRecorder.BATCH_SIZE:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            lines = []
+            for item in batch:
+                if item is PacketRecorder._CLOSE:
+                    closed = True
+                    continue
+                t, conn_id, direction, aid, msg = item
+                if isinstance(msg, bytes):
+                    msg = msg.decode("utf-8")
+                lines.append(json.dumps({"t": t, "conn_id": conn_id, "dir": direction, "aid": aid, "msg": msg}, ensure_ascii=False))
+            if lines:
+                self._file.write("\n".join(lines) + "\n")
+                self._file.flush()
+        self._file.close()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._queue.put(PacketRecorder._CLOSE)
+            self._thread.join()
+            self._file = None
+
+
+def _get_recorder(path: Optional[str] = None) -> Optional[PacketRecorder]:
+    """返回录制到 path (默认为环境变量 TQ_RECORD_FILE) 的 PacketRecorder，没有指定时返回 None"""
+    path = path if path else os.getenv(RECORD_FILE_ENV)
+    if not path:
+        return None
+    path = os.path.abspath(path)
+    if path not in _recorders:
+        _recorders[path] = PacketRecorder(path)
+        atexit.register(_recorders[path].close)
+    return _recorders[path]
+
+
+def _read_packets(path: str, conn_id: str, direction: str = "recv") -> Iterator[Tuple[float, Optional[str], str]]:
+    """按顺序读取录制文件中指定连接的数据包，返回 (时间, aid, 原始数据包)"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:  # 录制进程异常退出时最后一行可能不完整
+                break
+            if record["conn_id"] == conn_id and record["dir"] == direction:
+                yield record["t"], record.get("aid"), record["msg"]
+
+
+# TqConnect 发出的 peek_message 包的开头，aid 总是第一个字段，json 模块及 orjson / ujson 的区别只在于冒号后是否有空格
+_PEEK_MESSAGE_PREFIXES = ('{"aid": "peek_message"', '{"aid":"peek_message"')
+
+
+class ReplayConnection(object):
+    """
+    回放录制文件的连接，提供 TqConnect 用到的 websocket 连接接口 (async with / async for / send)
+    """
+
+    def __init__(self, path: str, conn_id: str, speed: float = 0) -> None:
+        if not os.path.exists(path):
+            raise Exception(f"录制文件 {path} 不存在")
+        self._path = path
+        self._conn_id = conn_id
+        self._speed = speed
+        self._peek_event = asyncio.Event()
+
+    @staticmethod
+    def from_url(url: str, conn_id: str) -> "ReplayConnection":
+        """根据 tqrec://<path>?speed=N&conn_id=xx 格式的地址创建回放连接"""
+        url_info = urlparse(url)
+        query = parse_qs(url_info.query)
+        speed = float(query["speed"][0]) if "speed" in query else 0
+        conn_id = query["conn_id"][0] if "conn_id" in query else conn_id
+        return ReplayConnection(url_info.netloc + url_info.path, conn_id, speed)
+
+    async def __aenter__(self) -> "ReplayConnection":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        pass
+
+    async def send(self, msg) -> None:
+        if msg.startswith(_PEEK_MESSAGE_PREFIXES):
+            self._peek_event.set()
+
+    async def __aiter__(self):
+        start_time, first_t = time.time(), None
+        for t, aid, msg in _read_packets(self._path, self._conn_id):
+            if self._speed > 0:
+                first_t = t if first_t is None else first_t
+                delay = start_time + (t - first_t) / self._speed - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            if aid == "rtn_data":
+                await self._peek_event.wait()
+                self._peek_event.clear()
+            yield msg
+        await asyncio.Event().wait()  # 回放结束后连接保持打开
@@ -3,6 +3,7 @@
 import math
 from tqsdk.entity import Entity
 from tqsdk.diff import _simple_merge_diff, _get_obj
+from tqsdk.subscribe import QuoteSubscribeManager
 
 
 class TqStockProfit():
@@ -18,7 +19,8 @@ class TqStockProfit():
         self._data = Entity()  # 业务信息截面
         self._data._instance_entity([])
         self._diffs = []
-        self._all_subscribe = set()
+        self._quote_subscribe = QuoteSubscribeManager()  # 下游+持仓股票订阅的合约
+        self._position_symbols = set()  # 已订阅行情的持仓股票
 
 
     async def _run(self, api_send_chan, api_recv_chan, md_send_chan, md_recv_chan):
@@ -34,11 +36,14 @@ class TqStockProfit():
             async for pack in api_send_chan:
                 if "_md_recv" in pack:
                     await self._md_recv(pack)
+                    await self._send_subscribe_quote()  # 处理这个数据包时新增的持仓股票合并为一个订阅请求
                     await self._send_diff()
                     if not self._is_diff_complete():
                         await self._md_send_chan.send({"aid": "peek_message"})
                 elif pack["aid"] == "subscribe_quote":
-                    await self._subscribe_quote(set(pack["ins_list"].split(",")))
+                    # 下游发来的是全量订阅列表，下游退订的合约如果不是持仓股票，也会向上游退订
+                    self._quote_subscribe.set_source("downstream", pack["ins_list"].split(","))
+                    await self._send_subscribe_quote()
                 elif pack["aid"] == "peek_message":
                     self._pending_peek = True
                     await self._send_diff()
@@ -87,7 +92,7 @@ class TqStockProfit():
             if self._data['trade'].get(account_key, {}).get("account_type", "FUTURE") == "FUTURE":
                 continue
             for symbol, _ in self._data['trade'][account_key].get('positions', {}).items():
-                await self._subscribe_quote(symbol)
+                self._subscribe_quote(symbol)
                 last_price = self._data["quotes"].get(symbol, {}).get('last_price', float("nan"))
                 if not math.isnan(last_price):
                     diff = self._update_position(account_key, symbol, last_price)
@@ -115,15 +120,18 @@ class TqStockProfit():
             self._pending_peek = False
             await self._api_recv_chan.send(rtn_data)
 
-    async def _subscribe_quote(self, symbols: [set, str]):
-        """这里只会增加订阅合约，不会退订合约"""
+    def _subscribe_quote(self, symbols: [set, str]):
+        """订阅持仓股票的行情，不会退订，订阅变更在 _send_subscribe_quote 时合并发出"""
         symbols = symbols if isinstance(symbols, set) else {symbols}
-        if symbols - self._all_subscribe:
-            self._all_subscribe |= symbols
-            await self._md_send_chan.send({
-                "aid": "subscribe_quote",
-                "ins_list": ",".join(self._all_subscribe)
-            })
+        new_symbols = symbols - self._position_symbols
+        if new_symbols:
+            self._position_symbols |= new_symbols
+            self._quote_subscribe.add(new_symbols)
+
+    async def _send_subscribe_quote(self):
+        pack = self._quote_subscribe.make_pack()
+        if pack:
+            await self._md_send_chan.send(pack)
 
 
     def _update_position(self, key, symbol, last_price):
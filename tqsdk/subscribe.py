@@ -0,0 +1,96 @@
+#!usr/bin/env python3
+# -*- coding:utf-8 -*-
+__author__ = 'mayanqiong'
+
+"""
+合约行情订阅管理
+
+subscribe_quote 协议中 ins_list 是全量的订阅列表，服务器以最后一次收到的 ins_list 为准，所以每次发出的包中都需要包含全部合约。
+QuoteSubscribeManager 用于减少发出的 subscribe_quote 包:
+* 订阅及退订只修改引用计数并标记有变更，调用方在合适的时机 (TqApi 为当前 EventLoop 迭代结束后，TqSim 等模块为下游的 peek_message 到达时)
+  调用 make_pack 生成一个包含全部合约的 subscribe_quote 包，多次订阅变更只发出一个包
+* 每个合约记录被订阅的次数，退订次数与订阅次数相同时才会从订阅列表中移除该合约
+* 下游发来的 subscribe_quote 包是下游的全量订阅列表，通过 set_source 与该来源上一次的列表比较后增加或减少引用计数
+"""
+
+from typing import Dict, Hashable, Iterable, Optional, Set
+
+
+class QuoteSubscribeManager(object):
+    """记录每个合约的订阅次数，合并订阅变更生成 subscribe_quote 包"""
+
+    def __init__(self) -> None:
+        self._refs: Dict[str, int] = {}  # {合约: 订阅次数}，按照首次订阅的顺序排列
+        self._sources: Dict[Hashable, Set[str]] = {}  # {来源: 该来源的全量订阅列表}
+        self._sent: Set[str] = set()  # 最近一次发出的订阅列表
+        self._changed = False  # 自上次 make_pack 之后订阅列表是否有变化
+        self._packs = 0  # 发出的 subscribe_quote 包的个数
+        self._sent_symbols = 0  # 发出的 subscribe_quote 包中合约的总个数
+
+    @property
+    def symbols(self):
+        """当前订阅的全部合约"""
+        return self._refs.keys()
+
+    @property
+    def changed(self) -> bool:
+        """订阅列表是否有还没有发出的变更"""
+        return self._changed
+
+    def add(self, symbols: Iterable[str]) -> bool:
+        """每个合约的订阅次数加 1，返回订阅列表是否增加了合约"""
+        added = False
+        for symbol in symbols:
+            if not symbol:
+                continue
+            count = self._refs.get(symbol, 0)
+            if count == 0:
+                added = True
+            self._refs[symbol] = count + 1
+        self._changed |= added
+        return added
+
+    def remove(self, symbols: Iterable[str]) -> bool:
+        """每个合约的订阅次数减 1，返回订阅列表是否减少了合约，没有订阅过的合约会被忽略"""
+        removed = False
+        for symbol in symbols:
+            count = self._refs.get(symbol, 0)
+            if count == 1:
+                del self._refs[symbol]
+                removed = True
+            elif count > 1:
+                self._refs[symbol] = count - 1
+        self._changed |= removed
+        return removed
+
+    def set_source(self, source: Hashable, symbols: Iterable[str]) -> bool:
+        """设置来源 source 的全量订阅列表，返回订阅列表是否有变化"""
+        symbols = dict.fromkeys(s for s in symbols if s)  # 去重并保持顺序
+        last = self._sources.get(source, set())
+        self._sources[source] = set(symbols)
+        added = self.add([s for s in symbols if s not in last])
+        removed = self.remove(last - self._sources[source])
+        return added or removed
+
+    def make_pack(self) -> Optional[dict]:
+        """订阅列表与上次发出的不同时，返回包含全部合约的 subscribe_quote 包，否则返回 None"""
+        if not self._changed:
+            return None
+        self._changed = False
+        if self._sent == self._refs.keys():  # 订阅后又退订了相同的合约
+            return None
+        self._sent = set(self._refs)
+        self._packs += 1
+        self._sent_symbols += len(self._refs)
+        return {
+            "aid": "subscribe_quote",
+            "ins_list": ",".join(self._refs)
+        }
+
+    def get_stats(self) -> Dict[str, int]:
+        """返回订阅的合约个数、发出的 subscribe_quote 包的个数及包中合约的总个数"""
+        return {
+            "symbols": len(self._refs),
+            "packs": self._packs,
+            "sent_symbols": self._sent_symbols,
+        }
@@ -3,7 +3,9 @@
 __author__ = 'mayanqiong'
 
 import asyncio
+import copy
 
+from tqsdk.channel import TqPipeChan
 from tqsdk.objs import Quote
 
 
@@ -14,59 +16,139 @@ class TqSymbols(object):
 
     async def _run(self, api, sim_send_chan, sim_recv_chan, md_send_chan, md_recv_chan):
         """回测task"""
-        self._api = api
+        self._setup(api, md_send_chan)
         self._sim_send_chan = sim_send_chan
         self._sim_recv_chan = sim_recv_chan
-        self._md_send_chan = md_send_chan
         self._md_recv_chan = md_recv_chan
-        self._etf_options = set()
-        self._quotes_all_keys = set(Quote(None).keys())
-        self._quotes_all_keys = self._quotes_all_keys.union({'margin', 'commission'})
-        # 以下字段合约服务也会请求，但是不应该记在 quotes 中，quotes 中的这些字段应该有行情服务负责
-        self._quotes_all_keys.difference_update({'pre_open_interest', 'pre_close', 'upper_limit', 'lower_limit'})
         sim_task = self._api.create_task(self._sim_handler())
         try:
             async for pack in self._md_recv_chan:
-                if pack.get("aid") == "rtn_data":
-                    data = pack.setdefault("data", [])
-                    # 对于收到的数据，全部转发给下游
-                    # 对于合约服务信息，query_id 为 PYSDK_quote_xxx 开头的，一定是请求了合约的全部合约信息，需要转为 quotes 转发给下游
-                    updated_quotes = {}  # 合约服务内容转为的 quotes 对象
-                    # 分两次循环，第一次循环找到所有的 SSE 期权，第二次循环将从行情收到的 SSE 期权的 pre_settlement 删掉
-                    # 最终将 updated_quotes 发送给下游
-                    for d in data:
-                        for query_id, query_result in d.get("symbols", {}).items():
-                            if query_result:
-                                if query_result.get("error", None):
-                                    try:
-                                        for ins in query_result['variables']['instrument_id']:
-                                            updated_quotes[ins] = self._api._pre20_ins_info[ins]
-                                    except KeyError:
-                                        raise Exception(f"查询合约服务报错 {query_result['error']}") from None
-                                elif query_id.startswith("PYSDK_quote"):
-                                    quotes = self._api._symbols_to_quotes(query_result, self._quotes_all_keys)
-                                    for quote in quotes.values():
-                                        if quote["ins_class"] == "OPTION" and quote["exchange_id"] in ["SSE", "SZSE"]:
-                                            self._etf_options.add(quote["instrument_id"])
-                                        else:
-                                            # quotes 中的 pre_settlement 字段应该由行情服务负责，行情没有上交所期权的 pre_settlement，需要从合约服务取，其他合约不变
-                                            quote.pop("pre_settlement", None)
-                                    updated_quotes.update(quotes)
-                                    self._md_send_chan.send_nowait({
-                                        "aid": "ins_query",
-                                        "query_id": query_id,
-                                        "query": ""
-                                    })
-                    for d in data:
-                        for symbol, quote in d.get("quotes", {}).items():
-                            if symbol in self._etf_options:
-                                quote.pop("pre_settlement", None)
-                    data.append({"quotes": updated_quotes})
-                await self._sim_recv_chan.send(pack)
+                pack = self._handle_md_pack(pack)
+                if pack is not None:
+                    await self._sim_recv_chan.send(pack)
         finally:
             await self._api._cancel_task(sim_task)
 
+    def _setup(self, api, md_send_chan):
+        self._api = api
+        self._md_send_chan = md_send_chan
+        self._etf_options = set()
+        self._quotes_all_keys = set(Quote(None).keys())
+        self._quotes_all_keys = self._quotes_all_keys.union({'margin', 'commission'})
+        # 以下字段合约服务也会请求，但是不应该记在 quotes 中，quotes 中的这些字段应该有行情服务负责
+        self._quotes_all_keys.difference_update({'pre_open_interest', 'pre_close', 'upper_limit', 'lower_limit'})
+        # 旧版合约服务 (api._stock is False) 的合约信息由本模块从 api._pre20_ins_info 中返回，为了不破坏下游依赖的 peek_message 流控，
+        # 此时发给下游的 rtn_data 都要等到下游的 peek_message，合约信息与上游的数据合并在同一个 rtn_data 中发出
+        self._peek_gate = api._stock is False
+        self._peeking = False  # 下游发出了 peek_message，还没有发给下游 rtn_data
+        self._upstream_peeking = False  # 向上游发出了 peek_message，还没有收到上游的 rtn_data
+        self._pending_data = []  # 等待下游 peek_message 的数据
+
+    def _pipe(self, api, sim_recv_chan, md_send_chan):
+        """
+        同步模式，不创建 task，返回上游应该发送数据的 channel，收到的数据包处理后直接发到 sim_recv_chan；
+        下游发送的数据包应该发到 _pipe_sim_send 返回的 channel
+        """
+        self._setup(api, md_send_chan)
+        self._sim_recv_chan = sim_recv_chan
+
+        def handler(pack):
+            pack = self._handle_md_pack(pack)
+            if pack is not None:
+                sim_recv_chan.send_nowait(pack)
+        return TqPipeChan(api, handler, chan_name="pipe to tq_symbols")
+
+    def _pipe_sim_send(self):
+        """同步模式，返回下游应该发送数据的 channel，数据包处理后直接发到 md_send_chan，需要先调用 _pipe"""
+        def handler(pack):
+            if not self._handle_sim_pack(pack):
+                self._md_send_chan.send_nowait(pack)
+        return TqPipeChan(self._api, handler, chan_name="pipe from tq_symbols")
+
+    def _handle_sim_pack(self, pack):
+        """
+        处理下游发来的数据包，返回该数据包是否已经处理，没有处理的数据包应该转发到上游
+
+        旧版合约服务 (api._stock is False) 的全部合约信息在 api._pre20_ins_info 中，_query_for_quote 对这些合约逐个发出查询请求，
+        这些请求不需要发到上游，合约信息在下游的下一个 peek_message 到达时发出；
+        下游的 peek_message 在向上游发出的 peek_message 还没有收到回复时不再重复发出
+        """
+        if not self._peek_gate:
+            return False
+        if pack.get("aid") == "peek_message":
+            self._peeking = True
+            if not self._upstream_peeking:
+                self._upstream_peeking = True
+                self._md_send_chan.send_nowait(pack)
+            self._send_pending()
+            return True
+        if pack.get("aid") == "ins_query":
+            symbols = pack.get("variables", {}).get("instrument_id", [])
+            if symbols and all(s in self._api._pre20_ins_info for s in symbols):
+                self._pending_data.append({"quotes": {s: copy.deepcopy(self._api._pre20_ins_info[s]) for s in symbols}})
+                self._send_pending()
+                return True
+        return False
+
+    def _pop_pending(self):
+        """下游在等待数据且有等待发出的数据时，返回包含这些数据的 rtn_data，否则返回 None"""
+        if not self._peeking or not self._pending_data:
+            return None
+        pack = {"aid": "rtn_data", "data": self._pending_data}
+        self._pending_data = []
+        self._peeking = False
+        return pack
+
+    def _send_pending(self):
+        pack = self._pop_pending()
+        if pack is not None:
+            self._sim_recv_chan.send_nowait(pack)
+
+    def _handle_md_pack(self, pack):
+        """处理从上游收到的数据包，合约服务的查询结果转为 quotes 添加在 pack 中，返回应该发给下游的数据包，没有时返回 None"""
+        if pack.get("aid") == "rtn_data":
+            data = pack.setdefault("data", [])
+            # 对于收到的数据，全部转发给下游
+            # 对于合约服务信息，query_id 为 PYSDK_quote_xxx 开头的，一定是请求了合约的全部合约信息，需要转为 quotes 转发给下游
+            updated_quotes = {}  # 合约服务内容转为的 quotes 对象
+            # 分两次循环，第一次循环找到所有的 SSE 期权，第二次循环将从行情收到的 SSE 期权的 pre_settlement 删掉
+            # 最终将 updated_quotes 发送给下游
+            for d in data:
+                for query_id, query_result in d.get("symbols", {}).items():
+                    if query_result:
+                        if query_result.get("error", None):
+                            try:
+                                for ins in query_result['variables']['instrument_id']:
+                                    updated_quotes[ins] = self._api._pre20_ins_info[ins]
+                            except KeyError:
+                                raise Exception(f"查询合约服务报错 {query_result['error']}") from None
+                        elif query_id.startswith("PYSDK_quote"):
+                            quotes = self._api._symbols_to_quotes(query_result, self._quotes_all_keys)
+                            for quote in quotes.values():
+                                if quote["ins_class"] == "OPTION" and quote["exchange_id"] in ["SSE", "SZSE"]:
+                                    self._etf_options.add(quote["instrument_id"])
+                                else:
+                                    # quotes 中的 pre_settlement 字段应该由行情服务负责，行情没有上交所期权的 pre_settlement，需要从合约服务取，其他合约不变
+                                    quote.pop("pre_settlement", None)
+                            updated_quotes.update(quotes)
+                            self._md_send_chan.send_nowait({
+                                "aid": "ins_query",
+                                "query_id": query_id,
+                                "query": ""
+                            })
+            for d in data:
+                for symbol, quote in d.get("quotes", {}).items():
+                    if symbol in self._etf_options:
+                        quote.pop("pre_settlement", None)
+            data.append({"quotes": updated_quotes})
+            if self._peek_gate:
+                self._upstream_peeking = False
+                self._pending_data.extend(data)
+                return self._pop_pending()
+        return pack
+
     async def _sim_handler(self):
-        # 下游发来的数据包，直接转发到上游
+        # 下游发来的数据包，没有处理的转发到上游
         async for pack in self._sim_send_chan:
-            await self._md_send_chan.send(pack)
+            if not self._handle_sim_pack(pack):
+                await self._md_send_chan.send(pack)
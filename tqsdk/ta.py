@@ -2765,17 +2765,26 @@ def VOLATILITY_CURVE(df: pd.DataFrame, quotes: dict, underlying: str, r=0.025):
     res_dict = {} # 波动率曲线数据结构 {'datetime':[], $strike_price:[]}
     pd_columns = [] # pd.DataFrame 列
 
+    # 所有行权价的期权按列排列 (每列一个期权，每行一根K线)，一次计算全部隐含波动率
+    close_titles, strike_prices, option_classes, ts = [], [], [], []
     for symbol_title in symbol_titles:
         if symbol_title == base_symbol_title[0]:
             continue
-        close_title = f'close{symbol_title[6:]}'
         quote = quotes[df[symbol_title].iloc[0]]
-        t = tqsdk.tafunc._get_t_series(df["datetime"], df["duration"], quote.expire_datetime)
-        res_dict[quote.strike_price] = tqsdk.tafunc.get_impv(df[base_close_title],
-                                                             df[close_title], quote.strike_price, r, 0.5, t,
-                                                             quote.option_class).interpolate(method='linear')
+        close_titles.append(f'close{symbol_title[6:]}')
+        strike_prices.append(quote.strike_price)
+        option_classes.append(tqsdk.tafunc._get_options_class_array(quote.option_class, 1))
+        ts.append(tqsdk.tafunc._get_t_series(df["datetime"], df["duration"], quote.expire_datetime).values)
+    if close_titles:
+        shape = (len(df), len(close_titles))
+        s, p, k, r_, init_v, t, o = [np.broadcast_to(np.asarray(a, dtype=np.float64), shape) for a in [
+            df[base_close_title].values[:, None], df[close_titles].values, strike_prices, r, 0.5,
+            np.stack(ts, axis=1), np.ravel(option_classes)]]
+        impv = tqsdk.tafunc._get_impv_array(s, p, k, r_, init_v, t, o).reshape(shape)
+        for i, strike_price in enumerate(strike_prices):
+            res_dict[strike_price] = pd.Series(impv[:, i]).interpolate(method='linear')
+            pd_columns.append(strike_price)
         res_dict['datetime'] = df["datetime"]
-        pd_columns.append(quote.strike_price)
     pd_columns.sort()
     pd_columns.insert(0, "datetime")
     return pd.DataFrame(data=res_dict, columns=pd_columns)
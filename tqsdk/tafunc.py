@@ -11,11 +11,11 @@ tqsdk.tafunc 模块包含了一批用于技术指标计算的函数
 
 import datetime
 import math
-from typing import Union
+from typing import Dict, Union
 
 import numpy as np
 import pandas as pd
-from scipy import stats
+from scipy import special, stats
 
 from tqsdk.datetime import _get_period_timestamp, _str_to_timestamp_nano, _datetime_to_timestamp_nano, \
     _timestamp_nano_to_datetime, _timestamp_nano_to_str
@@ -1293,6 +1293,71 @@ def get_rho(series, k, r, v, t, option_class, d1=None):
     return pd.Series(np.where(np.isnan(d1), np.nan, o * k * t * np.exp(-r * t) * _get_cdf(o * d2)))
 
 
+def _get_options_class_array(option_class, size: int):
+    """与 _get_options_class 相同，返回 1 / -1 / nan 组成的 numpy 数组 (option_class 为 str 时返回标量)"""
+    if isinstance(option_class, str):
+        return 1.0 if option_class == "CALL" else -1.0 if option_class == "PUT" else np.nan
+    option_class = np.asarray(option_class)
+    if option_class.size != size:
+        return np.full(size, np.nan)
+    return np.where(option_class == "CALL", 1.0, np.where(option_class == "PUT", -1.0, np.nan))
+
+
+def _get_d1_array(s, k, r, v, t):
+    """与 _get_d1 相同，参数为 numpy 数组"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where((v <= 0) | (t <= 0), np.nan, (np.log(s / k) + (r + 0.5 * v * v) * t) / (v * np.sqrt(t)))
+
+
+def _get_pdf_array(x):
+    return np.exp(-0.5 * x * x) / math.sqrt(2 * math.pi)
+
+
+def _get_greeks_array(s, k, r, v, t, o) -> Dict[str, np.ndarray]:
+    """计算 BS 模型理论价及各个希腊指标，参数为 numpy 数组，结果与 get_bs_price、get_delta 等函数一致"""
+    d1 = _get_d1_array(s, k, r, v, t)
+    sqrt_t = np.sqrt(np.where(t > 0, t, np.nan))
+    d2 = d1 - v * sqrt_t
+    discount = k * np.exp(-r * t)
+    pdf_d1 = _get_pdf_array(d1)
+    cdf_o_d2 = special.ndtr(o * d2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {
+            "price": o * (s * special.ndtr(o * d1) - discount * cdf_o_d2),
+            "delta": o * special.ndtr(o * d1),
+            "gamma": pdf_d1 / (s * v * sqrt_t),
+            "theta": -v * s * pdf_d1 / (2 * sqrt_t) - o * r * discount * cdf_o_d2,
+            "vega": s * sqrt_t * pdf_d1,
+            "rho": o * k * t * np.exp(-r * t) * cdf_o_d2,
+        }
+
+
+def _get_impv_array(s, p, k, r, init_v, t, o, max_iterations: int = 100):
+    """
+    计算隐含波动率，参数为形状相同的 numpy 数组，迭代方法及结果与 get_impv 一致
+
+    每次迭代只计算尚未收敛的元素，价格误差小于 1e-8 或者 vega 过小 (无法继续迭代) 的元素不再参与计算
+    最多迭代 max_iterations 次，避免个别元素无法收敛时陷入死循环
+    """
+    s, p, k, r, init_v, t, o = [a.ravel() for a in (s, p, k, r, init_v, t, o)]
+    with np.errstate(invalid="ignore"):
+        x = np.where((p < o * (s - k * np.exp(-r * t))) | (t <= 0), np.nan, init_v)
+    active = np.flatnonzero(~np.isnan(x))  # 尚未收敛的元素
+    for _ in range(max_iterations):
+        if active.size == 0:
+            break
+        xa, sa, pa, ka, ra, ta, oa = x[active], s[active], p[active], k[active], r[active], t[active], o[active]
+        greeks = _get_greeks_array(sa, ka, ra, xa, ta, oa)
+        y, vega = greeks["price"], greeks["vega"]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            diff_x = np.where(np.isnan(vega) | (vega < 1e-8), np.nan, (pa - y) / vega)
+            done = (np.abs(pa - y) < 1e-8) | np.isnan(diff_x)
+        xa, diff_x = xa[~done], diff_x[~done]
+        active = active[~done]
+        x[active] = np.where(xa + diff_x < 0, xa / 2, np.where(diff_x > xa / 2, xa * 1.5, xa + diff_x))
+    return x
+
+
 def get_impv(series, series_option, k, r, init_v, t, option_class):
     """
     计算期权隐含波动率
@@ -1345,20 +1410,70 @@ def get_impv(series, series_option, k, r, init_v, t, option_class):
         print("impv", list((impv * 100).round(2)))
         api.close()
     """
-    o = _get_options_class(series, option_class=option_class)
-    lower_limit = o * (series - k * np.exp(-r * t))
-    x = pd.Series(np.where((series_option < lower_limit) | (t <= 0), np.nan, init_v))
-    y = pd.Series(np.where(np.isnan(x), np.nan, get_bs_price(series, k, r, x, t, option_class)))
-    vega = get_vega(series, k, r, x, t)
-    diff_x = pd.Series(np.where(np.isnan(vega) | (vega < 1e-8), np.nan, (series_option - y) / vega))
-    while not pd.DataFrame.all((np.abs(series_option - y) < 1e-8) | np.isnan(diff_x)):
-        x = pd.Series(np.where(np.isnan(x) | np.isnan(diff_x), x,
-                               np.where(x + diff_x < 0, x / 2,
-                                        np.where(diff_x > x / 2, x * 1.5, x + diff_x))))
-        y = pd.Series(np.where(np.isnan(x), np.nan, get_bs_price(series, k, r, x, t, option_class)))
-        vega = get_vega(series, k, r, x, t)
-        diff_x = pd.Series(np.where(np.isnan(vega) | (vega < 1e-8), np.nan, (series_option - y) / vega))
-    return x
+    o = _get_options_class_array(option_class, len(series))
+    return pd.Series(_get_impv_array(*np.broadcast_arrays(*[np.asarray(a, dtype=np.float64) for a in
+                                                             [series, series_option, k, r, init_v, t, o]])))
+
+
+def get_option_chain_greeks(series, series_option, k, r, t, option_class, v=None, init_v=0.3):
+    """
+    批量计算期权的隐含波动率及希腊指标，可以一次计算多个到期日、多个行权价的全部期权合约
+
+    Args:
+        series (pandas.Series / numpy.ndarray / float): 每个期权合约对应的标的价格
+
+        series_option (pandas.Series / numpy.ndarray / float): 期权价格，与 series 长度应该相同
+
+        k (pandas.Series / numpy.ndarray / float): 期权行权价
+
+        r (float): 无风险利率
+
+        t (pandas.Series / numpy.ndarray / float): 年化到期时间，例如：还有 100 天到期，则年化到期时间为 100/360
+
+        option_class (str / pandas.Series / numpy.ndarray): 期权方向，"CALL" 或者 "PUT"，或者每个元素为 "CALL" 或者 "PUT" 的序列
+
+        v (pandas.Series / numpy.ndarray / float): [可选] 计算希腊指标使用的波动率，默认为 None，使用计算得到的隐含波动率
+
+        init_v (pandas.Series / numpy.ndarray / float): [可选] 计算隐含波动率的迭代初始值，默认为 0.3
+
+    Returns:
+        pandas.DataFrame: 每行对应一个期权，列为 impv (隐含波动率)、delta、gamma、theta、vega、rho
+
+    注意:
+
+        1. 所有参数都会按照 numpy 的规则广播为相同的形状，每个期权的计算结果与分别调用 get_impv、get_delta 等函数一致
+        2. 计算隐含波动率时每次迭代只计算尚未收敛的期权，不会因为少数期权收敛慢而对全部期权重复计算
+
+    Example::
+
+        from tqsdk import TqApi, TqAuth, tafunc
+        from tqsdk.tafunc import _get_t_series
+        from tqsdk.datetime import _str_to_timestamp_nano
+
+        api = TqApi(auth=TqAuth("快期账户", "账户密码"))
+        quotes = api.get_quote_list(api.query_options("SHFE.au2412"))
+        greeks = tafunc.get_option_chain_greeks(
+            [q.underlying_quote.last_price for q in quotes], [q.last_price for q in quotes],
+            [q.strike_price for q in quotes], 0.025,
+            [(q.expire_datetime - _str_to_timestamp_nano(q.datetime) / 1e9) / (360 * 86400) for q in quotes],
+            [q.option_class for q in quotes])
+        print(greeks)
+        api.close()
+    """
+    s, p, k, r, t, init_v = np.broadcast_arrays(*[np.asarray(a, dtype=np.float64) for a in
+                                                  [series, series_option, k, r, t, init_v]])
+    o = np.broadcast_to(_get_options_class_array(option_class, s.size), s.shape)
+    impv = _get_impv_array(s, p, k, r, init_v, t, o)
+    v = impv if v is None else np.broadcast_to(np.asarray(v, dtype=np.float64), s.shape)
+    greeks = _get_greeks_array(s, k, r, v, t, o)
+    return pd.DataFrame({
+        "impv": impv,
+        "delta": greeks["delta"],
+        "gamma": greeks["gamma"],
+        "theta": greeks["theta"],
+        "vega": greeks["vega"],
+        "rho": greeks["rho"],
+    }, index=series.index if isinstance(series, pd.Series) else None)
 
 
 def get_ticks_info(df):
@@ -2,4 +2,4 @@
 #  -*- coding: utf-8 -*-
 __author__ = 'chengzhi'
 
-from tqsdk.tools.downloader import DataDownloader
+from tqsdk.tools.downloader import DataDownloader, DataDownloaderBatch
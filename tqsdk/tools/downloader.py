@@ -4,15 +4,19 @@ __author__ = 'yangyang'
 
 import asyncio
 import csv
+import glob
 import os
+import time
 from datetime import date, datetime
 from encodings.utf_8 import StreamWriter
 from typing import Union, List, Optional
 import lzma
 
+import numpy as np
 import pandas
 
 from tqsdk.api import TqApi
+from tqsdk.columnar import _ensure_columnar
 from tqsdk.datetime import _cst_tz, _convert_user_input_to_nano
 from tqsdk.diff import _get_obj
 from tqsdk.utils import _generate_uuid, _get_dividend_factor
@@ -28,6 +32,89 @@ except:
 # 价格相关的字段，需要 format 数据格式
 PRICE_KEYS = ["open", "high", "low", "close", "last_price", "highest", "lowest"] + [f"bid_price{i}" for i in range(1, 6)] + [f"ask_price{i}" for i in range(1, 6)]
 
+# 列式输出时每次写入的行数，parquet 格式每块为一个 row group，npy 格式每块为一个 .npy 文件
+COLUMNAR_CHUNK_ROWS = 100000
+
+
+class _ColumnarWriter(object):
+    """
+    将下载的数据按列分块写入文件，数据列为 float64，datetime_nano 为 int64，datetime 为北京时间的 datetime64[ns]
+    * parquet: 写入 file_name 文件，每块数据为一个 row group，没有数据时写入只有表结构的空文件
+    * npy: 写入 file_name 目录，每块数据为一个结构化数组的 .npy 文件，文件名按写入顺序编号
+    """
+
+    def __init__(self, file_name: str, output_format: str, header: List[str], write_mode: str) -> None:
+        self._file_name = file_name
+        self._output_format = output_format
+        self._header = header
+        self._chunks = []  # 还没有写入文件的 (datetime_nano, values)
+        self._rows = 0  # _chunks 中的总行数
+        self._parquet_writer = None
+        self._shard = 0
+        if output_format == "npy":
+            os.makedirs(file_name, exist_ok=True)
+            shards = _ColumnarWriter._get_shards(file_name)
+            if write_mode == "w":
+                for f in shards:
+                    os.remove(f)
+            else:
+                self._shard = len(shards)
+
+    def write(self, datetime_nano: np.ndarray, values: np.ndarray) -> None:
+        """写入一段数据，datetime_nano 为 int64 数组，values 为 header 中 datetime_nano 之后各列组成的 float64 二维数组"""
+        self._chunks.append((datetime_nano, values))
+        self._rows += len(datetime_nano)
+        if self._rows >= COLUMNAR_CHUNK_ROWS:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._chunks:
+            return
+        chunks, self._chunks, self._rows = self._chunks, [], 0
+        self._write_columns(np.concatenate([c[0] for c in chunks]), np.concatenate([c[1] for c in chunks]))
+
+    def _write_columns(self, datetime_nano: np.ndarray, values: np.ndarray) -> None:
+        columns = {
+            "datetime": (datetime_nano + 8 * 3600 * 1000000000).astype("datetime64[ns]"),  # 与 csv 一致，为北京时间
+            "datetime_nano": datetime_nano,
+        }
+        for i, col in enumerate(self._header[2:]):
+            columns[col] = values[:, i]
+        if self._output_format == "parquet":
+            import pyarrow
+            import pyarrow.parquet
+            table = pyarrow.table(columns)
+            if self._parquet_writer is None:
+                self._parquet_writer = pyarrow.parquet.ParquetWriter(self._file_name, table.schema)
+            self._parquet_writer.write_table(table)
+        else:
+            array = np.empty(len(datetime_nano), dtype=[(k, v.dtype) for k, v in columns.items()])
+            for k, v in columns.items():
+                array[k] = v
+            np.save(os.path.join(self._file_name, f"{self._shard:08d}.npy"), array)
+            self._shard += 1
+
+    def close(self) -> None:
+        self.flush()
+        if self._output_format == "parquet" and self._parquet_writer is None:
+            # 没有下载到数据，与 csv 只有表头一致，写入只有表结构的空文件
+            self._write_columns(np.empty(0, dtype=np.int64), np.empty((0, len(self._header) - 2), dtype=np.float64))
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+
+    @staticmethod
+    def _get_shards(file_name: str) -> List[str]:
+        return sorted(glob.glob(os.path.join(glob.escape(file_name), "[0-9]" * 8 + ".npy")))
+
+    @staticmethod
+    def read(file_name: str, output_format: str) -> pandas.DataFrame:
+        if output_format == "parquet":
+            return pandas.read_parquet(file_name)
+        shards = _ColumnarWriter._get_shards(file_name)
+        if not shards:
+            return pandas.DataFrame()
+        return pandas.DataFrame(np.concatenate([np.load(f) for f in shards]))
+
 
 class DataDownloader:
     """
@@ -42,7 +129,7 @@ class DataDownloader:
 
     def __init__(self, api: TqApi, symbol_list: Union[str, List[str]], dur_sec: int, start_dt: Union[date, datetime],
                  end_dt: Union[date, datetime], csv_file_name: Union[str, asyncio.StreamWriter], write_mode: str = "w",
-                 adj_type: Union[str, None] = None) -> None:
+                 adj_type: Union[str, None] = None, output_format: str = "csv") -> None:
         """
         创建历史数据下载器实例
 
@@ -72,6 +159,15 @@ class DataDownloader:
 
             adj_type (str/None): 复权计算方式，默认值为 None。"F" 为前复权；"B" 为后复权；None 表示不复权。只对股票、基金合约有效。
 
+            output_format (str): 输出格式，默认值为 "csv"。
+                * "csv": 输出 csv 文件
+
+                * "parquet": 输出 parquet 文件，csv_file_name 为文件名，数据按列分块写入，每块为一个 row group。需要安装 pyarrow，不支持追加写入
+
+                * "npy": 输出 numpy 文件，csv_file_name 为目录名，数据按列分块写入目录下依次编号的 .npy 文件，每个文件为一个结构化数组
+
+                列式格式 (parquet/npy) 的列名与 csv 的标题行相同，价格不做精度格式化，没有数据时为 nan；其中 datetime 列为北京时间的 datetime64[ns] 类型
+
         Example::
 
             from datetime import datetime, date
@@ -122,11 +218,26 @@ class DataDownloader:
         if write_mode not in ["w", "a"]:
             raise Exception("write_mode 参数只支持 'w' ｜ 'a'")
         self._write_mode = write_mode
+        if output_format not in ["csv", "parquet", "npy"]:
+            raise Exception("output_format 参数只支持 'csv' ｜ 'parquet' ｜ 'npy'")
+        if output_format != "csv" and not isinstance(csv_file_name, str):
+            raise Exception(f"output_format 为 {output_format} 时 csv_file_name 参数只支持 str 类型")
+        if output_format == "parquet":
+            if write_mode == "a":
+                raise Exception("output_format 为 parquet 时不支持追加写入")
+            try:
+                import pyarrow.parquet
+            except ImportError:
+                raise Exception("输出 parquet 格式需要安装 pyarrow 包: pip install pyarrow") from None
+        self._output_format = output_format
         self._csv_header = self._get_headers()
         # 缓存合约对应的复权系数矩阵，每个合约只计算一次
         # 含义为截止 datetime 之前(不包含) 应使用 factor 复权
         self._dividend_cache = {}
         self._data_series = None
+        self._view_width = 2000  # 每次请求的数据窗口长度
+        self._bytes = 0  # 已下载的数据量，每个数值按 8 字节计算
+        self._batch = None  # 所属的 DataDownloaderBatch，由 DataDownloaderBatch 在创建下载器后设置
         self._task = self._api.create_task(self._run())
 
     def is_finished(self) -> bool:
@@ -179,8 +290,11 @@ class DataDownloader:
         if not self._task.done():
             return None
         if isinstance(self._csv_file_name, str):
-            if not self._data_series:
-                self._data_series = pandas.read_csv(self._csv_file_name)
+            if self._data_series is None:
+                if self._output_format == "csv":
+                    self._data_series = pandas.read_csv(self._csv_file_name)
+                else:
+                    self._data_series = _ColumnarWriter.read(self._csv_file_name, self._output_format)
             return self._data_series
         else:
             raise Exception('DataDownloader._get_data_series 接口仅支持 csv_file_name 參數为 str 时使用')
@@ -215,6 +329,13 @@ class DataDownloader:
             }
 
     async def _run(self):
+        if self._batch is None:
+            await self._download()
+        else:
+            async with self._batch._get_semaphore():
+                await self._download()
+
+    async def _download(self):
         self._quote_list = await self._api.get_quote_list(self._symbol_list)
         # 下载数据的 async generator
         gen = self._download_data()
@@ -226,13 +347,22 @@ class DataDownloader:
             cols = ["last_price", "highest", "lowest"]
             cols.extend(f"{x}{i}" for x in ["bid_price", "ask_price"] for i in range(1, 6))
         try:
-            if isinstance(self._csv_file_name, asyncio.StreamWriter):
-                writer = StreamWriter(self._csv_file_name)
+            if self._output_format != "csv":
+                writer = csv_writer = _ColumnarWriter(self._csv_file_name, self._output_format, self._csv_header,
+                                                      self._write_mode)
             else:
-                writer = open(self._csv_file_name, self._write_mode, newline='')
-            csv_writer = csv.writer(writer, dialect='excel')
-            if self._write_mode == "w":
-                csv_writer.writerow(self._csv_header)
+                if isinstance(self._csv_file_name, asyncio.StreamWriter):
+                    writer = StreamWriter(self._csv_file_name)
+                else:
+                    writer = open(self._csv_file_name, self._write_mode, newline='')
+                csv_writer = csv.writer(writer, dialect='excel')
+                if self._write_mode == "w":
+                    csv_writer.writerow(self._csv_header)
+            if self._output_format != "csv":
+                async for datetime_nano, values in gen:
+                    await self._adjust_columns(datetime_nano, values, cols)
+                    csv_writer.write(datetime_nano, values)
+                return
             async for item in gen:
                 for quote in self._quote_list:
                     symbol = quote.instrument_id
@@ -266,19 +396,36 @@ class DataDownloader:
             # https://docs.python.org/3/reference/expressions.html#agen.aclose
             await gen.aclose()
 
+    async def _adjust_columns(self, datetime_nano: np.ndarray, values: np.ndarray, cols: List[str]) -> None:
+        """列式输出时按列计算复权，与 csv 逐行计算的结果一致"""
+        for quote in self._quote_list:
+            if self._adj_type and quote.ins_class in ["STOCK", "FUND"]:
+                await self._ensure_dividend_factor(quote, int(datetime_nano[0]))
+                df = self._dividend_cache[quote.instrument_id]["df"]
+                # 每行使用该行之后第一条复权记录的复权因子
+                factor = df["factor"].values[np.searchsorted(df["datetime"].values, datetime_nano, side="right")]
+                for c in cols:
+                    values[:, self._csv_header.index(f"{quote.instrument_id}.{c}") - 2] *= factor
+
     async def _download_data(self):
-        """下载数据, 多合约横向按时间对齐"""
+        """
+        下载数据, 多合约横向按时间对齐
+
+        csv 格式每次返回一行数据；列式输出每次返回一个窗口中的数据 (datetime_nano, values)，直接从 K线 / Tick 的列式存储中按列取出，
+        values 为 header 中 datetime_nano 之后各列组成的 float64 二维数组
+        """
         chart_info = {
             "aid": "set_chart",
             "chart_id": _generate_uuid("PYSDK_downloader"),
             "ins_list": ",".join(self._symbol_list),
             "duration": self._dur_nano,
-            "view_width": 2000,
+            "view_width": self._view_width,
             "focus_datetime": self._start_dt_nano,
             "focus_position": 0,
         }
         # 还没有发送过任何请求, 先请求定位左端点
         await self._api._send_chan.send(chart_info)
+        request_time = time.time()
         chart = _get_obj(self._api._data, ["charts", chart_info["chart_id"]])
         current_id = None  # 当前数据指针
         data_cols = self._get_data_cols()
@@ -287,6 +434,12 @@ class DataDownloader:
             path = ["klines", symbol, str(self._dur_nano)] if self._dur_nano != 0 else ["ticks", symbol]
             serial = _get_obj(self._api._data, path)
             serials.append(serial)
+        stores = []
+        if self._output_format != "csv":
+            default = self._api._prototype["klines"]["*"]["*"]["data"]["@"] if self._dur_nano != 0 else \
+                self._api._prototype["ticks"]["*"]["data"]["@"]
+            # 与 TqApi._init_serial 一致，窗口最长为 10000 条，副合约在相同时间段内的数据条数可能多于主合约，所以预留更大的空间
+            stores = [_ensure_columnar(serial, default, 4 * 10000) for serial in serials]
         try:
             async with self._api.register_update_notify() as update_chan:
                 async for _ in update_chan:
@@ -301,6 +454,25 @@ class DataDownloader:
                     right_id = chart.get("right_id", -1)
                     if current_id is None:
                         current_id = max(left_id, 0)
+                    if stores and current_id <= right_id:
+                        # 列式输出按窗口批量取出数据，取完后 current_id 超过 right_id，不会进入下面逐行处理的循环
+                        ids = np.arange(current_id, right_id + 1, dtype=np.int64)
+                        datetime_nano, values, hit = stores[0]._take_fields(ids, data_cols)
+                        # 当前 id 已超出 last_id 或k线数据的时间已经超过用户限定的右端
+                        stop = ~hit | (datetime_nano == 0) | (datetime_nano > self._end_dt_nano)
+                        count = int(np.argmax(stop)) if stop.any() else len(ids)
+                        columns = [values[:count]]
+                        for i in range(1, len(self._symbol_list)):
+                            binding = serials[0].get("binding", {}).get(self._symbol_list[i], {})
+                            tids = np.array([binding.get(str(id), -1) for id in ids[:count].tolist()], dtype=np.int64)
+                            columns.append(stores[i]._take_fields(tids, data_cols)[1])
+                        if count > 0:
+                            self._bytes += 8 * count * (2 + len(data_cols) * len(self._symbol_list))
+                            yield datetime_nano[:count], np.hstack(columns)
+                            current_id += count
+                            self._current_dt_nano = int(datetime_nano[count - 1])
+                        if count < len(ids):
+                            return
                     while current_id <= right_id:
                         item = serials[0]["data"].get(str(current_id), {})
                         if item.get("datetime", 0) == 0 or item["datetime"] > self._end_dt_nano:
@@ -315,6 +487,7 @@ class DataDownloader:
                             k = {} if tid == -1 else serials[i]["data"].get(str(tid), {})
                             for col in data_cols:
                                 row.append(self._get_value(k, col, self._quote_list[i]["price_decs"]))
+                        self._bytes += 8 * len(row)
                         yield row
                         current_id += 1
                         self._current_dt_nano = item["datetime"]
@@ -322,7 +495,12 @@ class DataDownloader:
                     chart_info.pop("focus_datetime", None)
                     chart_info.pop("focus_position", None)
                     chart_info["left_kline_id"] = current_id
+                    if self._batch is not None:
+                        # 批量下载时根据上一个窗口的耗时调整窗口长度
+                        self._view_width = self._batch._next_view_width(self._view_width, time.time() - request_time)
+                        chart_info["view_width"] = self._view_width
                     await self._api._send_chan.send(chart_info)
+                    request_time = time.time()
         finally:
             # 释放chart资源
             await self._api._send_chan.send({
@@ -330,7 +508,7 @@ class DataDownloader:
                 "chart_id": chart_info["chart_id"],
                 "ins_list": "",
                 "duration": self._dur_nano,
-                "view_width": 2000,
+                "view_width": self._view_width,
             })
 
     def _get_headers(self):
@@ -368,3 +546,101 @@ class DataDownloader:
         # 这里为了保留 nano 精度，没有用 datetime._timestamp_nano_to_str
         dt = datetime.fromtimestamp(nano // 1000000000, tz=_cst_tz)
         return "%d-%02d-%02d %02d:%02d:%02d.%09d" % (dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second, int(nano) % 1000000000)
+
+
+class DataDownloaderBatch(object):
+    """
+    批量历史数据下载器，使用同一个 TqApi 下载多组数据
+
+    * 同时进行下载的任务数不超过 max_concurrency，其余任务排队等待
+    * 每个任务请求数据的窗口长度根据上一个窗口的耗时在 500 ~ 10000 之间自动调整
+    * 提供全部任务的总体下载进度及下载速度
+
+    Example::
+
+        from datetime import date
+        from contextlib import closing
+        from tqsdk import TqApi, TqAuth
+        from tqsdk.tools import DataDownloaderBatch
+
+        api = TqApi(auth=TqAuth("快期账户", "账户密码"))
+        jobs = [{"symbol_list": s, "dur_sec": 60, "start_dt": date(2020, 1, 1), "end_dt": date(2020, 12, 31),
+                 "csv_file_name": f"{s}.parquet", "output_format": "parquet"}
+                for s in ["SHFE.cu2101", "SHFE.cu2102", "SHFE.cu2103", "SHFE.cu2104"]]
+        batch = DataDownloaderBatch(api, jobs, max_concurrency=2)
+        with closing(api):
+            while not batch.is_finished():
+                api.wait_update()
+                print(f"progress: {batch.get_progress():.2f}%, speed: {batch.get_speed() / 1024:.1f} KB/s")
+    """
+
+    MIN_VIEW_WIDTH = 500
+    MAX_VIEW_WIDTH = 10000
+
+    def __init__(self, api: TqApi, jobs: List[dict], max_concurrency: int = 4) -> None:
+        """
+        创建批量历史数据下载器实例
+
+        Args:
+            api (TqApi): TqApi实例，所有任务都使用该 api 下载数据
+
+            jobs (list of dict): 下载任务列表，每个任务为 DataDownloader 的参数 (除 api 以外)，\
+            例如 {"symbol_list": "SHFE.cu2101", "dur_sec": 60, "start_dt": date(2020, 1, 1), "end_dt": date(2020, 12, 31), "csv_file_name": "cu2101.csv"}
+
+            max_concurrency (int): [可选]同时下载的任务数上限，默认为 4
+        """
+        if max_concurrency < 1:
+            raise Exception("max_concurrency 参数必须大于 0")
+        self._api = api
+        self._max_concurrency = max_concurrency
+        self._semaphore = None
+        self._start_time = time.time()
+        self.downloaders = []
+        for job in jobs:
+            downloader = DataDownloader(api, **job)
+            downloader._batch = self  # 下载任务在下一次事件循环中才开始执行，此时已经设置好 _batch
+            self.downloaders.append(downloader)
+
+    def is_finished(self) -> bool:
+        """
+        判断是否全部任务都已下载完成
+
+        Returns:
+            bool: 如果全部任务下载完成则返回 True, 否则返回 False.
+        """
+        return all(d.is_finished() for d in self.downloaders)
+
+    def get_progress(self) -> float:
+        """
+        获得全部任务的总体下载进度百分比，为各个任务下载进度的平均值
+
+        Returns:
+            float: 下载进度,100表示下载完成
+        """
+        if not self.downloaders:
+            return 100.0
+        return sum(d.get_progress() for d in self.downloaders) / len(self.downloaders)
+
+    def get_speed(self) -> float:
+        """
+        获得开始下载以来的平均下载速度
+
+        Returns:
+            float: 每秒下载的数据量 (bytes/s)，每个数值按 8 字节计算
+        """
+        elapsed = time.time() - self._start_time
+        return sum(d._bytes for d in self.downloaders) / elapsed if elapsed > 0 else 0.0
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # 在事件循环中创建，保证 Semaphore 绑定的是 api 的事件循环
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        return self._semaphore
+
+    def _next_view_width(self, view_width: int, elapsed: float) -> int:
+        """上一个窗口 1 秒内完成时窗口长度加倍，超过 5 秒时减半"""
+        if elapsed < 1:
+            return min(view_width * 2, self.MAX_VIEW_WIDTH)
+        if elapsed > 5:
+            return max(view_width // 2, self.MIN_VIEW_WIDTH)
+        return view_width
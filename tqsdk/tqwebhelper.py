@@ -16,7 +16,7 @@ from tqsdk.tradeable.sim.basesim import BaseSim
 
 from tqsdk.auth import TqAuth
 from tqsdk.backtest import TqBacktest, TqReplay
-from tqsdk.channel import TqChan
+from tqsdk.channel import TqChan, TqPipeChan
 from tqsdk.datetime import _get_trading_day_start_time, _datetime_to_timestamp_nano
 from tqsdk.diff import _simple_merge_diff
 from tqsdk.tradeable import TqAccount, TqKq, TqSim
@@ -71,6 +71,16 @@ class TqWebHelper(object):
             self._http_server_host = ip if ip else "0.0.0.0"
             self._http_server_port = int(port) if port else 0
 
+    def _pipe(self, web_send_chan):
+        """
+        没有开启 web_gui 功能时的同步模式，不创建 task，返回下游应该发送数据的 channel，过滤出 set_chart_data 后发到 web_send_chan；
+        上游发送的数据包原样转发，应该直接发到下游
+        """
+        def handler(pack):
+            if pack['aid'] not in ['set_chart_data', 'set_report_data']:
+                web_send_chan.send_nowait(pack)
+        return TqPipeChan(self._api, handler, chan_name="pipe to web_helper")
+
     async def _run(self, api_send_chan, api_recv_chan, web_send_chan, web_recv_chan):
         if not self._api._web_gui:
             # 没有开启 web_gui 功能
@@ -147,7 +157,7 @@ class TqWebHelper(object):
                                 web_diff['subscribed'].append({"symbol": item[0], "dur_nano": item[1] * 1000000000})
                             for item in self._api._requests["ticks"].keys():
                                 web_diff['subscribed'].append({"symbol": item[0], "dur_nano": 0})
-                            for symbol in self._api._requests["quotes"]:
+                            for symbol in self._api._quote_subscribe.symbols:
                                 web_diff['subscribed'].append({"symbol": symbol})
                             for symbol in self._order_symbols:
                                 web_diff['subscribed'].append({"symbol": symbol})
@@ -232,11 +242,10 @@ class TqWebHelper(object):
         return diffs
 
     def send_to_conn_chan(self, chan, diffs):
-        last_diff = chan.recv_latest({})
-        for d in diffs:
-            _simple_merge_diff(last_diff, d)
-        if last_diff != {}:
-            chan.send_nowait(last_diff)
+        # conn_chan 中最多保存一个 rtn_data，web 端没有取走之前新的 diff 会合并进去
+        diffs = [d for d in diffs if d]
+        if diffs:
+            chan.send_nowait({"aid": "rtn_data", "data": diffs})
 
     def dt_func (self):
         # 回测和复盘模式，用 _api._account 一定是 TqSim, 使用 TqSim _get_current_timestamp() 提供的时间
@@ -264,10 +273,10 @@ class TqWebHelper(object):
                           not k.startswith("_")}
         }
 
-    def get_send_msg(self, data=None):
+    def get_send_msg(self, data=None, datas=None):
         return simplejson.dumps({
             'aid': 'rtn_data',
-            'data': [self._data if data is None else data]
+            'data': datas if datas is not None else [self._data if data is None else data]
         }, ignore_nan=True, default=TqWebHelper._convert)
 
     async def connection_handler(self, request):
@@ -275,14 +284,14 @@ class TqWebHelper(object):
         await ws.prepare(request)
         send_msg = self.get_send_msg(self._data)
         await ws.send_str(send_msg)
-        conn_chan = TqChan(self._api, last_only=True)
+        conn_chan = TqChan(self._api, maxsize=1, policy="coalesce")
         self._conn_diff_chans.add(conn_chan)
         try:
             async for msg in ws:
                 pack = simplejson.loads(msg.data)
                 if pack["aid"] == 'peek_message':
-                    last_diff = await conn_chan.recv()
-                    send_msg = self.get_send_msg(last_diff)
+                    last_pack = await conn_chan.recv()
+                    send_msg = self.get_send_msg(datas=last_pack["data"])
                     await ws.send_str(send_msg)
         except Exception as e:
             await conn_chan.close()
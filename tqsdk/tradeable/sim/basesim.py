@@ -15,6 +15,7 @@ from tqsdk.datetime import _get_trading_day_from_timestamp, _get_trading_day_end
 from tqsdk.diff import _get_obj, _register_update_chan, _merge_diff
 from tqsdk.entity import Entity
 from tqsdk.objs import Quote
+from tqsdk.subscribe import QuoteSubscribeManager
 from tqsdk.tradeable.tradeable import Tradeable
 from tqsdk.tradeable.sim.trade_future import SimTrade
 from tqsdk.tradeable.sim.trade_stock import SimTradeStock
@@ -72,7 +73,7 @@ class BaseSim(Tradeable):
         self._pending_subscribe_downstream = False
         # True 发给上游 subscribe，但是没有收到过回复；False 如果行情不变，上游不会回任何包
         self._pending_subscribe_upstream = False
-        self._all_subscribe = set()  # 客户端+模拟交易模块订阅的合约集合
+        self._quote_subscribe = QuoteSubscribeManager()  # 客户端+模拟交易模块订阅的合约
         # 是否已经发送初始账户信息
         self._has_send_init_account = False
         try:
@@ -90,7 +91,12 @@ class BaseSim(Tradeable):
         """
         self._pending_subscribe_upstream = False
         if pack["aid"] == "rtn_data":
-            self._md_recv(pack)  # md_recv 中会发送 wait_count 个 quotes 包给各个 quote_chan
+            if self._api._latency_stats:
+                start_time = time.perf_counter()
+                self._md_recv(pack)  # md_recv 中会发送 wait_count 个 quotes 包给各个 quote_chan
+                self._api._latency_stats.record("TqSim._md_recv", time.perf_counter() - start_time)
+            else:
+                self._md_recv(pack)  # md_recv 中会发送 wait_count 个 quotes 包给各个 quote_chan
             await asyncio.gather(*[quote_task["quote_chan"].join() for quote_task in self._quote_tasks.values()])
         if self._tqsdk_backtest != {} and self._tqsdk_backtest["current_dt"] >= self._tqsdk_backtest["end_dt"]:
             # 回测情况下，把 _handle_stat_report 在循环中回测结束时执行
@@ -118,8 +124,9 @@ class BaseSim(Tradeable):
                 for symbol in self._quote_tasks:
                     await self._quote_tasks[symbol]["order_chan"].send(pack)
         elif pack["aid"] == "subscribe_quote":
-            # 这里只会增加订阅合约，不会退订合约
-            await self._subscribe_quote(set(pack["ins_list"].split(",")))
+            # 下游发来的是全量订阅列表，下游退订的合约如果模拟交易模块没有用到，也会向上游退订
+            if self._quote_subscribe.set_source("downstream", pack["ins_list"].split(",")):
+                await self._on_subscribe_changed()
         else:
             await self._md_send_chan.send(pack)
 
@@ -128,25 +135,27 @@ class BaseSim(Tradeable):
             await self._send_subscribe_quote()
 
     async def _subscribe_quote(self, symbols: [set, str]):
+        """模拟交易模块自身订阅的合约，不会退订"""
+        symbols = symbols if isinstance(symbols, set) else {symbols}
+        if self._quote_subscribe.add(symbols):
+            await self._on_subscribe_changed()
+
+    async def _on_subscribe_changed(self):
         """
-        这里只会增加订阅合约，不会退订合约
+        订阅列表有变化时，如果下游在等待数据并且上游已经回复了上一个订阅请求，立即发出，否则等到下一次下游 peek_message 时合并发出
         todo: 这里用到了 self._pending_peek ，父类的内部变量
         """
-        symbols = symbols if isinstance(symbols, set) else {symbols}
-        if symbols - self._all_subscribe:
-            self._all_subscribe |= symbols
-            if self._pending_peek and not self._pending_subscribe_upstream:
-                await self._send_subscribe_quote()
-            else:
-                self._pending_subscribe_downstream = True
+        if self._pending_peek and not self._pending_subscribe_upstream:
+            await self._send_subscribe_quote()
+        else:
+            self._pending_subscribe_downstream = True
 
     async def _send_subscribe_quote(self):
-        self._pending_subscribe_upstream = True
         self._pending_subscribe_downstream = False
-        await self._md_send_chan.send({
-            "aid": "subscribe_quote",
-            "ins_list": ",".join(self._all_subscribe)
-        })
+        pack = self._quote_subscribe.make_pack()
+        if pack:
+            self._pending_subscribe_upstream = True
+            await self._md_send_chan.send(pack)
 
     def _handle_stat_report(self):
         if self.tqsdk_stat:
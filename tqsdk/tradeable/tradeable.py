@@ -11,6 +11,8 @@ from tqsdk.baseModule import TqModule
 
 class Tradeable(ABC, TqModule):
 
+    _trade_pack_aids = ("insert_order", "cancel_order", "set_risk_management_rule", "pre_insert_order")  # 需要指定账户的交易请求
+
     def __init__(self):
         self._account_key = self._get_account_key()  # 每个账户的唯一标识，在账户初始化时就确定下来，后续只读不写
 
@@ -42,7 +44,7 @@ class Tradeable(ABC, TqModule):
 
     def _is_self_trade_pack(self, pack):
         """是否是当前交易实例应该处理的交易包"""
-        if pack["aid"] in ["insert_order", "cancel_order", "set_risk_management_rule", "pre_insert_order"]:
+        if pack["aid"] in Tradeable._trade_pack_aids:
             assert "account_key" in pack, "发给交易请求的包必须包含 account_key"
             if pack["account_key"] != self._account_key:
                 return False
@@ -18,6 +18,7 @@ from tqsdk.ins_schema import ins_schema, _add_all_frags
 from tqsdk.tafunc import get_dividend_df
 
 RD = random.Random(secrets.randbits(128))  # 初始化随机数引擎，使用随机数作为seed，防止用户同时拉起多个策略，产生同样的 seed
+_QUERY_BATCH_SIZE = 2000  # 批量查询合约信息时每个 ins_query 请求最多包含的合约个数，2000 个合约的请求长度约 35000
 
 
 def _reinit_rd():
@@ -43,15 +44,16 @@ def _query_for_quote(symbol, single_symbol_set) -> List[Dict]:
     用户请求合约信息一定是 PYSDK_api 开头的请求，因为用户请求的合约信息在回测时带有 timestamp 参数，是不应该调用此函数的
     即：以 PYSDK_quote_ 开头的 query_id 都是 sdk 主动请求合约信息
     对于在 single_symbol_set 合约表中的待查询合约逐个查询, 即每个查询请求只查询一个合约
-    对于不在 single_symbol_set 的合约表中的待查询合约批量查询一次
+    对于不在 single_symbol_set 的合约表中的待查询合约批量查询, 每 _QUERY_BATCH_SIZE 个合约一个查询请求
     """
     results = []
     symbol_list = symbol if isinstance(symbol, list) else [symbol]
-    batch_set = set(symbol_list) - single_symbol_set
-    single_set = set(symbol_list) - batch_set
-    if batch_set:
+    batch_list = [s for s in dict.fromkeys(symbol_list) if s not in single_symbol_set]
+    single_set = set(symbol_list) - set(batch_list)
+    # 批量查询时每个请求最多包含 _QUERY_BATCH_SIZE 个合约，避免请求长度超过服务器的限制
+    for i in range(0, len(batch_list), _QUERY_BATCH_SIZE):
         op = Operation(ins_schema.rootQuery)
-        query = op.multi_symbol_info(instrument_id=list(batch_set))
+        query = op.multi_symbol_info(instrument_id=batch_list[i:i + _QUERY_BATCH_SIZE])
         _add_all_frags(query)
         results.append({
             "aid": "ins_query",
@@ -123,11 +125,16 @@ night_trading_table = {
 def _quotes_add_night(quotes):
     """为 quotes 中应该有夜盘但是市价合约文件中没有夜盘的品种，添加夜盘时间"""
     for symbol in quotes:
-        product_id = quotes[symbol].get("product_id")
-        if quotes[symbol].get("trading_time") and product_id:
-            key = f"{quotes[symbol].get('exchange_id')}.{product_id}"
-            if key in night_trading_table and (not quotes[symbol]["trading_time"].get("night")):
-                quotes[symbol]["trading_time"]["night"] = [night_trading_table[key]]
+        _quote_add_night(quotes[symbol])
+
+
+def _quote_add_night(quote):
+    """为应该有夜盘但是市价合约文件中没有夜盘的合约，添加夜盘时间"""
+    product_id = quote.get("product_id")
+    if quote.get("trading_time") and product_id:
+        key = f"{quote.get('exchange_id')}.{product_id}"
+        if key in night_trading_table and (not quote["trading_time"].get("night")):
+            quote["trading_time"]["night"] = [night_trading_table[key]]
 
 
 def _bisect_value(a, x, priority="right"):